@@ -1,4 +1,4 @@
-import { apiCall } from "./utils";
+import { apiCall, fetchAllPages } from "./utils";
 import axiosInstance from "./axios-instance";
 import type { APIResponse } from "@/types";
 import type { Assignment } from "@/types";
@@ -18,8 +18,21 @@ export type GetSubmissionsResponse = {
   submitted_at: string;
   score: number | null;
   is_hand_written: boolean;
+  needs_manual_grading: boolean;
 }[];
-export type AutoCheckResponse = object;
+export type AutoCheckJob = {
+  id: number;
+  assignment: number;
+  status: "pending" | "running" | "completed";
+  total_tasks: number;
+  completed_tasks: number;
+  failed_tasks: number;
+  progress: number;
+  created_at: string;
+  started_at: string | null;
+  finished_at: string | null;
+};
+export type AutoCheckResponse = AutoCheckJob;
 export type ResetScoresResponse = {
   detail: string;
   assignment_id: number;
@@ -38,6 +51,7 @@ export type MarkSubmissionResponse = {
   submitted_at: string;
   score: number;
   is_hand_written: boolean;
+  needs_manual_grading: boolean;
 };
 
 export async function getAssignment(
@@ -74,7 +88,9 @@ export async function getAssignmentSubmissions(
   assignmentId: number
 ): APIResponse<GetSubmissionsResponse> {
   return apiCall<GetSubmissionsResponse>(() =>
-    axiosInstance.get(`assignments/submissions/${assignmentId}/`)
+    fetchAllPages<GetSubmissionsResponse[number]>(
+      `assignments/submissions/${assignmentId}/`
+    )
   );
 }
 
@@ -82,7 +98,7 @@ export async function autoCheckAssignment(
   assignmentId: number,
   classId: number
 ): APIResponse<AutoCheckResponse> {
-  return apiCall<GetSubmissionsResponse>(() =>
+  return apiCall<AutoCheckResponse>(() =>
     axiosInstance.post(
       `assignments/${assignmentId}/class/${classId}/auto-check/`,
       {}
@@ -90,6 +106,14 @@ export async function autoCheckAssignment(
   );
 }
 
+export async function getAutoCheckJob(
+  jobId: number
+): APIResponse<AutoCheckJob> {
+  return apiCall<AutoCheckJob>(() =>
+    axiosInstance.get(`assignments/auto-check/jobs/${jobId}/`)
+  );
+}
+
 export async function resetSubmissionScores(
   assignmentId: number
 ): APIResponse<ResetScoresResponse> {
@@ -106,3 +130,18 @@ export async function markSubmission(
     axiosInstance.patch(`assignments/mark/${submissionId}/`, { score })
   );
 }
+
+export type SubmissionScore = { submission_id: number; score: number };
+export type MarkSubmissionsResponse = {
+  updated: number;
+  submissions: GetSubmissionsResponse;
+};
+
+export async function markSubmissions(
+  assignmentId: number,
+  scores: SubmissionScore[]
+): APIResponse<MarkSubmissionsResponse> {
+  return apiCall<MarkSubmissionsResponse>(() =>
+    axiosInstance.post(`assignments/${assignmentId}/mark/`, { scores })
+  );
+}
@@ -1,4 +1,4 @@
-import { apiCall } from "./utils";
+import { apiCall, fetchAllPages } from "./utils";
 import axiosInstance from "./axios-instance";
 import type { APIResponse, Class, ClassDetails } from "@/types";
 import type { ClassPayload } from "@/components/pages/CreateClass";
@@ -18,7 +18,7 @@ export async function createClass(
 }
 
 export async function getClasses(): APIResponse<GetClassesResponse> {
-  return apiCall<GetClassesResponse>(() => axiosInstance.get("classes/"));
+  return apiCall<GetClassesResponse>(() => fetchAllPages<Class>("classes/"));
 }
 
 export async function getClass(id: number): APIResponse<GetClassResponse> {
@@ -1,5 +1,6 @@
 import type { APIError, APIResponse, Result } from "@/types";
 import { AxiosError } from "axios";
+import axiosInstance from "./axios-instance";
 
 const statusMessages: Record<number, string> = {
     400: "Bad request. Please check your input.",
@@ -32,6 +33,25 @@ export async function apiCall<T>(fn: () => Promise<{ data: any }>): APIResponse<
     }
 }
 
+type CursorPage<T> = {
+    next: string | null;
+    previous: string | null;
+    results: T[];
+};
+
+// Follows the `next` cursor links of a paginated listing and concatenates
+// all pages, so callers keep receiving a plain array
+export async function fetchAllPages<T>(url: string): Promise<{ data: T[] }> {
+    const items: T[] = [];
+    let next: string | null = url;
+    while (next) {
+        const response: { data: CursorPage<T> } = await axiosInstance.get(next);
+        items.push(...response.data.results);
+        next = response.data.next;
+    }
+    return { data: items };
+}
+
 export function handleError<T>(data: any): Result<T, APIError> {
     if ("error" in data)
         return failure(data.error)
@@ -10,6 +10,7 @@ import {
   autoCheckAssignment,
   getAssignment,
   getAssignmentSubmissions,
+  getAutoCheckJob,
   resetSubmissionScores,
   markSubmission,
 } from "@/api/assignments";
@@ -46,6 +47,7 @@ type Submission = {
   submitted_at: string;
   score: number | null;
   is_hand_written: boolean;
+  needs_manual_grading: boolean;
 };
 
 export default function AssignmentDetailsPage() {
@@ -146,8 +148,21 @@ export default function AssignmentDetailsPage() {
       Number(assignmentId || "-1"),
       Number(classId || "-1")
     ).then((result) => {
-      if (result.ok) window.location.reload();
-      else toast.error(result.error);
+      if (result.ok) {
+        toast.info("Auto-check started. Submissions are being graded...");
+        pollAutoCheckJob(result.value.id);
+      } else toast.error(result.error);
+    });
+  }
+
+  function pollAutoCheckJob(jobId: number) {
+    getAutoCheckJob(jobId).then((result) => {
+      if (!result.ok) {
+        toast.error(result.error);
+        return;
+      }
+      if (result.value.status === "completed") window.location.reload();
+      else setTimeout(() => pollAutoCheckJob(jobId), 3000);
     });
   }
 
@@ -568,6 +583,15 @@ export default function AssignmentDetailsPage() {
                                   Score: {submission.score}
                                 </Badge>
                               )}
+                              {submission.score === null &&
+                                submission.needs_manual_grading && (
+                                  <Badge
+                                    variant="destructive"
+                                    className="text-xs"
+                                  >
+                                    Needs manual grading
+                                  </Badge>
+                                )}
                             </div>
                           </div>
                         </div>
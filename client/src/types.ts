@@ -66,6 +66,7 @@ export type Assignment = {
   task_file: string;
   solution_file: string;
   submission_count: number;
+  graded_count: number | null;
   submitted: boolean;
   user_submission?: {
     id: number;
@@ -0,0 +1,27 @@
+from django.contrib.auth import get_user_model
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.models import TokenUser
+
+User = get_user_model()
+
+
+class ClaimsUser(TokenUser):
+    """
+    The user of an access token, read from its claims (id, role, name and
+    email, see CustomTokenObtainPairSerializer) without a query. Any other
+    attribute loads the CustomUser row once, on first access, so tokens
+    issued without these claims keep working. Query by `user.id`
+    (`teacher_id=user.id`), as the ORM does not accept this object in place
+    of a model instance.
+    """
+
+    @cached_property
+    def db_user(self):
+        return User.objects.get(id=self.id)
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        if attr in self.token:
+            return self.token[attr]
+        return getattr(self.db_user, attr)
@@ -1,3 +1,138 @@
-from django.test import TestCase
+from rest_framework_simplejwt.tokens import RefreshToken
 
-# Create your tests here.
+from accounts.tokens import CustomTokenObtainPairSerializer
+from server.testing import EndpointBudgetTestCase, seed_classroom, seed_users
+
+
+class AccountEndpointBudgetTests(EndpointBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = seed_users("teacher", 1, "acct")[0]
+        cls.teacher.set_password("secret-password")
+        cls.teacher.save()
+        cls.students = seed_users("student", 40, "accs")
+        cls.classroom = seed_classroom(
+            cls.teacher, cls.students, assignments=5, prefix="acc"
+        )
+
+    def bearer(self, user, token=None):
+        if token is None:
+            token = CustomTokenObtainPairSerializer.get_token(user).access_token
+        return {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+
+    def test_register(self):
+        self.assertWithinBudget(
+            None,
+            "post",
+            "/accounts/register/",
+            max_queries=3,
+            status_code=201,
+            data={
+                "name": "New Student",
+                "email": "new-student@example.com",
+                "password": "secret-password",
+                "role": "student",
+            },
+        )
+
+    def test_login(self):
+        response, _ = self.assertWithinBudget(
+            None,
+            "post",
+            "/accounts/login/",
+            max_queries=1,
+            data={"email": self.teacher.email, "password": "secret-password"},
+        )
+        self.assertEqual(response.data["role"], "teacher")
+
+    def test_refresh(self):
+        refresh = CustomTokenObtainPairSerializer.get_token(self.teacher)
+        response, _ = self.assertWithinBudget(
+            None,
+            "post",
+            "/accounts/refresh/",
+            max_queries=1,
+            data={"refresh": str(refresh)},
+        )
+        self.assertEqual(response.data["role"], "teacher")
+
+    def test_refresh_of_token_without_role(self):
+        refresh = RefreshToken.for_user(self.teacher)
+        response, _ = self.assertWithinBudget(
+            None,
+            "post",
+            "/accounts/refresh/",
+            max_queries=2,
+            data={"refresh": str(refresh)},
+        )
+        self.assertEqual(response.data["role"], "teacher")
+
+    def test_current_user_from_token_claims(self):
+        response, _ = self.assertWithinBudget(
+            None, "get", "/accounts/", max_queries=0, **self.bearer(self.teacher)
+        )
+        self.assertEqual(
+            response.data["user"],
+            {
+                "id": self.teacher.id,
+                "name": self.teacher.name,
+                "email": self.teacher.email,
+                "role": "teacher",
+            },
+        )
+
+    def test_token_without_claims_loads_the_user(self):
+        token = RefreshToken.for_user(self.students[0]).access_token
+        response, _ = self.assertWithinBudget(
+            None,
+            "get",
+            "/accounts/",
+            max_queries=1,
+            **self.bearer(self.students[0], token),
+        )
+        self.assertEqual(response.data["user"]["role"], "student")
+
+    def test_token_authenticated_requests_need_no_user_lookup(self):
+        self.assertWithinBudget(
+            None, "get", "/classes/", max_queries=1, **self.bearer(self.teacher)
+        )
+        self.assertWithinBudget(
+            None,
+            "post",
+            "/classes/create/",
+            max_queries=2,
+            status_code=201,
+            data={"name": "Algebra", "subject": "Algebra", "section": "A"},
+            **self.bearer(self.teacher),
+        )
+        self.assertWithinBudget(
+            None,
+            "get",
+            f"/classes/{self.classroom.id}/",
+            max_queries=4,
+            **self.bearer(self.students[0]),
+        )
+        self.assertWithinBudget(
+            None,
+            "get",
+            "/accounts/",
+            max_queries=0,
+            status_code=401,
+            HTTP_AUTHORIZATION="Bearer invalid",
+        )
+
+    def test_current_user_as_teacher(self):
+        self.assertFlatQueries(
+            self.teacher,
+            "/accounts/",
+            max_queries=0,
+            grow=lambda: seed_users("student", 200, "accg"),
+        )
+
+    def test_current_user_as_student(self):
+        self.assertFlatQueries(
+            self.students[0],
+            "/accounts/",
+            max_queries=0,
+            grow=lambda: seed_users("student", 200, "accg"),
+        )
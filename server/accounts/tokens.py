@@ -8,7 +8,10 @@ class CustomTokenObtainPairSerializer(TokenObtainPairSerializer):
     @classmethod
     def get_token(cls, user):
         token = super().get_token(user)
+        # Read by ClaimsUser, so that requests need no user lookup
         token["role"] = user.role
+        token["name"] = user.name
+        token["email"] = user.email
         return token
 
     def validate(self, attrs):
@@ -20,8 +23,10 @@ class CustomTokenRefreshSerializer(TokenRefreshSerializer):
     def validate(self, attrs):
         data = super().validate(attrs)
         refresh = RefreshToken(attrs["refresh"])
-        user_id = refresh["user_id"]
-        from accounts.models import CustomUser
-        user = CustomUser.objects.get(id=user_id)
-        data["role"] = user.role
+        role = refresh.get("role")
+        if role is None:
+            # Issued before the role was added to the claims
+            from accounts.models import CustomUser
+            role = CustomUser.objects.get(id=refresh["user_id"]).role
+        data["role"] = role
         return data
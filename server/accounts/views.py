@@ -2,7 +2,6 @@ from rest_framework.request import Request
 from rest_framework.views import APIView, Response, status
 from rest_framework.permissions import IsAuthenticated
 from django.forms.models import model_to_dict
-from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 from accounts.serializers import RegisterUserSerializer, UserSerializer
@@ -25,7 +24,7 @@ class RegisterUser(APIView):
         serializer = RegisterUserSerializer(data=request.data)
         if serializer.is_valid():
             user = serializer.save()
-            refresh = RefreshToken.for_user(user)
+            refresh = CustomTokenObtainPairSerializer.get_token(user)
             return Response(
                 {
                     "refresh": str(refresh),
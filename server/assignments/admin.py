@@ -1,5 +1,23 @@
 from django.contrib import admin
 
-from assignments.models import Assignment, Submission
+from assignments.models import (
+    Assignment,
+    AutoCheckJob,
+    AutoCheckTask,
+    ExtractedText,
+    GradingResult,
+    OCRResult,
+    Submission,
+)
 
-admin.site.register([Assignment, Submission])
+admin.site.register(
+    [
+        Assignment,
+        Submission,
+        AutoCheckJob,
+        AutoCheckTask,
+        GradingResult,
+        OCRResult,
+        ExtractedText,
+    ]
+)
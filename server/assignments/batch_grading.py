@@ -0,0 +1,127 @@
+import json
+import mimetypes
+
+from assignments import budget, prompts, reference_cache
+
+# Completion tokens reserved per submission in a batched response
+TOKENS_PER_SCORE = 40
+
+
+def guess_mime_type(file_field) -> str:
+    mime_type, _ = mimetypes.guess_type(file_field.name)
+    return mime_type or "application/octet-stream"
+
+
+def build_batch_prompt(assignment, submissions) -> list[dict]:
+    """
+    Prompt grading several submissions at once. The task and reference
+    solution are sent a single time, followed by each submission labelled
+    with its id.
+    """
+    builder = submissions[0].build_content_part
+    prompt_parts = [
+        {
+            "type": "text",
+            "text": prompts.grading_instructions(assignment, len(submissions)),
+        },
+        {"type": "text", "text": "Assignment Task:"},
+        reference_cache.get_reference_part(
+            assignment,
+            "task",
+            assignment.task_file,
+            guess_mime_type(assignment.task_file),
+            builder,
+        ),
+        {"type": "text", "text": "Reference Solution:"},
+        reference_cache.get_reference_part(
+            assignment,
+            "solution",
+            assignment.solution_file,
+            guess_mime_type(assignment.solution_file),
+            builder,
+        ),
+    ]
+
+    for submission in submissions:
+        submission_mime_type, _ = mimetypes.guess_type(submission.submitted_file.name)
+        predicted_text = ""
+        try:
+            predicted_text = submission.handle_ocr_prediction(submission_mime_type)
+        except Exception as e:
+            print(
+                f"OCR failed for submission {submission.id}, continuing without OCR text: {e}"
+            )
+
+        prompt_parts.append(
+            {
+                "type": "text",
+                "text": f"Student Submission (submission_id {submission.id}):",
+            }
+        )
+        submission.add_content_part(
+            prompt_parts,
+            guess_mime_type(submission.submitted_file),
+            submission.submitted_file,
+            grayscale=submission.is_hand_written,
+        )
+        if submission.is_hand_written and predicted_text:
+            prompt_parts.append(
+                {
+                    "type": "text",
+                    "text": (
+                        f"OCR extracted text from handwritten submission {submission.id}:\n"
+                        f"{predicted_text}"
+                    ),
+                }
+            )
+    return prompt_parts
+
+
+def parse_batch_scores(
+    output_text: str, submission_ids, max_score: float
+) -> dict[int, float]:
+    """
+    Read the per-submission scores out of the model output. Entries that are
+    missing or malformed are left out so they can be graded individually.
+    """
+    start = output_text.find("{")
+    end = output_text.rfind("}")
+    if start == -1 or end < start:
+        return {}
+    try:
+        entries = json.loads(output_text[start : end + 1]).get("scores", [])
+    except (ValueError, AttributeError):
+        return {}
+    if not isinstance(entries, list):
+        return {}
+
+    expected_ids = set(submission_ids)
+    scores = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        try:
+            submission_id = int(entry["submission_id"])
+            score = float(entry["score"])
+        except (KeyError, TypeError, ValueError):
+            continue
+        if submission_id in expected_ids:
+            scores[submission_id] = max(0.0, min(score, float(max_score)))
+    return scores
+
+
+def grade_batch(assignment, submissions) -> dict[int, float]:
+    """Grade submissions of one assignment in a single chat completion."""
+    prompt_parts = build_batch_prompt(assignment, submissions)
+    if budget.estimate_prompt_tokens(prompt_parts) > assignment.get_token_budget():
+        # Too large together; each submission goes through the single path,
+        # which truncates or flags it on its own
+        return {}
+    response = submissions[0].make_openrouter_prediction(
+        prompt_parts, max_tokens=TOKENS_PER_SCORE * len(submissions) + 50
+    )
+    response.raise_for_status()
+    output_text = submissions[0].extract_openrouter_text(response.json())
+    return parse_batch_scores(
+        output_text, [submission.id for submission in submissions], assignment.max_score
+    )
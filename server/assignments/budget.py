@@ -0,0 +1,135 @@
+import base64
+import binascii
+import io
+import math
+
+from django.conf import settings
+from PIL import Image, UnidentifiedImageError
+
+# OpenAI-style vision pricing: a base cost plus a cost per 512px tile after
+# the image is fit into 2048x2048 and its short side scaled down to 768
+IMAGE_BASE_TOKENS = 85
+IMAGE_TILE_TOKENS = 170
+
+# Bytes of base64 decoded to read an image's dimensions from its header
+IMAGE_HEADER_B64_CHARS = 64 * 1024
+
+BASE64_PART_PREFIX = "File ("
+
+# Room left in a truncated part for the omission marker
+TRUNCATION_MARKER_CHARS = 100
+
+
+class PromptTooLarge(Exception):
+    pass
+
+
+def estimate_text_tokens(text: str) -> int:
+    return math.ceil(len(text) / settings.GRADING_CHARS_PER_TOKEN)
+
+
+def _image_size(data_url: str) -> tuple[int, int] | None:
+    encoded = data_url.partition(",")[2][:IMAGE_HEADER_B64_CHARS]
+    try:
+        header = base64.b64decode(encoded[: len(encoded) - len(encoded) % 4])
+        return Image.open(io.BytesIO(header)).size
+    except (binascii.Error, UnidentifiedImageError, OSError):
+        return None
+
+
+def estimate_image_tokens(data_url: str) -> int:
+    size = _image_size(data_url)
+    if size is None:
+        width = height = settings.GRADING_IMAGE_MAX_DIMENSION
+    else:
+        width, height = size
+
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return IMAGE_BASE_TOKENS + IMAGE_TILE_TOKENS * tiles
+
+
+def estimate_part_tokens(part: dict) -> int:
+    if part.get("type") == "image_url":
+        return estimate_image_tokens(part["image_url"]["url"])
+    return estimate_text_tokens(part.get("text", ""))
+
+
+def estimate_prompt_tokens(prompt_parts: list[dict]) -> int:
+    return sum(estimate_part_tokens(part) for part in prompt_parts)
+
+
+def _is_truncatable(index: int, part: dict, tokens: int) -> bool:
+    # The grading instructions, small labels, images and base64 encoded files
+    # (which would no longer decode) are always sent whole
+    return (
+        index > 0
+        and part.get("type") == "text"
+        and not part["text"].startswith(BASE64_PART_PREFIX)
+        and tokens > settings.GRADING_MIN_TRUNCATED_PART_TOKENS
+    )
+
+
+def truncate_text(text: str, max_tokens: int) -> str:
+    max_chars = max_tokens * settings.GRADING_CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    max_chars -= TRUNCATION_MARKER_CHARS
+    # Keep the beginning and the end, where answers and conclusions usually are
+    head = max_chars * 2 // 3
+    tail = max_chars - head
+    omitted = len(text) - head - tail
+    return (
+        f"{text[:head]}\n[... {omitted} characters omitted to fit the grading "
+        f"budget ...]\n{text[len(text) - tail:]}"
+    )
+
+
+def fit_to_budget(prompt_parts: list[dict], budget: int) -> list[dict]:
+    """
+    Return prompt parts whose estimated size fits `budget` tokens. The largest
+    text parts are cut down to a common ceiling, so the result only depends
+    on the input. Raises PromptTooLarge when parts that cannot be truncated
+    exceed the budget on their own.
+    """
+    sizes = [estimate_part_tokens(part) for part in prompt_parts]
+    if sum(sizes) <= budget:
+        return prompt_parts
+
+    truncatable = [
+        index
+        for index, part in enumerate(prompt_parts)
+        if _is_truncatable(index, part, sizes[index])
+    ]
+    fixed = sum(size for index, size in enumerate(sizes) if index not in truncatable)
+    available = budget - fixed
+    floor = settings.GRADING_MIN_TRUNCATED_PART_TOKENS
+    if not truncatable or available < floor * len(truncatable):
+        raise PromptTooLarge(
+            f"Prompt needs about {sum(sizes)} tokens, budget is {budget}"
+        )
+
+    # Find the largest ceiling that all truncatable parts fit under
+    remaining = sorted(sizes[index] for index in truncatable)
+    ceiling = available // len(remaining)
+    for position, size in enumerate(remaining):
+        share = available // (len(remaining) - position)
+        if size > share:
+            ceiling = share
+            break
+        available -= size
+    else:
+        return prompt_parts
+
+    fitted = list(prompt_parts)
+    for index in truncatable:
+        if sizes[index] > ceiling:
+            # Copy rather than edit, the part may be shared through a cache
+            fitted[index] = {
+                **prompt_parts[index],
+                "text": truncate_text(prompt_parts[index]["text"], ceiling),
+            }
+    return fitted
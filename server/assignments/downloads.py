@@ -0,0 +1,231 @@
+"""
+Authorized downloads of task, solution and submission files.
+
+Links are opened by the browser without the Authorization header, so the
+URL itself names the user it was issued to and is signed with SECRET_KEY.
+It also embeds the file's content hash, so a new file gets a new URL and
+responses can be cached as immutable. As a leaked link works for anyone,
+it expires after DOWNLOAD_URL_MAX_AGE seconds; see url_window for how it
+stays stable in between. The transfer itself is handed to the front proxy
+(X-Accel-Redirect or X-Sendfile), to the storage backend's own URLs, or
+streamed by Django with Range support, see FILE_DELIVERY.
+"""
+
+import hashlib
+import mimetypes
+import os
+import re
+import time
+
+from django.conf import settings
+from django.core.signing import BadSignature, TimestampSigner, b62_encode
+from django.http import (
+    HttpResponse,
+    HttpResponseRedirect,
+    StreamingHttpResponse,
+)
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import content_disposition_header
+
+from assignments.storage import recorded_sha256
+
+# Downloadable kinds of files and their model field
+FILE_FIELDS = {
+    "task": "task_file",
+    "solution": "solution_file",
+    "submission": "submitted_file",
+}
+
+# Types shown in the browser; anything else, e.g. HTML or SVG uploaded by a
+# student, could run script on the app's origin and is only downloaded
+INLINE_CONTENT_TYPES = {
+    "application/pdf",
+    "image/gif",
+    "image/jpeg",
+    "image/png",
+    "image/webp",
+    "text/plain",
+}
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def url_window() -> int:
+    """
+    Length of the periods URLs are signed for. Within one the URL of a file
+    does not change, so responses embedding it can be revalidated and
+    cached, and it stays valid for at least half of DOWNLOAD_URL_MAX_AGE.
+    """
+    return max(1, settings.DOWNLOAD_URL_MAX_AGE // 2)
+
+
+def url_epoch() -> int:
+    """Number of the current URL window, part of the ETag of responses."""
+    return int(time.time()) // url_window()
+
+
+class _WindowSigner(TimestampSigner):
+    # Signed at the start of the current window rather than now
+    def timestamp(self):
+        return b62_encode(url_epoch() * url_window())
+
+
+_signer = _WindowSigner(salt="assignments.downloads", sep=".")
+
+
+def file_version(file_field) -> str:
+    # Files stored before content addressing are versioned by their name
+    digest = (
+        recorded_sha256(file_field)
+        or hashlib.sha256(file_field.name.encode()).hexdigest()
+    )
+    return digest[:16]
+
+
+def _signed_prefix(kind: str, object_id: int, user_id: int) -> str:
+    return f"{kind}:{object_id}:{user_id}:"
+
+
+def file_url(request, kind: str, obj) -> str | None:
+    """Absolute download URL of a file of `obj` for the requesting user."""
+    file_field = getattr(obj, FILE_FIELDS[kind])
+    if not file_field:
+        return None
+    user_id = request.user.id
+    prefix = _signed_prefix(kind, obj.id, user_id)
+    path = reverse(
+        "download-file",
+        kwargs={
+            "kind": kind,
+            "object_id": obj.id,
+            "user_id": user_id,
+            # The signed value minus what the rest of the URL already says:
+            # <version>.<timestamp>.<signature>
+            "token": _signer.sign(prefix + file_version(file_field)).removeprefix(
+                prefix
+            ),
+            "filename": os.path.basename(file_field.name),
+        },
+    )
+    return request.build_absolute_uri(path)
+
+
+def check_token(kind: str, object_id: int, user_id: int, token: str) -> str | None:
+    """
+    Return the file version signed in `token`, or None if it is forged or
+    older than DOWNLOAD_URL_MAX_AGE.
+    """
+    prefix = _signed_prefix(kind, object_id, user_id)
+    try:
+        value = _signer.unsign(prefix + token, max_age=settings.DOWNLOAD_URL_MAX_AGE)
+    except BadSignature:
+        return None
+    return value.removeprefix(prefix)
+
+
+def parse_range(header: str, size: int) -> tuple[int, int] | None:
+    """
+    Return the inclusive (first, last) byte positions of a single-range
+    Range header, None to serve the whole file (no header, several ranges
+    or an unknown unit) or raise ValueError when it cannot be satisfied.
+    """
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    if size == 0:
+        raise ValueError("Empty file")
+    first, last = match.groups()
+    if first == "":
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(0, size - length), size - 1
+    first = int(first)
+    last = size - 1 if last == "" else min(int(last), size - 1)
+    if first > last or first >= size:
+        raise ValueError("Range starts past the end of the file")
+    return first, last
+
+
+def _stream(file, first: int, length: int):
+    with file:
+        file.seek(first)
+        while length > 0:
+            chunk = file.read(min(STREAM_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_file(request, file_field, version: str):
+    """
+    Respond with the file: through the proxy or storage configured in
+    FILE_DELIVERY, or streamed by Django honouring Range and If-Range.
+    Only the types in INLINE_CONTENT_TYPES are shown inline.
+    """
+    etag = f'"{version}"'
+    response = get_conditional_response(request, etag=etag)
+    if response is not None:
+        return _with_cache_headers(response, etag)
+
+    storage = file_field.storage
+    filename = os.path.basename(file_field.name)
+    content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    delivery = settings.FILE_DELIVERY
+
+    if delivery == "storage":
+        return HttpResponseRedirect(storage.url(file_field.name))
+
+    if delivery in ("x-accel-redirect", "x-sendfile"):
+        response = HttpResponse(content_type=content_type)
+        if delivery == "x-accel-redirect":
+            response["X-Accel-Redirect"] = (
+                settings.FILE_ACCEL_REDIRECT_PREFIX.rstrip("/")
+                + "/"
+                + getattr(storage, "physical_name", str)(file_field.name)
+            )
+        else:
+            response["X-Sendfile"] = storage.path(file_field.name)
+    else:
+        size = storage.size(file_field.name)
+        byte_range = None
+        # A stale If-Range asks for the whole, changed file
+        if request.headers.get("If-Range", etag) == etag:
+            try:
+                byte_range = parse_range(request.headers.get("Range", ""), size)
+            except ValueError:
+                response = HttpResponse(status=416)
+                response["Content-Range"] = f"bytes */{size}"
+                return response
+        first, last = byte_range or (0, size - 1)
+        length = max(0, last - first + 1)
+        response = StreamingHttpResponse(
+            _stream(storage.open(file_field.name, "rb"), first, length),
+            status=206 if byte_range else 200,
+            content_type=content_type,
+        )
+        response["Content-Length"] = str(length)
+        if byte_range:
+            response["Content-Range"] = f"bytes {first}-{last}/{size}"
+        # The proxy answers Range requests itself in the other modes
+        response["Accept-Ranges"] = "bytes"
+
+    response["Content-Disposition"] = content_disposition_header(
+        content_type not in INLINE_CONTENT_TYPES, filename
+    )
+    # Browsers must not render a file as another type than the one sent
+    response["X-Content-Type-Options"] = "nosniff"
+    return _with_cache_headers(response, etag)
+
+
+def _with_cache_headers(response, etag: str):
+    response["ETag"] = etag
+    # The URL changes with the file, so it can be cached for good
+    patch_cache_control(
+        response, private=True, max_age=settings.FILE_CACHE_MAX_AGE, immutable=True
+    )
+    return response
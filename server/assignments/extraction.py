@@ -0,0 +1,40 @@
+import time
+
+from assignments.grading_cache import content_hash
+from assignments.utils import get_text_extractor
+
+
+def extract_text(file_field, mime_type: str) -> str | None:
+    """
+    Text content of a grading input, or None when the format has no
+    extractor, extraction fails or yields no text. Results are stored per
+    file hash and extractor, so each file is only parsed once.
+    """
+    from assignments.models import ExtractedText
+
+    extractor = get_text_extractor(file_field.name, mime_type)
+    if extractor is None:
+        return None
+
+    file_hash = content_hash(file_field)
+    cached = ExtractedText.objects.filter(
+        content_hash=file_hash, extractor=extractor.__name__
+    ).first()
+    if cached is not None:
+        return cached.text or None
+
+    started = time.perf_counter()
+    try:
+        text = extractor(file_field)
+    except Exception as e:
+        print(f"Could not extract text from {file_field.name}: {e}")
+        return None
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    text = text if text.strip() else ""
+    ExtractedText.objects.get_or_create(
+        content_hash=file_hash,
+        extractor=extractor.__name__,
+        defaults={"text": text, "extraction_ms": elapsed_ms},
+    )
+    return text or None
@@ -0,0 +1,111 @@
+import hashlib
+import threading
+
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from assignments.reference_cache import file_identity
+from assignments.storage import recorded_sha256
+from assignments.utils import file_sha256
+
+# Bump whenever the grading prompts (see prompts.grading_instructions) or
+# score parsing change, so scores obtained with the old prompt are no
+# longer reused.
+PROMPT_VERSION = "2"
+
+_stats_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0}
+
+_hash_lock = threading.Lock()
+_hashes_by_identity: dict[str, str] = {}
+
+
+def content_hash(file_field) -> str:
+    # Recorded on upload for files in content-addressed storage
+    digest = recorded_sha256(file_field)
+    if digest:
+        return digest
+    identity = file_identity(file_field)
+    with _hash_lock:
+        digest = _hashes_by_identity.get(identity)
+    if digest is None:
+        digest = file_sha256(file_field)
+        with _hash_lock:
+            if len(_hashes_by_identity) >= settings.GRADING_CACHE_MAX_HASHES:
+                _hashes_by_identity.clear()
+            _hashes_by_identity[identity] = digest
+    return digest
+
+
+def make_key(submission, assignment) -> str | None:
+    """
+    Key a grading result on everything that determines the prompt: the three
+    files, the model, the prompt version, the assignment settings the
+    prompt mentions and the token budget it is truncated to. Returns None
+    when a file cannot be hashed.
+    """
+    try:
+        parts = [
+            content_hash(assignment.task_file),
+            content_hash(assignment.solution_file),
+            content_hash(submission.submitted_file),
+        ]
+    except (OSError, ValueError) as e:
+        print(f"Could not hash files for grading cache, skipping it: {e}")
+        return None
+
+    parts += [
+        settings.OPENROUTER_MODEL,
+        PROMPT_VERSION,
+        str(assignment.max_score),
+        assignment.classroom.subject,
+        str(submission.is_hand_written),
+        str(assignment.get_token_budget()),
+    ]
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+def get_cached_score(cache_key: str) -> float | None:
+    from assignments.models import GradingResult
+
+    result = GradingResult.objects.filter(cache_key=cache_key).first()
+    with _stats_lock:
+        _stats["hits" if result else "misses"] += 1
+    if result is None:
+        return None
+
+    GradingResult.objects.filter(id=result.id).update(
+        hit_count=F("hit_count") + 1, last_hit_at=timezone.now()
+    )
+    return result.score
+
+
+def store_score(cache_key: str, score: float) -> None:
+    from assignments.models import GradingResult
+
+    GradingResult.objects.update_or_create(
+        cache_key=cache_key,
+        defaults={
+            "score": score,
+            "model": settings.OPENROUTER_MODEL,
+            "prompt_version": PROMPT_VERSION,
+        },
+    )
+
+
+def get_stats() -> dict:
+    """Hit-rate counters for this process plus totals across all processes."""
+    from assignments.models import GradingResult
+
+    with _stats_lock:
+        hits, misses = _stats["hits"], _stats["misses"]
+    lookups = hits + misses
+    totals = GradingResult.objects.aggregate(total_hits=Sum("hit_count"))
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": hits / lookups if lookups else 0.0,
+        "entries": GradingResult.objects.count(),
+        "total_hits": totals["total_hits"] or 0,
+    }
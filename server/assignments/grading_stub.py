@@ -0,0 +1,281 @@
+"""
+Local stand-in for the OpenRouter chat completions API and the OCR service,
+for benchmarking the grading pipeline without network access or costs.
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RESPONSE_FORMATS = ("plain", "parts", "verbose")
+
+MAX_SCORE_PATTERN = re.compile(r"between 0\.0 and (\d+(?:\.\d+)?)")
+BATCH_ID_PATTERN = re.compile(r"submission_id (\d+)\)")
+
+
+class LatencyDistribution:
+    """
+    Latency parsed from a spec in milliseconds: `constant:MS`,
+    `uniform:LOW:HIGH`, `exponential:MEAN` or `lognormal:MEDIAN:SIGMA`.
+    """
+
+    def __init__(self, spec: str):
+        kind, _, params = spec.partition(":")
+        try:
+            values = [float(value) for value in params.split(":") if value]
+        except ValueError:
+            raise ValueError(f"Invalid latency spec '{spec}'")
+        expected = {"constant": 1, "uniform": 2, "exponential": 1, "lognormal": 2}
+        if kind not in expected or len(values) != expected[kind]:
+            raise ValueError(
+                f"Invalid latency spec '{spec}', expected one of constant:MS, "
+                "uniform:LOW:HIGH, exponential:MEAN, lognormal:MEDIAN:SIGMA"
+            )
+        self.spec = spec
+        self.kind = kind
+        self.values = values
+
+    def sample(self, rng: random.Random) -> float:
+        """Return a latency in seconds."""
+        if self.kind == "constant":
+            ms = self.values[0]
+        elif self.kind == "uniform":
+            ms = rng.uniform(*self.values)
+        elif self.kind == "exponential":
+            ms = rng.expovariate(1 / self.values[0]) if self.values[0] else 0
+        else:
+            median, sigma = self.values
+            ms = median * rng.lognormvariate(0, sigma)
+        return max(0.0, ms) / 1000
+
+
+@dataclass
+class StubConfig:
+    latency: LatencyDistribution = field(
+        default_factory=lambda: LatencyDistribution("lognormal:800:0.5")
+    )
+    ocr_latency: LatencyDistribution = field(
+        default_factory=lambda: LatencyDistribution("uniform:200:600")
+    )
+    # Share of chat completion requests answered with a 500 or a 429
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    retry_after: float = 1.0
+    response_format: str = "plain"
+    seed: int = 0
+
+
+class GradingStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config: StubConfig):
+        super().__init__(address, GradingStubHandler)
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.stats = {"completions": 0, "ocr": 0, "errors": 0, "throttled": 0}
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, key: str) -> None:
+        with self.lock:
+            self.stats[key] += 1
+
+    def random(self) -> float:
+        with self.lock:
+            return self.rng.random()
+
+    def sample(self, distribution: LatencyDistribution) -> float:
+        with self.lock:
+            return distribution.sample(self.rng)
+
+
+class GradingStubHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so the client's connection pool behaves as in production
+    protocol_version = "HTTP/1.1"
+    server: GradingStubServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def read_body(self) -> bytes | None:
+        # Like APIs that refuse chunked bodies, insist on a Content-Length
+        if "Content-Length" not in self.headers:
+            return None
+        return self.rfile.read(int(self.headers["Content-Length"]))
+
+    def send_json(self, status: int, payload: dict, headers: dict | None = None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.read_body()
+        if body is None:
+            self.close_connection = True
+            self.send_json(411, {"error": "Content-Length required"})
+            return
+        try:
+            payload = json.loads(body or b"{}")
+        except ValueError:
+            self.send_json(400, {"error": "Invalid JSON"})
+            return
+
+        if self.path.rstrip("/").endswith("chat/completions"):
+            self.handle_completion(payload)
+        elif self.path.rstrip("/").endswith("predict") or "image" in payload:
+            self.handle_ocr(payload)
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def handle_ocr(self, payload):
+        self.server.record("ocr")
+        time.sleep(self.server.sample(self.server.config.ocr_latency))
+        self.send_json(200, {"pred": "x = 2, y = 3 therefore the sum is 5"})
+
+    def handle_completion(self, payload):
+        config = self.server.config
+        self.server.record("completions")
+        time.sleep(self.server.sample(config.latency))
+
+        roll = self.server.random()
+        if roll < config.throttle_rate:
+            self.server.record("throttled")
+            self.send_json(
+                429,
+                {"error": {"message": "Rate limit exceeded"}},
+                {"Retry-After": str(config.retry_after)},
+            )
+            return
+        if roll < config.throttle_rate + config.error_rate:
+            self.server.record("errors")
+            self.send_json(500, {"error": {"message": "Injected failure"}})
+            return
+
+        prompt = " ".join(
+            part.get("text", "")
+            for message in payload.get("messages", [])
+            for part in (
+                message["content"]
+                if isinstance(message.get("content"), list)
+                else [{"text": message.get("content", "")}]
+            )
+            if isinstance(part, dict)
+        )
+        self.send_json(
+            200,
+            {
+                "id": "stub",
+                "model": payload.get("model", "stub"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "finish_reason": "stop",
+                        "message": {
+                            "role": "assistant",
+                            "content": self.completion_content(prompt),
+                        },
+                    }
+                ],
+            },
+        )
+
+    def completion_content(self, prompt: str):
+        match = MAX_SCORE_PATTERN.search(prompt)
+        max_score = float(match.group(1)) if match else 10.0
+
+        def score():
+            return round(self.server.random() * max_score * 2) / 2
+
+        batch_ids = BATCH_ID_PATTERN.findall(prompt)
+        response_format = self.server.config.response_format
+        if batch_ids:
+            text = json.dumps(
+                {
+                    "scores": [
+                        {"submission_id": int(submission_id), "score": score()}
+                        for submission_id in batch_ids
+                    ]
+                }
+            )
+            if response_format == "verbose":
+                text = f"Here are the scores:\n{text}"
+        elif response_format == "verbose":
+            text = f"The submission deserves {score()} points."
+        else:
+            text = f"Score: {score()}"
+
+        if response_format == "parts":
+            return [{"type": "text", "text": text}]
+        return text
+
+
+def start_stub_server(
+    config: StubConfig, host: str = "127.0.0.1", port: int = 0
+) -> GradingStubServer:
+    """Serve the stub from a background thread; port 0 picks a free port."""
+    server = GradingStubServer((host, port), config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def add_stub_arguments(parser) -> None:
+    parser.add_argument(
+        "--latency",
+        default="lognormal:800:0.5",
+        help="Chat completion latency in ms, e.g. constant:500, uniform:200:900, "
+        "exponential:600 or lognormal:800:0.5",
+    )
+    parser.add_argument(
+        "--ocr-latency", default="uniform:200:600", help="OCR latency in ms"
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Share of chat completions answered with a 500",
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        type=float,
+        default=0.0,
+        help="Share of chat completions answered with a 429",
+    )
+    parser.add_argument(
+        "--retry-after",
+        type=float,
+        default=1.0,
+        help="Retry-After seconds sent with 429 responses",
+    )
+    parser.add_argument(
+        "--response-format",
+        choices=RESPONSE_FORMATS,
+        default="plain",
+        help="plain 'Score: X' text, a list of content parts, or prose that "
+        "needs the fallback parser",
+    )
+    parser.add_argument("--stub-seed", type=int, default=0)
+
+
+def config_from_options(options) -> StubConfig:
+    return StubConfig(
+        latency=LatencyDistribution(options["latency"]),
+        ocr_latency=LatencyDistribution(options["ocr_latency"]),
+        error_rate=options["error_rate"],
+        throttle_rate=options["throttle_rate"],
+        retry_after=options["retry_after"],
+        response_format=options["response_format"],
+        seed=options["stub_seed"],
+    )
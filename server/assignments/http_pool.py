@@ -0,0 +1,159 @@
+import json
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+_session = None
+_session_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_pool_stats: dict[str, dict[str, int]] = {}
+
+
+def _record(host: str, key: str) -> None:
+    with _stats_lock:
+        host_stats = _pool_stats.setdefault(host, {"requests": 0, "misses": 0})
+        host_stats[key] += 1
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    def _new_conn(self):
+        # A new connection means the pool had nothing idle to reuse
+        _record(self.host, "misses")
+        return super()._new_conn()
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    def _new_conn(self):
+        _record(self.host, "misses")
+        return super()._new_conn()
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter counting the requests it sends, once each whatever urllib3
+    does to send them, and the new connections its pools open.
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, *args, **kwargs):
+        _record(urlsplit(request.url).hostname, "requests")
+        return super().send(request, *args, **kwargs)
+
+
+def _build_session() -> requests.Session:
+    session = requests.Session()
+    default_adapter = CountingHTTPAdapter(
+        pool_connections=settings.GRADING_HTTP_POOL_CONNECTIONS,
+        pool_maxsize=settings.GRADING_HTTP_POOL_MAXSIZE,
+        pool_block=settings.GRADING_HTTP_POOL_BLOCK,
+    )
+    session.mount("http://", default_adapter)
+    session.mount("https://", default_adapter)
+
+    for host, maxsize in settings.GRADING_HTTP_HOST_POOL_LIMITS.items():
+        host_adapter = CountingHTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=maxsize,
+            pool_block=settings.GRADING_HTTP_POOL_BLOCK,
+        )
+        session.mount(f"http://{host}", host_adapter)
+        session.mount(f"https://{host}", host_adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """Return the process-wide session shared by all outbound grading traffic."""
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _build_session()
+    return _session
+
+
+def get_timeout(url: str) -> tuple[float, float]:
+    host = urlsplit(url).netloc
+    return settings.GRADING_HTTP_HOST_TIMEOUTS.get(
+        host,
+        (settings.GRADING_HTTP_CONNECT_TIMEOUT, settings.GRADING_HTTP_READ_TIMEOUT),
+    )
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    kwargs.setdefault("timeout", get_timeout(url))
+    return get_session().post(url, **kwargs)
+
+
+class JSONBody:
+    """
+    `payload` encoded as JSON once, into chunks of about `chunk_size` bytes
+    that are sent as the request body with a Content-Length, rather than
+    chunked, which not every API accepts. The chunks are held with the
+    payload until the request is sent, and are never joined into one body
+    string. Each string in the payload lands whole in one chunk, so a large
+    base64 file is still copied once.
+    """
+
+    def __init__(self, payload, chunk_size: int = 64 * 1024):
+        self.chunks = list(self._encode(payload, chunk_size))
+        self._length = sum(len(chunk) for chunk in self.chunks)
+
+    @staticmethod
+    def _encode(payload, chunk_size: int):
+        # ASCII only, so every character is one byte
+        pieces = json.JSONEncoder(allow_nan=False, ensure_ascii=True).iterencode(
+            payload
+        )
+        buffered = []
+        buffered_size = 0
+        for piece in pieces:
+            buffered.append(piece)
+            buffered_size += len(piece)
+            if buffered_size >= chunk_size:
+                yield "".join(buffered).encode("ascii")
+                buffered = []
+                buffered_size = 0
+        if buffered:
+            yield "".join(buffered).encode("ascii")
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+
+def get_pool_stats() -> dict[str, dict[str, float]]:
+    """
+    Per-host connection reuse counters for this process. `hits` are requests
+    served on a kept-alive connection, `misses` required a new connection.
+    """
+    with _stats_lock:
+        snapshot = {host: dict(values) for host, values in _pool_stats.items()}
+
+    stats = {}
+    for host, values in snapshot.items():
+        hits = max(0, values["requests"] - values["misses"])
+        stats[host] = {
+            "requests": values["requests"],
+            "hits": hits,
+            "misses": values["misses"],
+            "reuse_rate": hits / values["requests"] if values["requests"] else 0.0,
+        }
+    return stats
+
+
+def reset_pool_stats() -> None:
+    with _stats_lock:
+        _pool_stats.clear()
@@ -0,0 +1,112 @@
+import io
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from assignments.grading_cache import content_hash
+
+FORMAT_MIME_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "WEBP": "image/webp"}
+FORMAT_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp"}
+
+
+def _encode(image: Image.Image, image_format: str) -> bytes:
+    if image_format == "JPEG" and image.mode not in ("L", "RGB"):
+        # JPEG has no alpha channel; flatten transparent scans onto white
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.convert("RGBA").getchannel("A"))
+        image = background
+
+    output = io.BytesIO()
+    # Re-encoding without passing exif/icc data strips the original metadata
+    image.save(
+        output,
+        format=image_format,
+        optimize=True,
+        quality=settings.GRADING_IMAGE_QUALITY,
+    )
+    return output.getvalue()
+
+
+def _normalize(file_field, image_format: str, grayscale: bool) -> bytes | None:
+    try:
+        with file_field.open("rb") as f:
+            image = Image.open(f)
+            image = ImageOps.exif_transpose(image)
+            max_dimension = settings.GRADING_IMAGE_MAX_DIMENSION
+            image.thumbnail((max_dimension, max_dimension))
+            if grayscale:
+                image = image.convert("L")
+            return _encode(image, image_format)
+    except (UnidentifiedImageError, OSError) as e:
+        print(f"Could not normalize image {file_field.name}, using original: {e}")
+        return None
+
+
+def derivatives_dir(digest: str) -> str:
+    return f"{settings.GRADING_IMAGE_DERIVATIVES_DIR}/{digest}"
+
+
+def delete_derivatives(digest: str) -> None:
+    """Delete the normalized copies of the image with hash `digest`."""
+    directory = derivatives_dir(digest)
+    try:
+        _, names = default_storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        default_storage.delete(f"{directory}/{name}")
+    try:
+        os.rmdir(default_storage.path(directory))
+    except (NotImplementedError, OSError):
+        pass
+
+
+def normalized_image(file_field, image_format: str, grayscale: bool = False):
+    """
+    Return (mime_type, file) for a downsized, re-encoded copy of an image.
+    The copy is stored in a directory named after the source hash, under a
+    name derived from the normalization settings, so each file is processed
+    only once. Content-addressed storage deletes the directory with the
+    source, see delete_derivatives. Falls back to the original when the
+    image cannot be decoded.
+    """
+    variant = "-".join(
+        [
+            str(settings.GRADING_IMAGE_MAX_DIMENSION),
+            str(settings.GRADING_IMAGE_QUALITY),
+            "gray" if grayscale else "color",
+        ]
+    )
+    name = (
+        f"{derivatives_dir(content_hash(file_field))}/"
+        f"{variant}{FORMAT_EXTENSIONS[image_format]}"
+    )
+
+    if not default_storage.exists(name):
+        data = _normalize(file_field, image_format, grayscale)
+        if data is None:
+            return None, file_field
+        written = default_storage.save(name, ContentFile(data))
+        if written != name:
+            # Lost a race with a concurrent request, keep the other copy
+            default_storage.delete(written)
+
+    return FORMAT_MIME_TYPES[image_format], default_storage.open(name)
+
+
+def normalize_for_model(file_field, mime_type: str, grayscale: bool = False):
+    derivative_mime_type, image_file = normalized_image(
+        file_field, settings.GRADING_IMAGE_FORMAT, grayscale
+    )
+    return derivative_mime_type or mime_type, image_file
+
+
+def normalize_for_ocr(file_field):
+    # The OCR service is sent a lossless image; text strokes suffer under JPEG
+    _, image_file = normalized_image(
+        file_field, settings.GRADING_OCR_IMAGE_FORMAT, grayscale=True
+    )
+    return image_file
@@ -0,0 +1,486 @@
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from assignments import batch_grading, grading_cache
+from assignments.models import Assignment, AutoCheckJob, AutoCheckTask, Submission
+
+logger = logging.getLogger(__name__)
+
+
+def get_active_job(assignment: Assignment) -> AutoCheckJob | None:
+    return (
+        AutoCheckJob.objects.filter(
+            assignment=assignment,
+            status__in=[AutoCheckJob.STATUS_PENDING, AutoCheckJob.STATUS_RUNNING],
+        )
+        .order_by("-created_at")
+        .first()
+    )
+
+
+def enqueue_auto_check(
+    assignment: Assignment, requested_by, force_regrade: bool = False
+) -> AutoCheckJob | None:
+    """
+    Create a job with one task per unchecked submission of the assignment.
+    Returns None when there is nothing to grade, and the active job when the
+    assignment already has one (see get_active_job). A forced regrade
+    bypasses the grading cache and calls the model for every submission.
+    """
+    submission_ids = list(
+        Submission.objects.filter(assignment=assignment, score__isnull=True)
+        .exclude(submitted_file="")
+        .values_list("id", flat=True)
+    )
+    if not submission_ids:
+        return None
+
+    try:
+        with transaction.atomic():
+            job = AutoCheckJob.objects.create(
+                assignment=assignment,
+                requested_by_id=requested_by.id,
+                total_tasks=len(submission_ids),
+                force_regrade=force_regrade,
+            )
+            AutoCheckTask.objects.bulk_create(
+                [
+                    AutoCheckTask(job=job, submission_id=submission_id)
+                    for submission_id in submission_ids
+                ]
+            )
+    except IntegrityError:
+        # Queued by a concurrent request, one active job per assignment
+        return get_active_job(assignment)
+    return job
+
+
+def claim_tasks(worker_id: str, limit: int, job_ids=None) -> list[AutoCheckTask]:
+    """
+    Claim up to `limit` pending tasks for this worker, only of `job_ids` when
+    given. Each task is claimed with a conditional update, so several workers
+    on different processes or hosts never grade the same task twice.
+    """
+    pending = AutoCheckTask.objects.filter(status=AutoCheckTask.STATUS_PENDING)
+    if job_ids is not None:
+        pending = pending.filter(job_id__in=job_ids)
+    candidate_ids = pending.order_by("id").values_list("id", flat=True)[: limit * 2]
+
+    claimed_ids = []
+    for task_id in candidate_ids:
+        claimed = AutoCheckTask.objects.filter(
+            id=task_id, status=AutoCheckTask.STATUS_PENDING
+        ).update(
+            status=AutoCheckTask.STATUS_RUNNING,
+            worker_id=worker_id,
+            claimed_at=timezone.now(),
+            attempts=F("attempts") + 1,
+        )
+        if claimed:
+            claimed_ids.append(task_id)
+        if len(claimed_ids) >= limit:
+            break
+
+    if not claimed_ids:
+        return []
+
+    tasks = list(
+        AutoCheckTask.objects.filter(id__in=claimed_ids).select_related(
+            "job", "submission__assignment__classroom"
+        )
+    )
+    AutoCheckJob.objects.filter(
+        id__in={task.job_id for task in tasks}, status=AutoCheckJob.STATUS_PENDING
+    ).update(status=AutoCheckJob.STATUS_RUNNING, started_at=timezone.now())
+    return tasks
+
+
+def requeue_stale_tasks() -> int:
+    """
+    Release tasks whose worker stopped reporting back within the lease, so
+    another worker can pick them up. Tasks out of attempts are failed instead.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.AUTOCHECK_TASK_LEASE_SECONDS)
+    stale = AutoCheckTask.objects.filter(
+        status=AutoCheckTask.STATUS_RUNNING, claimed_at__lt=cutoff
+    )
+
+    exhausted = list(
+        stale.filter(attempts__gte=settings.AUTOCHECK_TASK_MAX_ATTEMPTS).values_list(
+            "id", "worker_id"
+        )
+    )
+    for task_id, worker_id in exhausted:
+        _finish_task(
+            task_id, worker_id, AutoCheckTask.STATUS_FAILED, "Worker lease expired"
+        )
+
+    return stale.filter(attempts__lt=settings.AUTOCHECK_TASK_MAX_ATTEMPTS).update(
+        status=AutoCheckTask.STATUS_PENDING, worker_id="", claimed_at=None
+    )
+
+
+def renew_leases(worker_id: str, task_ids) -> int:
+    """Extend the lease of tasks this worker is still grading."""
+    return AutoCheckTask.objects.filter(
+        id__in=task_ids, status=AutoCheckTask.STATUS_RUNNING, worker_id=worker_id
+    ).update(claimed_at=timezone.now())
+
+
+class LeaseKeeper:
+    """
+    Renews the lease of the tasks a worker is grading from a background
+    thread, every third of AUTOCHECK_TASK_LEASE_SECONDS. A batch held up by
+    rate limit retries and individual fallbacks can take longer than the
+    lease, and would otherwise be requeued and paid for a second time by
+    another worker. Leases still expire when the worker process dies.
+    """
+
+    def __init__(self, worker_id: str, interval: float | None = None):
+        self.worker_id = worker_id
+        self.interval = (
+            interval
+            if interval is not None
+            else settings.AUTOCHECK_TASK_LEASE_SECONDS / 3
+        )
+        self._task_ids = set()
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, task_ids) -> None:
+        with self._condition:
+            self._task_ids.update(task_ids)
+
+    def remove(self, task_ids) -> None:
+        with self._condition:
+            self._task_ids.difference_update(task_ids)
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self) -> None:
+        try:
+            while True:
+                with self._condition:
+                    self._condition.wait_for(
+                        lambda: self._closed, timeout=self.interval
+                    )
+                    if self._closed:
+                        return
+                    task_ids = list(self._task_ids)
+                if not task_ids:
+                    continue
+                try:
+                    renew_leases(self.worker_id, task_ids)
+                except DatabaseError as e:
+                    logger.warning(
+                        "Renewing the lease of %d tasks failed: %s", len(task_ids), e
+                    )
+        finally:
+            connection.close()
+
+
+def grade_submission(
+    submission: Submission, assignment: Assignment, use_cache: bool = True
+) -> float | None:
+    """Return the score for a submission, without saving nor rounding it."""
+    if not submission.submitted_file:
+        return None
+
+    logger.info("Auto checking %s", submission)
+
+    return submission.auto_check(assignment, use_cache=use_cache)
+
+
+def round_score(score: float) -> float:
+    return round(score * 4) / 4
+
+
+def save_score(task: AutoCheckTask, score: float, writer=None) -> None:
+    """
+    Record the score of a graded task. With a ScoreWriter the score is queued
+    and written with others in one transaction, otherwise it is applied now.
+    """
+    score = round_score(score)
+    if writer is None:
+        apply_scores([(task.id, task.worker_id, task.submission_id, score)])
+    else:
+        writer.add(task.id, task.worker_id, task.submission_id, score)
+
+
+def apply_scores(results: list[tuple[int, str, int, float]]) -> None:
+    """
+    Write (task id, worker id, submission id, score) results in a single
+    transaction: only the score column of the submissions, the graded
+    counters of their assignments and the completion of the tasks and their
+    jobs. Results of tasks the worker no longer runs (lease expired,
+    requeued, reclaimed by another worker or finished elsewhere) are
+    dropped, and scores never replace one given in the meantime, e.g. a
+    manual mark entered while the submission was being graded.
+    """
+    owners = {task_id: worker_id for task_id, worker_id, _, _ in results}
+    with transaction.atomic():
+        locked = (
+            AutoCheckTask.objects.select_for_update()
+            .filter(id__in=owners, status=AutoCheckTask.STATUS_RUNNING)
+            .values_list("id", "worker_id", "job_id")
+        )
+        running = [
+            (task_id, job_id)
+            for task_id, worker_id, job_id in locked
+            if worker_id == owners[task_id]
+        ]
+        running_ids = {task_id for task_id, _ in running}
+        scores = {
+            submission_id: score
+            for task_id, _, submission_id, score in results
+            if task_id in running_ids
+        }
+        submissions = list(
+            Submission.objects.filter(id__in=scores, score__isnull=True).only(
+                "id", "assignment_id", "student_id", "score"
+            )
+        )
+        Submission.set_scores(submissions, scores)
+
+        AutoCheckTask.objects.filter(id__in=running_ids).update(
+            status=AutoCheckTask.STATUS_COMPLETED, finished_at=timezone.now(), error=""
+        )
+        completed_by_job = Counter(job_id for _, job_id in running)
+        for job_id, count in completed_by_job.items():
+            AutoCheckJob.objects.filter(id=job_id).update(
+                completed_tasks=F("completed_tasks") + count
+            )
+        _complete_jobs(completed_by_job)
+    logger.info("Saved %d scores", len(submissions))
+    if len(submissions) < len(results):
+        logger.info("Dropped %d stale scores", len(results) - len(submissions))
+
+
+class ScoreWriter:
+    """
+    Collects scores from grading threads and writes them from one thread with
+    apply_scores, in batches of `flush_size` at least every `flush_interval`
+    seconds. Keeps writes short and serialized, which SQLite needs under
+    parallel grading. Scores that cannot be written are retried; on close
+    any left are dropped and their tasks requeued once their lease expires.
+    """
+
+    def __init__(
+        self, flush_size: int | None = None, flush_interval: float | None = None
+    ):
+        self.flush_size = flush_size or settings.AUTOCHECK_SCORE_FLUSH_SIZE
+        self.flush_interval = (
+            flush_interval
+            if flush_interval is not None
+            else settings.AUTOCHECK_SCORE_FLUSH_INTERVAL
+        )
+        self._pending = []
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(
+        self, task_id: int, worker_id: str, submission_id: int, score: float
+    ) -> None:
+        with self._condition:
+            self._pending.append((task_id, worker_id, submission_id, score))
+            if len(self._pending) >= self.flush_size:
+                self._condition.notify()
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self) -> None:
+        try:
+            while True:
+                with self._condition:
+                    self._condition.wait_for(
+                        lambda: self._closed or len(self._pending) >= self.flush_size,
+                        timeout=self.flush_interval,
+                    )
+                    batch = self._pending[: self.flush_size]
+                    del self._pending[: self.flush_size]
+                    closed = self._closed
+                    remaining = len(self._pending)
+
+                if batch and not self._write(batch) and closed:
+                    # _write put the batch back in front of the pending scores
+                    with self._condition:
+                        dropped = len(self._pending)
+                        self._pending.clear()
+                    logger.error(
+                        "Could not save %d scores, their tasks will be requeued",
+                        dropped,
+                    )
+                    return
+                if closed and not batch and not remaining:
+                    return
+        finally:
+            connection.close()
+
+    def _write(self, batch) -> bool:
+        try:
+            apply_scores(batch)
+            return True
+        except DatabaseError as e:
+            logger.warning("Saving %d scores failed, retrying: %s", len(batch), e)
+            with self._condition:
+                self._pending[:0] = batch
+            time.sleep(self.flush_interval)
+            return False
+
+
+def run_task(task: AutoCheckTask, writer: ScoreWriter | None = None) -> None:
+    submission = task.submission
+    if submission.score is not None:
+        # Graded manually while the task was queued
+        _finish_task(task.id, task.worker_id, AutoCheckTask.STATUS_COMPLETED)
+        return
+
+    try:
+        score = grade_submission(
+            submission, submission.assignment, use_cache=not task.job.force_regrade
+        )
+    except Exception as e:
+        logger.exception("Error processing submission %s", submission.id)
+        _retry_or_fail(task, str(e))
+        return
+
+    if score is not None:
+        save_score(task, score, writer)
+    elif submission.prompt_too_large:
+        _finish_task(
+            task.id,
+            task.worker_id,
+            AutoCheckTask.STATUS_FAILED,
+            "Prompt exceeds the token budget, marked for manual grading",
+        )
+    else:
+        # Network errors and server errors still failing after the
+        # scheduler's retries, which may pass with a later attempt
+        _retry_or_fail(task, "No score could be obtained")
+
+
+def _retry_or_fail(task: AutoCheckTask, error: str) -> None:
+    """Requeue a task that could not be graded, or fail it out of attempts."""
+    if task.attempts >= settings.AUTOCHECK_TASK_MAX_ATTEMPTS:
+        _finish_task(task.id, task.worker_id, AutoCheckTask.STATUS_FAILED, error)
+        return
+    AutoCheckTask.objects.filter(
+        id=task.id, status=AutoCheckTask.STATUS_RUNNING, worker_id=task.worker_id
+    ).update(
+        status=AutoCheckTask.STATUS_PENDING,
+        worker_id="",
+        claimed_at=None,
+        error=error,
+    )
+
+
+def run_task_batch(
+    tasks: list[AutoCheckTask], writer: ScoreWriter | None = None
+) -> None:
+    """
+    Grade tasks of the same job with one batched request. Cached scores are
+    applied first, and any submission whose score could not be read from the
+    batched response is graded on its own. Batched scores are not cached:
+    they come from another prompt than the one make_key describes, which
+    also depends on the other submissions of the batch.
+    """
+    if len(tasks) == 1:
+        run_task(tasks[0], writer)
+        return
+
+    use_cache = not tasks[0].job.force_regrade
+    to_grade = []
+    for task in tasks:
+        submission = task.submission
+        if submission.score is not None:
+            _finish_task(task.id, task.worker_id, AutoCheckTask.STATUS_COMPLETED)
+            continue
+        cache_key = grading_cache.make_key(submission, submission.assignment)
+        cached_score = (
+            grading_cache.get_cached_score(cache_key)
+            if use_cache and cache_key
+            else None
+        )
+        if cached_score is not None:
+            save_score(task, cached_score, writer)
+        else:
+            to_grade.append(task)
+
+    scores = {}
+    if len(to_grade) > 1:
+        assignment = to_grade[0].submission.assignment
+        logger.info("Auto checking %d submissions in one batch", len(to_grade))
+        try:
+            scores = batch_grading.grade_batch(
+                assignment, [task.submission for task in to_grade]
+            )
+        except Exception as e:
+            logger.warning("Batched grading failed, grading individually: %s", e)
+
+    for task in to_grade:
+        score = scores.get(task.submission_id)
+        if score is None:
+            run_task(task, writer)
+        else:
+            save_score(task, score, writer)
+
+
+def _finish_task(
+    task_id: int, worker_id: str, task_status: str, error: str = ""
+) -> None:
+    with transaction.atomic():
+        finished = AutoCheckTask.objects.filter(
+            id=task_id, status=AutoCheckTask.STATUS_RUNNING, worker_id=worker_id
+        ).update(status=task_status, finished_at=timezone.now(), error=error)
+        if not finished:
+            return
+
+        job_id = AutoCheckTask.objects.values_list("job_id", flat=True).get(id=task_id)
+        counter = (
+            "completed_tasks"
+            if task_status == AutoCheckTask.STATUS_COMPLETED
+            else "failed_tasks"
+        )
+        AutoCheckJob.objects.filter(id=job_id).update(**{counter: F(counter) + 1})
+        _complete_jobs([job_id])
+
+
+def _complete_jobs(job_ids) -> None:
+    AutoCheckJob.objects.filter(
+        id__in=job_ids,
+        total_tasks__lte=F("completed_tasks") + F("failed_tasks"),
+    ).exclude(status=AutoCheckJob.STATUS_COMPLETED).update(
+        status=AutoCheckJob.STATUS_COMPLETED, finished_at=timezone.now()
+    )
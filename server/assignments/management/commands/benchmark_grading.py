@@ -0,0 +1,344 @@
+import contextlib
+import functools
+import io
+import resource
+import threading
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from assignments import batch_grading, budget, grading_cache, jobs, ocr_cache
+from assignments.grading_stub import (
+    add_stub_arguments,
+    config_from_options,
+    start_stub_server,
+)
+from assignments.http_pool import get_pool_stats, reset_pool_stats
+from assignments.management.commands.seed_load import seeded_assignments
+from assignments.models import Assignment, AutoCheckJob, Submission
+from assignments.views import AutoCheckSubmissionsView
+from classes import response_cache
+
+User = get_user_model()
+
+
+class StageTimer:
+    """
+    Wall time spent per grading stage, summed over all worker threads. A
+    stage nested in another (OCR inside prompt building) is only counted
+    towards the inner stage.
+    """
+
+    def __init__(self):
+        self.totals = {}
+        self.counts = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def wrap(self, stage, function):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            stack = self._local.__dict__.setdefault("stack", [])
+            stack.append(0.0)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                nested = stack.pop()
+                if stack:
+                    stack[-1] += elapsed
+                with self._lock:
+                    self.totals[stage] = self.totals.get(stage, 0.0) + elapsed - nested
+                    self.counts[stage] = self.counts.get(stage, 0) + 1
+
+        return timed
+
+
+# (owner, attribute, stage) of the functions timed during a benchmark
+TIMED_FUNCTIONS = [
+    (grading_cache, "make_key", "hash files"),
+    (grading_cache, "get_cached_score", "cache lookup"),
+    (Submission, "handle_ocr_prediction", "ocr"),
+    (Submission, "build_openrouter_prompt", "build prompt"),
+    (batch_grading, "build_batch_prompt", "build prompt"),
+    (budget, "fit_to_budget", "fit budget"),
+    (Submission, "make_openrouter_prediction", "model request"),
+    (jobs, "apply_scores", "save scores"),
+    (jobs, "_finish_task", "finish task"),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark auto-checking against a local OpenRouter and OCR stand-in. "
+        "Scores of the benchmarked assignments are cleared first, so only "
+        "assignments created by seed_load are benchmarked unless --yes is given."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--assignment",
+            type=int,
+            action="append",
+            help="Assignment to grade, may be repeated. Defaults to the "
+            "seed_load assignments with the most submissions.",
+        )
+        parser.add_argument(
+            "--prefix",
+            default="load",
+            help="--prefix given to seed_load for the dataset to benchmark",
+        )
+        parser.add_argument(
+            "--yes",
+            action="store_true",
+            help="Also benchmark --assignment ids not created by seed_load, "
+            "clearing their real scores",
+        )
+        parser.add_argument(
+            "--submissions",
+            type=int,
+            default=200,
+            help="Approximate number of submissions to grade when no "
+            "--assignment is given",
+        )
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--batch-size", type=int, default=1)
+        parser.add_argument(
+            "--use-cache",
+            action="store_true",
+            help="Reuse cached scores instead of forcing a regrade",
+        )
+        parser.add_argument(
+            "--requests-per-minute",
+            type=float,
+            default=0,
+            help="OpenRouter request rate limit during the run, 0 for none",
+        )
+        parser.add_argument(
+            "--tokens-per-minute",
+            type=float,
+            default=0,
+            help="OpenRouter token rate limit during the run, 0 for none",
+        )
+        parser.add_argument(
+            "--stub-url",
+            help="Use an already running run_grading_stub instead of starting one",
+        )
+        parser.add_argument(
+            "--trace-memory",
+            action="store_true",
+            help="Also report the peak of Python allocations (slows the run)",
+        )
+        parser.add_argument(
+            "--verbose-worker",
+            action="store_true",
+            help="Show the worker's per-submission output",
+        )
+        add_stub_arguments(parser)
+
+    def handle(self, *args, **options):
+        assignments = self.select_assignments(options)
+        if not assignments:
+            raise CommandError(
+                "No seed_load assignments with submissions to benchmark, "
+                "see --prefix"
+            )
+
+        stub = None
+        stub_url = options["stub_url"]
+        if not stub_url:
+            try:
+                stub = start_stub_server(config_from_options(options))
+            except ValueError as e:
+                raise CommandError(str(e))
+            stub_url = stub.base_url
+        stub_url = stub_url.rstrip("/")
+
+        self.clear_scores(assignments)
+        timer = StageTimer()
+        originals = [
+            (owner, name, getattr(owner, name)) for owner, name, _ in TIMED_FUNCTIONS
+        ]
+        for owner, name, stage in TIMED_FUNCTIONS:
+            setattr(owner, name, timer.wrap(stage, getattr(owner, name)))
+
+        # Stub scores and OCR text must never be reused by real grading: the
+        # model name is part of the grading cache key, and OCR results, which
+        # are keyed on the image alone, are not stored during the run
+        originals.append((ocr_cache, "store_text", ocr_cache.store_text))
+        ocr_cache.store_text = lambda image_hash, text: None
+
+        try:
+            with override_settings(
+                OPENROUTER_MODEL=f"benchmark-stub/{settings.OPENROUTER_MODEL}",
+                OPENROUTER_API_KEY="benchmark",
+                OPENROUTER_API_URL=f"{stub_url}/api/v1/chat/completions",
+                OCR_PREDICTION_URL=f"{stub_url}/predict",
+                OPENROUTER_REQUESTS_PER_MINUTE=options["requests_per_minute"],
+                OPENROUTER_TOKENS_PER_MINUTE=options["tokens_per_minute"],
+            ):
+                result = self.run(assignments, options)
+        finally:
+            for owner, name, original in originals:
+                setattr(owner, name, original)
+            if stub is not None:
+                stub.shutdown()
+
+        self.report(result, timer, stub)
+
+    def select_assignments(self, options) -> list[Assignment]:
+        # Clearing the scores of real assignments would wipe teachers' grades
+        seeded = seeded_assignments(options["prefix"]).select_related(
+            "classroom__teacher"
+        )
+        if options["assignment"]:
+            selected = list(
+                Assignment.objects.select_related("classroom__teacher").filter(
+                    id__in=options["assignment"]
+                )
+            )
+            seeded_ids = set(
+                seeded.filter(id__in=options["assignment"]).values_list("id", flat=True)
+            )
+            real = sorted(a.id for a in selected if a.id not in seeded_ids)
+            if real and not options["yes"]:
+                raise CommandError(
+                    f"Assignments {real} were not created by seed_load with the "
+                    f"prefix '{options['prefix']}', benchmarking clears their "
+                    "scores. Pass --yes to benchmark them anyway."
+                )
+            return selected
+
+        selected, total = [], 0
+        for assignment in seeded.filter(submission_count__gt=0).order_by(
+            "-submission_count", "id"
+        ):
+            if total >= options["submissions"]:
+                break
+            selected.append(assignment)
+            total += assignment.submission_count
+        return selected
+
+    def clear_scores(self, assignments):
+        now = timezone.now()
+        with transaction.atomic():
+            for assignment in assignments:
+                cleared = Submission.objects.filter(
+                    assignment=assignment, score__isnull=False
+                ).update(score=None, updated_at=now)
+                Assignment.objects.filter(id=assignment.id).update(
+                    graded_count=F("graded_count") - cleared, updated_at=now
+                )
+                response_cache.class_changed(assignment.classroom_id)
+            Submission.objects.filter(assignment__in=assignments).update(
+                needs_manual_grading=False, updated_at=now
+            )
+
+    def enqueue(self, assignment, force_regrade) -> int:
+        """Queue the assignment through the same view the teacher uses."""
+        request = APIRequestFactory().post(
+            f"/assignments/{assignment.id}/class/{assignment.classroom_id}/auto-check/",
+            {"force": force_regrade},
+            format="json",
+        )
+        force_authenticate(request, user=assignment.classroom.teacher)
+        response = AutoCheckSubmissionsView.as_view()(
+            request, assignment_id=assignment.id, class_id=assignment.classroom_id
+        )
+        if response.status_code != 202:
+            raise CommandError(
+                f"Could not queue assignment {assignment.id}: {response.data}"
+            )
+        return response.data["id"]
+
+    def run(self, assignments, options):
+        reset_pool_stats()
+        job_ids = [
+            self.enqueue(assignment, not options["use_cache"])
+            for assignment in assignments
+        ]
+        self.stdout.write(
+            f"Grading {len(assignments)} assignments with concurrency "
+            f"{options['concurrency']} and batch size {options['batch_size']}"
+        )
+
+        if options["trace_memory"]:
+            tracemalloc.start()
+        worker_output = (
+            contextlib.nullcontext()
+            if options["verbose_worker"]
+            else contextlib.redirect_stdout(io.StringIO())
+        )
+        started = time.perf_counter()
+        with worker_output:
+            call_command(
+                "run_autocheck_worker",
+                once=True,
+                concurrency=options["concurrency"],
+                batch_size=options["batch_size"],
+                worker_id="benchmark",
+                # Tasks queued by teachers are left to the real workers
+                job=job_ids,
+                stdout=io.StringIO(),
+            )
+        elapsed = time.perf_counter() - started
+        traced_peak = None
+        if options["trace_memory"]:
+            traced_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        job_totals = AutoCheckJob.objects.filter(id__in=job_ids).values_list(
+            "completed_tasks", "failed_tasks"
+        )
+        return {
+            "elapsed": elapsed,
+            "completed": sum(completed for completed, _ in job_totals),
+            "failed": sum(failed for _, failed in job_totals),
+            "traced_peak": traced_peak,
+        }
+
+    def report(self, result, timer, stub):
+        elapsed = result["elapsed"]
+        graded = result["completed"] + result["failed"]
+        self.stdout.write(
+            f"Graded {result['completed']} submissions ({result['failed']} failed) "
+            f"in {elapsed:.1f}s: {graded / elapsed if elapsed else 0:.2f} submissions/s"
+        )
+
+        self.stdout.write(f"{'stage':<16}{'calls':>8}{'total s':>10}{'mean ms':>10}")
+        for stage, total in sorted(
+            timer.totals.items(), key=lambda item: item[1], reverse=True
+        ):
+            calls = timer.counts[stage]
+            self.stdout.write(
+                f"{stage:<16}{calls:>8}{total:>10.2f}{total / calls * 1000:>10.1f}"
+            )
+
+        # ru_maxrss is reported in kilobytes on Linux
+        peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.stdout.write(f"Peak resident memory: {peak_rss_mb:.1f} MB")
+        if result["traced_peak"] is not None:
+            self.stdout.write(
+                f"Peak Python allocations: {result['traced_peak'] / 2**20:.1f} MB"
+            )
+
+        for host, stats in get_pool_stats().items():
+            self.stdout.write(
+                f"{host}: {stats['requests']} requests, "
+                f"{stats['reuse_rate']:.0%} connection reuse"
+            )
+        if stub is not None:
+            self.stdout.write(
+                "Stub: "
+                + ", ".join(f"{key} {value}" for key, value in stub.stats.items())
+            )
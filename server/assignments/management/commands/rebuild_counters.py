@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from assignments.models import Assignment, Submission, count_subquery
+from classes import response_cache
+from classes.models import Class, ClassMembership
+
+
+def rebuild_counters():
+    now = timezone.now()
+    with transaction.atomic():
+        classes = Class.objects.update(
+            student_count=count_subquery(ClassMembership.objects.all(), "classroom"),
+            updated_at=now,
+        )
+        assignments = Assignment.objects.update(
+            submission_count=count_subquery(Submission.objects.all(), "assignment"),
+            graded_count=count_subquery(
+                Submission.objects.filter(score__isnull=False), "assignment"
+            ),
+            updated_at=now,
+        )
+        response_cache.invalidate_all()
+    return classes, assignments
+
+
+class Command(BaseCommand):
+    help = "Recompute the student, submission and graded counters from scratch"
+
+    def handle(self, *args, **options):
+        classes, assignments = rebuild_counters()
+        self.stdout.write(
+            f"Rebuilt counters for {classes} classes and {assignments} assignments"
+        )
@@ -0,0 +1,152 @@
+import os
+import socket
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from assignments import grading_cache
+from assignments.http_pool import get_pool_stats
+from assignments.jobs import (
+    LeaseKeeper,
+    ScoreWriter,
+    claim_tasks,
+    requeue_stale_tasks,
+    run_task_batch,
+)
+from assignments.pipeline import BoundedPipeline
+
+
+class Command(BaseCommand):
+    help = "Run a worker that claims and grades queued auto-check tasks"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=settings.AUTOCHECK_WORKER_CONCURRENCY,
+            help="Number of submissions graded in parallel by this worker",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.AUTOCHECK_WORKER_POLL_INTERVAL,
+            help="Seconds to wait before polling again when the queue is empty",
+        )
+        parser.add_argument(
+            "--worker-id",
+            default=f"{socket.gethostname()}:{os.getpid()}",
+            help="Identifier recorded on claimed tasks",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.AUTOCHECK_BATCH_SIZE,
+            help="Submissions of the same assignment graded in one request",
+        )
+        parser.add_argument(
+            "--job",
+            type=int,
+            action="append",
+            help="Only grade tasks of this job, may be repeated",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit as soon as the queue is empty instead of polling",
+        )
+
+    def handle(self, *args, **options):
+        concurrency = max(1, options["concurrency"])
+        batch_size = max(1, options["batch_size"])
+        worker_id = options["worker_id"]
+        self.stdout.write(
+            f"Auto-check worker {worker_id} started with concurrency {concurrency}"
+        )
+
+        # Grading threads hand their scores to a single writer, which saves
+        # them in batches; closing it last flushes what the pipeline produced.
+        # Leases of claimed tasks are renewed until their batch is done.
+        with ScoreWriter() as self.score_writer, LeaseKeeper(
+            worker_id
+        ) as self.lease_keeper, BoundedPipeline(
+            concurrency, settings.AUTOCHECK_MAX_IN_FLIGHT_BYTES
+        ) as pipeline:
+            processed = 0
+            while True:
+                requeued = requeue_stale_tasks()
+                if requeued:
+                    self.stdout.write(f"Requeued {requeued} stale tasks")
+
+                # Only claim what can start right away, so queued tasks stay
+                # available to other workers instead of waiting here
+                pipeline.wait_for_slot()
+                tasks = claim_tasks(
+                    worker_id, pipeline.free_slots() * batch_size, options["job"]
+                )
+                if not tasks:
+                    if pipeline.in_flight:
+                        pipeline.drain()
+                        continue
+                    if processed:
+                        self.stdout.write(f"Processed {processed} tasks")
+                        self.write_pool_stats()
+                        self.write_cache_stats()
+                        processed = 0
+                    if options["once"]:
+                        break
+                    time.sleep(options["poll_interval"])
+                    continue
+
+                self.lease_keeper.add(task.id for task in tasks)
+                for batch in self.make_batches(tasks, batch_size):
+                    pipeline.submit(self.run_in_thread, batch, self.payload_size(batch))
+                processed += len(tasks)
+
+        self.stdout.write("Auto-check worker stopped")
+
+    def payload_size(self, tasks):
+        size = 0
+        for task in tasks:
+            try:
+                size += task.submission.submitted_file.size
+            except (OSError, ValueError):
+                pass
+        # Files are sent base64 encoded, and encoding briefly holds the
+        # encoded pieces and the joined prompt part (see read_file_b64)
+        return size * 4 // 3 * 2
+
+    def write_pool_stats(self):
+        for host, stats in get_pool_stats().items():
+            self.stdout.write(
+                f"  {host}: {stats['requests']} requests, "
+                f"{stats['hits']} reused, {stats['misses']} new connections "
+                f"({stats['reuse_rate']:.0%} reuse)"
+            )
+
+    def write_cache_stats(self):
+        stats = grading_cache.get_stats()
+        self.stdout.write(
+            f"  grading cache: {stats['hits']} hits, {stats['misses']} misses "
+            f"({stats['hit_rate']:.0%} hit rate), {stats['entries']} entries"
+        )
+
+    def make_batches(self, tasks, batch_size):
+        tasks_by_job = {}
+        for task in tasks:
+            tasks_by_job.setdefault(task.job_id, []).append(task)
+
+        batches = []
+        for job_tasks in tasks_by_job.values():
+            for start in range(0, len(job_tasks), batch_size):
+                batches.append(job_tasks[start : start + batch_size])
+        return batches
+
+    def run_in_thread(self, tasks):
+        try:
+            run_task_batch(tasks, self.score_writer)
+        finally:
+            self.lease_keeper.remove(task.id for task in tasks)
+            # Each executor thread holds its own database connection
+            connection.close()
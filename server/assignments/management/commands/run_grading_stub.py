@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from assignments.grading_stub import (
+    add_stub_arguments,
+    config_from_options,
+    start_stub_server,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a local stand-in for the OpenRouter chat completions API and the "
+        "OCR service. Point OPENROUTER_API_URL at <url>/api/v1/chat/completions "
+        "and OCR_PREDICTION_URL at <url>/predict."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8089)
+        add_stub_arguments(parser)
+
+    def handle(self, *args, **options):
+        try:
+            config = config_from_options(options)
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        server = start_stub_server(config, options["host"], options["port"])
+        self.stdout.write(
+            f"Grading stub listening on {server.base_url} "
+            f"(latency {config.latency.spec}, OCR latency {config.ocr_latency.spec})"
+        )
+        try:
+            while True:
+                time.sleep(10)
+                self.stdout.write(
+                    ", ".join(f"{key}: {value}" for key, value in server.stats.items())
+                )
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.shutdown()
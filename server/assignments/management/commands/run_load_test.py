@@ -0,0 +1,296 @@
+import math
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+
+import requests
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from assignments.models import Assignment, Submission
+from assignments.synthetic import make_docx, make_png
+from classes.models import Class
+
+User = get_user_model()
+
+# Relative frequency of each request in the replayed mix, per role
+TEACHER_MIX = {
+    "login": 5,
+    "list_classes": 15,
+    "class_detail": 25,
+    "list_assignments": 15,
+    "list_submissions": 15,
+    "mark": 25,
+}
+STUDENT_MIX = {
+    "login": 5,
+    "list_classes": 20,
+    "class_detail": 35,
+    "list_assignments": 25,
+    "submit": 15,
+}
+
+
+def percentile(sorted_values: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+@dataclass
+class VirtualUser:
+    email: str
+    role: str
+    class_ids: list[int]
+    assignments: list[tuple[int, int]]
+    # (submission id, max score) pairs to mark for teachers, ids of the
+    # assignments still open for students
+    targets: list
+    token: str = ""
+    samples: list[tuple[str, float, bool]] = field(default_factory=list)
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay a mix of login, listing, class detail, submit and mark "
+        "requests against a running server and report latency percentiles. "
+        "Uses the users created by seed_load."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000/")
+        parser.add_argument("--prefix", default="load", help="seed_load prefix")
+        parser.add_argument("--password", default="loadtest-password")
+        parser.add_argument(
+            "--concurrency", type=int, default=16, help="Number of virtual users"
+        )
+        parser.add_argument(
+            "--duration", type=float, default=60, help="Seconds to generate load"
+        )
+        parser.add_argument(
+            "--teacher-ratio",
+            type=float,
+            default=0.2,
+            help="Share of virtual users that are teachers",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.base_url = options["base_url"].rstrip("/") + "/"
+        self.password = options["password"]
+        rng = random.Random(options["seed"])
+
+        users = self.prepare_users(rng, options)
+        self.files = {
+            False: ("answer.docx", make_docx(rng)),
+            True: ("scan.png", make_png(rng)),
+        }
+        deadline = time.monotonic() + options["duration"]
+        threads = [
+            threading.Thread(
+                target=self.run_user,
+                args=(user, random.Random(rng.random()), deadline),
+                daemon=True,
+            )
+            for user in users
+        ]
+
+        self.stdout.write(
+            f"Running {len(users)} virtual users against {self.base_url} "
+            f"for {options['duration']:.0f}s"
+        )
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.monotonic() - started
+
+        self.report([sample for user in users for sample in user.samples], elapsed)
+
+    def prepare_users(self, rng, options) -> list[VirtualUser]:
+        prefix = options["prefix"]
+        teachers = list(
+            User.objects.filter(email__startswith=f"{prefix}-teacher-").values_list(
+                "id", "email"
+            )
+        )
+        students = list(
+            User.objects.filter(email__startswith=f"{prefix}-student-").values_list(
+                "id", "email"
+            )
+        )
+        if not teachers or not students:
+            raise CommandError(
+                f"No users with the prefix '{prefix}', run seed_load first"
+            )
+
+        users = []
+        teacher_count = round(options["concurrency"] * options["teacher_ratio"])
+        for index in range(options["concurrency"]):
+            if index < teacher_count:
+                users.append(self.prepare_teacher(*rng.choice(teachers)))
+            else:
+                users.append(self.prepare_student(*rng.choice(students)))
+        return users
+
+    def prepare_teacher(self, user_id, email) -> VirtualUser:
+        class_ids = list(
+            Class.objects.filter(teacher_id=user_id).values_list("id", flat=True)
+        )
+        assignments = list(
+            Assignment.objects.filter(classroom__teacher_id=user_id).values_list(
+                "id", "classroom_id"
+            )
+        )
+        submissions = list(
+            Submission.objects.filter(
+                assignment__classroom__teacher_id=user_id
+            ).values_list("id", "assignment__max_score")[:1000]
+        )
+        return VirtualUser(email, "teacher", class_ids, assignments, submissions)
+
+    def prepare_student(self, user_id, email) -> VirtualUser:
+        class_ids = list(
+            Class.objects.filter(classmembership__student_id=user_id).values_list(
+                "id", flat=True
+            )
+        )
+        assignments = list(
+            Assignment.objects.filter(classroom_id__in=class_ids).values_list(
+                "id", "classroom_id"
+            )
+        )
+        open_ids = list(
+            Assignment.objects.filter(
+                classroom_id__in=class_ids, deadline__gt=timezone.now()
+            )
+            .exclude(submissions__student_id=user_id)
+            .values_list("id", flat=True)
+        )
+        return VirtualUser(email, "student", class_ids, assignments, open_ids)
+
+    def run_user(self, user: VirtualUser, rng: random.Random, deadline: float):
+        session = requests.Session()
+        self.login(session, user)
+        mix = TEACHER_MIX if user.role == "teacher" else STUDENT_MIX
+        actions, weights = list(mix), list(mix.values())
+        while time.monotonic() < deadline:
+            action = rng.choices(actions, weights)[0]
+            getattr(self, action)(session, user, rng)
+
+    def timed(self, user, name, send):
+        started = time.perf_counter()
+        try:
+            response = send()
+            ok = response.status_code < 400
+        except requests.exceptions.RequestException:
+            response, ok = None, False
+        user.samples.append((name, (time.perf_counter() - started) * 1000, ok))
+        return response if ok else None
+
+    def get(self, session, user, name, path):
+        return self.timed(
+            user,
+            name,
+            lambda: session.get(
+                self.base_url + path,
+                headers={"Authorization": f"Bearer {user.token}"},
+            ),
+        )
+
+    def login(self, session, user, rng=None):
+        response = self.timed(
+            user,
+            "login",
+            lambda: session.post(
+                self.base_url + "accounts/login/",
+                json={"email": user.email, "password": self.password},
+            ),
+        )
+        if response is not None:
+            user.token = response.json()["access"]
+
+    def list_classes(self, session, user, rng):
+        self.get(session, user, "list_classes", "classes/")
+
+    def class_detail(self, session, user, rng):
+        if user.class_ids:
+            class_id = rng.choice(user.class_ids)
+            self.get(session, user, "class_detail", f"classes/{class_id}/")
+
+    def list_assignments(self, session, user, rng):
+        if user.class_ids:
+            class_id = rng.choice(user.class_ids)
+            self.get(
+                session, user, "list_assignments", f"assignments/class/{class_id}/"
+            )
+
+    def list_submissions(self, session, user, rng):
+        if user.assignments:
+            assignment_id, _ = rng.choice(user.assignments)
+            self.get(
+                session,
+                user,
+                "list_submissions",
+                f"assignments/submissions/{assignment_id}/",
+            )
+
+    def mark(self, session, user, rng):
+        if user.targets:
+            submission_id, max_score = rng.choice(user.targets)
+            self.timed(
+                user,
+                "mark",
+                lambda: session.patch(
+                    self.base_url + f"assignments/mark/{submission_id}/",
+                    json={"score": rng.randint(0, max_score * 4) / 4},
+                    headers={"Authorization": f"Bearer {user.token}"},
+                ),
+            )
+
+    def submit(self, session, user, rng):
+        # Each open assignment can be submitted once
+        if not user.targets:
+            return
+        assignment_id = user.targets.pop(rng.randrange(len(user.targets)))
+        handwritten = rng.random() < 0.3
+        filename, content = self.files[handwritten]
+        self.timed(
+            user,
+            "submit",
+            lambda: session.post(
+                self.base_url + f"assignments/submit/{assignment_id}/",
+                data={"is_hand_written": str(handwritten).lower()},
+                files={"submitted_file": (filename, content)},
+                headers={"Authorization": f"Bearer {user.token}"},
+            ),
+        )
+
+    def report(self, samples, elapsed):
+        by_endpoint = {}
+        for name, duration_ms, ok in samples:
+            by_endpoint.setdefault(name, []).append((duration_ms, ok))
+
+        self.stdout.write(
+            f"{'endpoint':<18}{'requests':>9}{'errors':>8}{'req/s':>9}"
+            f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+        )
+        rows = sorted(by_endpoint.items()) + [
+            ("total", [(duration_ms, ok) for _, duration_ms, ok in samples])
+        ]
+        for name, results in rows:
+            durations = sorted(duration_ms for duration_ms, _ in results)
+            errors = sum(1 for _, ok in results if not ok)
+            self.stdout.write(
+                f"{name:<18}{len(results):>9}{errors:>8}"
+                f"{len(results) / elapsed:>9.1f}"
+                f"{percentile(durations, 0.50):>9.1f}"
+                f"{percentile(durations, 0.95):>9.1f}"
+                f"{percentile(durations, 0.99):>9.1f}"
+                f"{(durations[-1] if durations else 0):>9.1f}"
+            )
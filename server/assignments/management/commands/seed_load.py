@@ -0,0 +1,238 @@
+import random
+import time
+from datetime import timedelta
+from itertools import islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from assignments.management.commands.rebuild_counters import rebuild_counters
+from assignments.models import Assignment, Submission
+from assignments.synthetic import make_docx, make_png
+from classes.models import Class, ClassMembership
+from classes.utils import generate_invite_code
+
+User = get_user_model()
+
+# Marks the assignments created here, see seeded_assignments
+SEED_DESCRIPTION = "Generated by seed_load"
+
+
+def seeded_assignments(prefix: str):
+    """Assignments created by seed_load with `prefix`, safe to regrade."""
+    return Assignment.objects.filter(
+        description=SEED_DESCRIPTION,
+        classroom__teacher__email__startswith=f"{prefix}-teacher-",
+    )
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-create a synthetic dataset of users, classes, assignments and "
+        "submissions with generated files, for load testing"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--prefix", default="load", help="Prefix of emails")
+        parser.add_argument("--teachers", type=int, default=20)
+        parser.add_argument("--students", type=int, default=2000)
+        parser.add_argument("--classes-per-teacher", type=int, default=3)
+        parser.add_argument("--students-per-class", type=int, default=60)
+        parser.add_argument("--assignments-per-class", type=int, default=10)
+        parser.add_argument(
+            "--submission-ratio",
+            type=float,
+            default=0.8,
+            help="Share of class members that submit each assignment",
+        )
+        parser.add_argument(
+            "--graded-ratio",
+            type=float,
+            default=0.5,
+            help="Share of submissions that already have a score",
+        )
+        parser.add_argument(
+            "--handwritten-ratio",
+            type=float,
+            default=0.3,
+            help="Share of submissions uploaded as a PNG scan",
+        )
+        parser.add_argument(
+            "--distinct-files",
+            type=int,
+            default=40,
+            help="Number of different docx and PNG files generated and shared "
+            "between rows",
+        )
+        parser.add_argument("--password", default="loadtest-password")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        prefix = options["prefix"]
+        if User.objects.filter(email__startswith=f"{prefix}-").exists():
+            raise CommandError(
+                f"Users with the prefix '{prefix}' already exist, pick another --prefix"
+            )
+
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        started = time.monotonic()
+
+        docx_files, png_files = self.create_files(prefix, options["distinct_files"])
+        with transaction.atomic():
+            password = make_password(options["password"])
+            teachers = self.create_users(
+                prefix, "teacher", options["teachers"], password
+            )
+            students = self.create_users(
+                prefix, "student", options["students"], password
+            )
+            classes = self.create_classes(
+                prefix, teachers, options["classes_per_teacher"]
+            )
+            members = self.create_memberships(
+                classes, students, options["students_per_class"]
+            )
+            assignments = self.create_assignments(
+                classes, options["assignments_per_class"], docx_files
+            )
+            submissions = self.create_submissions(
+                assignments, members, docx_files, png_files, options
+            )
+            rebuild_counters()
+
+        self.stdout.write(
+            f"Seeded {len(teachers)} teachers, {len(students)} students, "
+            f"{len(classes)} classes, {len(assignments)} assignments and "
+            f"{submissions} submissions in {time.monotonic() - started:.1f}s. "
+            f"Log in as {prefix}-teacher-0@example.com or "
+            f"{prefix}-student-0@example.com with password '{options['password']}'."
+        )
+
+    def create_files(self, prefix, count):
+        docx_files, png_files = [], []
+        for index in range(max(1, count)):
+            docx_files.append(
+                default_storage.save(
+                    f"{prefix}/document_{index}.docx",
+                    ContentFile(make_docx(self.rng)),
+                )
+            )
+            png_files.append(
+                default_storage.save(
+                    f"{prefix}/scan_{index}.png", ContentFile(make_png(self.rng))
+                )
+            )
+        return docx_files, png_files
+
+    def create_users(self, prefix, role, count, password):
+        return User.objects.bulk_create(
+            (
+                User(
+                    email=f"{prefix}-{role}-{index}@example.com",
+                    name=f"{role.title()} {index}",
+                    role=role,
+                    password=password,
+                )
+                for index in range(count)
+            ),
+            batch_size=self.batch_size,
+        )
+
+    def create_classes(self, prefix, teachers, per_teacher):
+        invite_codes = set(Class.objects.values_list("invite_code", flat=True))
+        classes = []
+        for teacher in teachers:
+            for index in range(per_teacher):
+                invite_code = generate_invite_code()
+                while invite_code in invite_codes:
+                    invite_code = generate_invite_code()
+                invite_codes.add(invite_code)
+                classes.append(
+                    Class(
+                        name=f"Class {index} of {teacher.name}",
+                        subject=self.rng.choice(
+                            ["Mathematics", "Physics", "Algorithms"]
+                        ),
+                        section=f"{prefix}-{teacher.id}-{index}",
+                        teacher=teacher,
+                        invite_code=invite_code,
+                    )
+                )
+        return Class.objects.bulk_create(classes, batch_size=self.batch_size)
+
+    def create_memberships(self, classes, students, per_class):
+        members = {}
+        for classroom in classes:
+            members[classroom.id] = self.rng.sample(
+                students, min(per_class, len(students))
+            )
+        ClassMembership.objects.bulk_create(
+            (
+                ClassMembership(student=student, classroom_id=class_id)
+                for class_id, class_students in members.items()
+                for student in class_students
+            ),
+            batch_size=self.batch_size,
+        )
+        return members
+
+    def create_assignments(self, classes, per_class, docx_files):
+        now = timezone.now()
+        return Assignment.objects.bulk_create(
+            (
+                Assignment(
+                    classroom=classroom,
+                    name=f"Assignment {index}",
+                    description=SEED_DESCRIPTION,
+                    deadline=now + timedelta(days=self.rng.randint(1, 60)),
+                    task_file=self.rng.choice(docx_files),
+                    solution_file=self.rng.choice(docx_files),
+                    max_score=self.rng.choice([5, 10, 20]),
+                )
+                for classroom in classes
+                for index in range(per_class)
+            ),
+            batch_size=self.batch_size,
+        )
+
+    def create_submissions(self, assignments, members, docx_files, png_files, options):
+        def rows():
+            for assignment in assignments:
+                for student in members[assignment.classroom_id]:
+                    if self.rng.random() >= options["submission_ratio"]:
+                        continue
+                    handwritten = self.rng.random() < options["handwritten_ratio"]
+                    graded = self.rng.random() < options["graded_ratio"]
+                    yield Submission(
+                        assignment=assignment,
+                        student=student,
+                        submitted_file=self.rng.choice(
+                            png_files if handwritten else docx_files
+                        ),
+                        is_hand_written=handwritten,
+                        score=(
+                            self.rng.randint(0, assignment.max_score * 4) / 4
+                            if graded
+                            else None
+                        ),
+                    )
+
+        created = 0
+        # Batches keep memory flat however many submissions are generated
+        for batch in batched(rows(), self.batch_size):
+            Submission.objects.bulk_create(batch)
+            created += len(batch)
+        return created
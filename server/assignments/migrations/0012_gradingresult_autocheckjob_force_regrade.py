@@ -0,0 +1,31 @@
+# Generated by Django 5.2.3 on 2026-10-17 06:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('assignments', '0011_autocheckjob_autochecktask'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GradingResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cache_key', models.CharField(max_length=64, unique=True)),
+                ('score', models.FloatField()),
+                ('model', models.CharField(max_length=255)),
+                ('prompt_version', models.CharField(max_length=32)),
+                ('hit_count', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_hit_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='autocheckjob',
+            name='force_regrade',
+            field=models.BooleanField(default=False),
+        ),
+    ]
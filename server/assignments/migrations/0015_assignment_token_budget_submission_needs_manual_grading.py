@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-17 06:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("assignments", "0014_extractedtext"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="assignment",
+            name="token_budget",
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="submission",
+            name="needs_manual_grading",
+            field=models.BooleanField(default=False),
+        ),
+    ]
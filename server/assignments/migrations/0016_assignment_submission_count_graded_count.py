@@ -0,0 +1,44 @@
+# Generated by Django 5.2.3 on 2026-10-17 06:55
+
+from django.db import migrations, models
+
+
+def populate_counters(apps, schema_editor):
+    Class = apps.get_model("classes", "Class")
+    ClassMembership = apps.get_model("classes", "ClassMembership")
+    Assignment = apps.get_model("assignments", "Assignment")
+    Submission = apps.get_model("assignments", "Submission")
+
+    for classroom in Class.objects.all():
+        classroom.student_count = ClassMembership.objects.filter(
+            classroom=classroom
+        ).count()
+        classroom.save(update_fields=["student_count"])
+
+    for assignment in Assignment.objects.all():
+        submissions = Submission.objects.filter(assignment=assignment)
+        assignment.submission_count = submissions.count()
+        assignment.graded_count = submissions.filter(score__isnull=False).count()
+        assignment.save(update_fields=["submission_count", "graded_count"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("assignments", "0015_assignment_token_budget_submission_needs_manual_grading"),
+        ("classes", "0004_class_student_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="assignment",
+            name="graded_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="assignment",
+            name="submission_count",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:19
+
+import assignments.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("assignments", "0017_assignment_updated_at_submission_updated_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Blob",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sha256", models.CharField(max_length=64, unique=True)),
+                ("size", models.BigIntegerField()),
+                ("ref_count", models.IntegerField(default=0)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name="assignment",
+            name="solution_file_sha256",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.AddField(
+            model_name="assignment",
+            name="task_file_sha256",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.AddField(
+            model_name="submission",
+            name="submitted_file_sha256",
+            field=models.CharField(blank=True, default="", max_length=64),
+        ),
+        migrations.AlterField(
+            model_name="assignment",
+            name="solution_file",
+            field=models.FileField(
+                max_length=1024,
+                storage=assignments.storage.get_upload_storage,
+                upload_to="",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="assignment",
+            name="task_file",
+            field=models.FileField(
+                max_length=1024,
+                storage=assignments.storage.get_upload_storage,
+                upload_to="",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="submission",
+            name="submitted_file",
+            field=models.FileField(
+                max_length=1024,
+                storage=assignments.storage.get_upload_storage,
+                upload_to="",
+            ),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:47
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def complete_duplicate_jobs(apps, schema_editor):
+    # Only the newest active job of an assignment stays active, the tasks of
+    # older ones are still graded
+    AutoCheckJob = apps.get_model("assignments", "AutoCheckJob")
+    active = AutoCheckJob.objects.filter(status__in=["pending", "running"])
+    newest = {}
+    for job_id, assignment_id in active.order_by("created_at", "id").values_list(
+        "id", "assignment_id"
+    ):
+        newest[assignment_id] = job_id
+    active.exclude(id__in=newest.values()).update(
+        status="completed", finished_at=timezone.now()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("assignments", "0019_uploadsession"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(complete_duplicate_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="autocheckjob",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("status__in", ["pending", "running"])),
+                fields=("assignment",),
+                name="one_active_auto_check_job_per_assignment",
+            ),
+        ),
+    ]
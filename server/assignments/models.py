@@ -1,14 +1,67 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.contrib.auth import get_user_model
+from classes import response_cache
 from classes.models import Class
-from assignments.utils import read_file_b64, docx_to_text
+from assignments.utils import read_file_b64
+from assignments import (
+    budget,
+    extraction,
+    grading_cache,
+    http_pool,
+    images,
+    ocr_cache,
+    prompts,
+    reference_cache,
+    scheduler,
+    storage,
+    uploads,
+)
 from django.conf import settings
+from django.utils import timezone
 import requests
 import mimetypes
+import uuid
 
 User = get_user_model()
 
 
+def count_subquery(queryset, field):
+    """
+    Number of rows of `queryset` whose `field` is the outer row, 0 for none.
+    Rebuilds the counters below, and tells deletions apart in ETags.
+    """
+    counted = (
+        queryset.filter(**{field: models.OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(count=models.Count("id"))
+        .values("count")
+    )
+    return Coalesce(
+        models.Subquery(counted, output_field=models.IntegerField()), models.Value(0)
+    )
+
+
+class AssignmentQuerySet(models.QuerySet):
+    def with_user_context(self, user):
+        """
+        Precompute the per-user fields of AssignmentSerializer: the student's
+        own submission for students.
+        """
+        if user.role == "teacher":
+            return self
+        return self.prefetch_related(
+            models.Prefetch(
+                "submissions",
+                queryset=Submission.objects.filter(student_id=user.id),
+                to_attr="user_submissions",
+            )
+        )
+
+
 class Assignment(models.Model):
     classroom = models.ForeignKey(
         Class, on_delete=models.CASCADE, related_name="assignments"
@@ -16,13 +69,41 @@ class Assignment(models.Model):
     name = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     deadline = models.DateTimeField()
-    task_file = models.FileField(max_length=1024)
-    solution_file = models.FileField(max_length=1024)
+    task_file = models.FileField(max_length=1024, storage=storage.get_upload_storage)
+    solution_file = models.FileField(
+        max_length=1024, storage=storage.get_upload_storage
+    )
+    # SHA-256 of the files, "" for files stored before hashing on upload
+    task_file_sha256 = models.CharField(max_length=64, blank=True, default="")
+    solution_file_sha256 = models.CharField(max_length=64, blank=True, default="")
     max_score = models.IntegerField(null=False, blank=False)
+    # Upper bound on the estimated prompt size when auto-checking, in tokens
+    token_budget = models.IntegerField(null=True, blank=True)
+    # Maintained on submit, mark, auto-check and reset, see rebuild_counters
+    submission_count = models.IntegerField(default=0)
+    graded_count = models.IntegerField(default=0)
+    # Queryset updates set it explicitly, auto_now only applies to save()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = AssignmentQuerySet.as_manager()
 
     class Meta:
         unique_together = ("classroom", "name")
 
+    def get_token_budget(self) -> int:
+        return self.token_budget or settings.GRADING_PROMPT_TOKEN_BUDGET
+
+    FILE_FIELDS = ["task_file", "solution_file"]
+
+    def save(self, *args, **kwargs):
+        replaced = storage.replaced_names(self, self.FILE_FIELDS)
+        storage.sync_hashes(self, self.FILE_FIELDS)
+        super().save(*args, **kwargs)
+        storage.release_on_commit(replaced)
+        # Task or solution files may have been replaced
+        reference_cache.invalidate_assignment(self.id)
+        response_cache.class_changed(self.classroom_id)
+
 
 class Submission(models.Model):
     assignment = models.ForeignKey(
@@ -31,15 +112,108 @@ class Submission(models.Model):
     student = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="submissions"
     )
-    submitted_file = models.FileField(max_length=1024)
+    submitted_file = models.FileField(
+        max_length=1024, storage=storage.get_upload_storage
+    )
+    submitted_file_sha256 = models.CharField(max_length=64, blank=True, default="")
     submitted_at = models.DateTimeField(auto_now_add=True)
     score = models.FloatField(null=True, blank=True)
     is_hand_written = models.BooleanField(null=False, blank=False)
+    # Set when auto-checking refused the submission, e.g. over the token
+    # budget, and cleared when it gets a score
+    needs_manual_grading = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    # Whether the last grade_with_openrouter call refused the prompt as too
+    # large, unlike needs_manual_grading which may be left from earlier ones
+    prompt_too_large = False
 
     class Meta:
         unique_together = ("assignment", "student")
 
-    def auto_check(self, assignment: Assignment) -> float | None:
+    FILE_FIELDS = ["submitted_file"]
+
+    def save(self, *args, **kwargs):
+        replaced = storage.replaced_names(self, self.FILE_FIELDS)
+        storage.sync_hashes(self, self.FILE_FIELDS)
+        super().save(*args, **kwargs)
+        storage.release_on_commit(replaced)
+
+    def set_score(self, score: float) -> None:
+        """Save only the score, keeping the assignment's graded_count in step."""
+        now = timezone.now()
+        with transaction.atomic():
+            newly_graded = Submission.objects.filter(
+                id=self.id, score__isnull=True
+            ).update(score=score, needs_manual_grading=False, updated_at=now)
+            if newly_graded:
+                Assignment.objects.filter(id=self.assignment_id).update(
+                    graded_count=models.F("graded_count") + 1, updated_at=now
+                )
+            else:
+                Submission.objects.filter(id=self.id).update(
+                    score=score, needs_manual_grading=False, updated_at=now
+                )
+            response_cache.submissions_changed(
+                self.assignment.classroom_id, [self.student_id]
+            )
+        self.score = score
+        self.needs_manual_grading = False
+        self.updated_at = now
+
+    @staticmethod
+    def set_scores(submissions: list["Submission"], scores: dict[int, float]) -> None:
+        """
+        Save `scores` (by submission id) with one bulk update of the score
+        column, keeping graded_count in step. The submissions must have been
+        loaded inside the caller's transaction.
+        """
+        now = timezone.now()
+        newly_graded = {}
+        for submission in submissions:
+            if submission.score is None:
+                newly_graded[submission.assignment_id] = (
+                    newly_graded.get(submission.assignment_id, 0) + 1
+                )
+            submission.score = scores[submission.id]
+            submission.needs_manual_grading = False
+            submission.updated_at = now
+        Submission.objects.bulk_update(
+            submissions, ["score", "needs_manual_grading", "updated_at"]
+        )
+        for assignment_id, count in newly_graded.items():
+            Assignment.objects.filter(id=assignment_id).update(
+                graded_count=models.F("graded_count") + count, updated_at=now
+            )
+
+        class_ids = dict(
+            Assignment.objects.filter(
+                id__in={submission.assignment_id for submission in submissions}
+            ).values_list("id", "classroom_id")
+        )
+        students_by_class = {}
+        for submission in submissions:
+            students_by_class.setdefault(
+                class_ids[submission.assignment_id], []
+            ).append(submission.student_id)
+        for class_id, student_ids in students_by_class.items():
+            response_cache.submissions_changed(class_id, student_ids)
+
+    def auto_check(
+        self, assignment: Assignment, use_cache: bool = True
+    ) -> float | None:
+        cache_key = grading_cache.make_key(self, assignment)
+        if use_cache and cache_key:
+            cached_score = grading_cache.get_cached_score(cache_key)
+            if cached_score is not None:
+                return cached_score
+
+        score = self.grade_with_openrouter(assignment)
+        if score is not None and cache_key:
+            grading_cache.store_score(cache_key, score)
+        return score
+
+    def grade_with_openrouter(self, assignment: Assignment) -> float | None:
         # Determine MIME types for the files
         task_mime_type, _ = mimetypes.guess_type(assignment.task_file.name)
         solution_mime_type, _ = mimetypes.guess_type(assignment.solution_file.name)
@@ -70,8 +244,23 @@ class Submission(models.Model):
             predicted_text,
         )
 
+        # Refuse oversized prompts before spending a request on them
+        self.prompt_too_large = False
+        try:
+            prompt_parts = budget.fit_to_budget(
+                prompt_parts, assignment.get_token_budget()
+            )
+        except budget.PromptTooLarge as e:
+            print(f"Submission {self.id} needs manual grading: {e}")
+            self.prompt_too_large = True
+            self.needs_manual_grading = True
+            self.save(update_fields=["needs_manual_grading", "updated_at"])
+            return None
+
         try:
             check_response = self.make_openrouter_prediction(prompt_parts)
+            # Release the encoded files before parsing the response
+            del prompt_parts
             check_response.raise_for_status()  # Raises HTTPError for bad responses (4xx or 5xx)
 
             response_json = check_response.json()
@@ -132,10 +321,20 @@ class Submission(models.Model):
         ):
             return ""
 
-        image_b64 = read_file_b64(self.submitted_file)
-        response = requests.post(settings.OCR_PREDICTION_URL, json={"image": image_b64})
+        # Re-grading the same image reuses the stored OCR output
+        image_hash = ocr_cache.cache_key(
+            grading_cache.content_hash(self.submitted_file)
+        )
+        cached_text = ocr_cache.get_cached_text(image_hash)
+        if cached_text is not None:
+            return cached_text
+
+        image_b64 = read_file_b64(images.normalize_for_ocr(self.submitted_file))
+        response = http_pool.post(settings.OCR_PREDICTION_URL, json={"image": image_b64})
         response.raise_for_status()
-        return response.json().get("pred", "")
+        predicted_text = response.json().get("pred", "")
+        ocr_cache.store_text(image_hash, predicted_text)
+        return predicted_text
 
     def build_openrouter_prompt(
         self,
@@ -146,26 +345,37 @@ class Submission(models.Model):
         predicted_text: str,
     ):
         prompt_parts = [
-            {
-                "type": "text",
-                "text": (
-                    f"You are an expert assignment grader for the course {assignment.classroom.subject}. I will provide "
-                    f"you with the assignment's task, a correct solution, and a student's submission. Carefully compare "
-                    f"the student's submission to the task and the provided solution. Your primary goal is to evaluate "
-                    f"accuracy, completeness, and adherence to the task requirements. Assign a numerical score between 0.0 and "
-                    f"{assignment.max_score} (inclusive). Provide ONLY the numerical score in your response, "
-                    f"preceded by the text 'Score: ', for example: 'Score: 85.5'. Do not include any other text, "
-                    f"explanation, or formatting beyond this."
-                ),
-            },
+            {"type": "text", "text": prompts.grading_instructions(assignment)},
             {"type": "text", "text": "Assignment Task:"},
         ]
 
-        self.add_content_part(prompt_parts, task_mime_type, assignment.task_file)
+        # Task and solution parts are identical for every submission of the assignment
+        prompt_parts.append(
+            reference_cache.get_reference_part(
+                assignment,
+                "task",
+                assignment.task_file,
+                task_mime_type,
+                self.build_content_part,
+            )
+        )
         prompt_parts.append({"type": "text", "text": "Reference Solution:"})
-        self.add_content_part(prompt_parts, solution_mime_type, assignment.solution_file)
+        prompt_parts.append(
+            reference_cache.get_reference_part(
+                assignment,
+                "solution",
+                assignment.solution_file,
+                solution_mime_type,
+                self.build_content_part,
+            )
+        )
         prompt_parts.append({"type": "text", "text": "Student Submission:"})
-        self.add_content_part(prompt_parts, submission_mime_type, self.submitted_file)
+        self.add_content_part(
+            prompt_parts,
+            submission_mime_type,
+            self.submitted_file,
+            grayscale=self.is_hand_written,
+        )
 
         # If the submission was handwritten and OCR produced text, include it as additional context for the model
         if self.is_hand_written and predicted_text:
@@ -181,32 +391,34 @@ class Submission(models.Model):
 
         return prompt_parts
 
-    def add_content_part(self, prompt_parts, mime_type, file_field):
-        if (
-            mime_type
-            == "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-        ):
-            text = docx_to_text(file_field)
-            prompt_parts.append({"type": "text", "text": text})
+    def add_content_part(self, prompt_parts, mime_type, file_field, grayscale=False):
+        prompt_parts.append(self.build_content_part(mime_type, file_field, grayscale))
+
+    def build_content_part(self, mime_type, file_field, grayscale=False):
+        text = extraction.extract_text(file_field, mime_type)
+        if text is not None:
+            return {"type": "text", "text": text}
         elif mime_type and mime_type.startswith("image/"):
-            prompt_parts.append(
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:{mime_type};base64,{read_file_b64(file_field)}"
-                    },
-                }
+            image_mime_type, image_file = images.normalize_for_model(
+                file_field, mime_type, grayscale
             )
+            # The prefix is passed in so the encoded file is not copied again
+            return {
+                "type": "image_url",
+                "image_url": {
+                    "url": read_file_b64(
+                        image_file, prefix=f"data:{image_mime_type};base64,"
+                    )
+                },
+            }
         else:
-            prompt_parts.append(
-                {
-                    "type": "text",
-                    "text": (
-                        f"File ({mime_type}) provided as base64 content:\n"
-                        f"{read_file_b64(file_field)}"
-                    ),
-                }
-            )
+            return {
+                "type": "text",
+                "text": read_file_b64(
+                    file_field,
+                    prefix=f"File ({mime_type}) provided as base64 content:\n",
+                ),
+            }
 
     def extract_openrouter_text(self, response_json):
         message_content = (
@@ -225,7 +437,7 @@ class Submission(models.Model):
             )
         return ""
 
-    def make_openrouter_prediction(self, prompt_parts):
+    def make_openrouter_prediction(self, prompt_parts, max_tokens=150):
         if not settings.OPENROUTER_API_KEY:
             raise ValueError("OPENROUTER_API_KEY is not configured")
 
@@ -236,11 +448,183 @@ class Submission(models.Model):
         payload = {
             "model": settings.OPENROUTER_MODEL,
             "messages": [{"role": "user", "content": prompt_parts}],
-            "max_tokens": 150,
+            "max_tokens": max_tokens,
             "temperature": 0,
         }
-        return requests.post(
-            settings.OPENROUTER_API_URL,
-            headers=headers,
-            json=payload,
+        # Sent in chunks with a Content-Length, see JSONBody; encoded once
+        # and resent as is when the scheduler retries
+        body = http_pool.JSONBody(payload)
+        return scheduler.get_scheduler().send(
+            lambda: http_pool.post(
+                settings.OPENROUTER_API_URL, headers=headers, data=body
+            ),
+            scheduler.estimate_tokens(payload),
         )
+
+
+class AutoCheckJob(models.Model):
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_COMPLETED = "completed"
+
+    assignment = models.ForeignKey(
+        Assignment, on_delete=models.CASCADE, related_name="auto_check_jobs"
+    )
+    requested_by = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="auto_check_jobs",
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=(
+            (STATUS_PENDING, "Pending"),
+            (STATUS_RUNNING, "Running"),
+            (STATUS_COMPLETED, "Completed"),
+        ),
+        default=STATUS_PENDING,
+    )
+    total_tasks = models.IntegerField(default=0)
+    completed_tasks = models.IntegerField(default=0)
+    failed_tasks = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    force_regrade = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            # Concurrent requests to auto-check an assignment queue one job
+            models.UniqueConstraint(
+                fields=["assignment"],
+                condition=models.Q(status__in=["pending", "running"]),
+                name="one_active_auto_check_job_per_assignment",
+            )
+        ]
+
+    def __str__(self):
+        return f"AutoCheckJob {self.id} ({self.status})"
+
+
+class AutoCheckTask(models.Model):
+    STATUS_PENDING = "pending"
+    STATUS_RUNNING = "running"
+    STATUS_COMPLETED = "completed"
+    STATUS_FAILED = "failed"
+
+    job = models.ForeignKey(
+        AutoCheckJob, on_delete=models.CASCADE, related_name="tasks"
+    )
+    submission = models.ForeignKey(
+        Submission, on_delete=models.CASCADE, related_name="auto_check_tasks"
+    )
+    status = models.CharField(
+        max_length=10,
+        choices=(
+            (STATUS_PENDING, "Pending"),
+            (STATUS_RUNNING, "Running"),
+            (STATUS_COMPLETED, "Completed"),
+            (STATUS_FAILED, "Failed"),
+        ),
+        default=STATUS_PENDING,
+    )
+    attempts = models.IntegerField(default=0)
+    worker_id = models.CharField(max_length=255, blank=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "claimed_at"])]
+
+    def __str__(self):
+        return f"AutoCheckTask {self.id} ({self.status})"
+
+
+class GradingResult(models.Model):
+    """Score previously obtained for an identical task, solution and submission."""
+
+    cache_key = models.CharField(max_length=64, unique=True)
+    score = models.FloatField()
+    model = models.CharField(max_length=255)
+    prompt_version = models.CharField(max_length=32)
+    hit_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_hit_at = models.DateTimeField(null=True, blank=True)
+
+
+class OCRResult(models.Model):
+    """
+    OCR output for a handwritten image, keyed by the image's SHA-256 and the
+    OCR settings, see ocr_cache.cache_key.
+    """
+
+    image_hash = models.CharField(max_length=64, unique=True)
+    text = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(db_index=True)
+
+
+class ExtractedText(models.Model):
+    """Text extracted from a grading input, keyed by the file's SHA-256."""
+
+    content_hash = models.CharField(max_length=64)
+    extractor = models.CharField(max_length=64)
+    text = models.TextField(blank=True)
+    extraction_ms = models.FloatField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("content_hash", "extractor")
+
+
+@receiver(post_delete, sender=Assignment)
+@receiver(post_delete, sender=Submission)
+def release_files(sender, instance, **kwargs):
+    storage.release_on_commit(
+        [getattr(instance, name).name for name in sender.FILE_FIELDS]
+    )
+
+
+class Blob(models.Model):
+    """
+    A file stored once by ContentAddressedStorage, with the number of file
+    field values that name it. The file is deleted with the last reference.
+    """
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    ref_count = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class UploadSession(models.Model):
+    """
+    A file uploaded in chunks, see assignments.uploads. The bytes received
+    so far are kept under MEDIA_ROOT/UPLOAD_SESSION_DIR until the file is
+    attached to an assignment or a submission.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="upload_sessions"
+    )
+    filename = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    # Bytes received and acknowledged so far
+    offset = models.BigIntegerField(default=0)
+    # SHA-256 of the file, set when its last chunk is received
+    sha256 = models.CharField(max_length=64, blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def is_complete(self) -> bool:
+        return self.offset == self.size
+
+
+@receiver(post_delete, sender=UploadSession)
+def remove_upload_data(sender, instance, **kwargs):
+    uploads.remove_data(instance)
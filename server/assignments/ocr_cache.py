@@ -0,0 +1,58 @@
+import hashlib
+
+from django.conf import settings
+from django.utils import timezone
+
+# Bump whenever the OCR service or the way its images are prepared (see
+# images.normalize_for_ocr) changes, so text read the old way is not reused.
+OCR_VERSION = "1"
+
+
+def cache_key(image_hash: str) -> str:
+    """Key of the OCR output for the original image with SHA-256 `image_hash`."""
+    parts = [
+        image_hash,
+        OCR_VERSION,
+        settings.OCR_PREDICTION_URL,
+        str(settings.GRADING_IMAGE_MAX_DIMENSION),
+        settings.GRADING_OCR_IMAGE_FORMAT,
+        str(settings.GRADING_IMAGE_QUALITY),
+    ]
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+def get_cached_text(image_hash: str) -> str | None:
+    from assignments.models import OCRResult
+
+    result = OCRResult.objects.filter(image_hash=image_hash).first()
+    if result is None:
+        return None
+    OCRResult.objects.filter(id=result.id).update(last_used_at=timezone.now())
+    return result.text
+
+
+def store_text(image_hash: str, text: str) -> None:
+    from assignments.models import OCRResult
+
+    if len(text) > settings.OCR_CACHE_MAX_TEXT_LENGTH:
+        return
+    OCRResult.objects.update_or_create(
+        image_hash=image_hash,
+        defaults={"text": text, "last_used_at": timezone.now()},
+    )
+    evict()
+
+
+def evict() -> int:
+    """Delete the least recently used entries above OCR_CACHE_MAX_ENTRIES."""
+    from assignments.models import OCRResult
+
+    stale_ids = list(
+        OCRResult.objects.order_by("-last_used_at").values_list("id", flat=True)[
+            settings.OCR_CACHE_MAX_ENTRIES :
+        ]
+    )
+    if not stale_ids:
+        return 0
+    deleted, _ = OCRResult.objects.filter(id__in=stale_ids).delete()
+    return deleted
@@ -0,0 +1,16 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class AssignmentCursorPagination(CursorPagination):
+    ordering = "id"
+    page_size = settings.ASSIGNMENT_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.MAX_PAGE_SIZE
+
+
+class SubmissionCursorPagination(CursorPagination):
+    ordering = "id"
+    page_size = settings.SUBMISSION_PAGE_SIZE
+    page_size_query_param = "page_size"
+    max_page_size = settings.MAX_PAGE_SIZE
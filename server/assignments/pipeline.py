@@ -0,0 +1,65 @@
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BoundedPipeline:
+    """
+    Thread pool that applies backpressure: `submit` blocks while the number
+    of in-flight items or their combined payload size is at its limit.
+    """
+
+    def __init__(self, max_in_flight: int, max_in_flight_bytes: int):
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_bytes = max_in_flight_bytes
+        self.in_flight = 0
+        self.in_flight_bytes = 0
+        self._condition = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._executor.shutdown(wait=True)
+
+    def free_slots(self) -> int:
+        with self._condition:
+            return self.max_in_flight - self.in_flight
+
+    def wait_for_slot(self) -> None:
+        with self._condition:
+            while self.in_flight >= self.max_in_flight:
+                self._condition.wait()
+
+    def drain(self) -> None:
+        with self._condition:
+            while self.in_flight:
+                self._condition.wait()
+
+    def submit(self, fn, item, cost_bytes: int) -> None:
+        with self._condition:
+            # An item larger than the whole budget still runs, but on its own
+            while self.in_flight >= self.max_in_flight or (
+                self.in_flight
+                and self.in_flight_bytes + cost_bytes > self.max_in_flight_bytes
+            ):
+                self._condition.wait()
+            self.in_flight += 1
+            self.in_flight_bytes += cost_bytes
+
+        future = self._executor.submit(fn, item)
+        future.add_done_callback(lambda future: self._done(future, cost_bytes))
+
+    def _done(self, future, cost_bytes: int) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self.in_flight_bytes -= cost_bytes
+            self._condition.notify_all()
+        # Nobody waits on the future, so its exception would go unnoticed
+        error = None if future.cancelled() else future.exception()
+        if error is not None:
+            print(
+                "Pipeline item failed: "
+                + "".join(traceback.format_exception(error)).rstrip()
+            )
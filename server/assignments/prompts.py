@@ -0,0 +1,48 @@
+"""
+Instructions opening the grading prompts, shared by single and batched
+grading so that both judge submissions by the same criteria. Scores are
+cached per grading_cache.PROMPT_VERSION, to bump when these change.
+"""
+
+
+def grading_instructions(assignment, batch_size: int | None = None) -> str:
+    """
+    Instructions for grading one submission, answered with 'Score: X', or
+    `batch_size` submissions labelled with their ids, answered with JSON.
+    """
+    if batch_size is None:
+        submissions = "a student's submission"
+        comparison = (
+            "Carefully compare the student's submission to the task and the "
+            "provided solution."
+        )
+        scored = "Assign a numerical score"
+        response_format = (
+            "Provide ONLY the numerical score in your response, preceded by "
+            "the text 'Score: ', for example: 'Score: 85.5'."
+        )
+    else:
+        submissions = (
+            f"{batch_size} student submissions, each labelled with its "
+            "submission id"
+        )
+        comparison = (
+            "Grade every submission independently by comparing it to the task "
+            "and the provided solution."
+        )
+        scored = "Assign each submission a numerical score"
+        response_format = (
+            "Respond ONLY with JSON of the form "
+            '{"scores": [{"submission_id": 12, "score": 85.5}]} containing one '
+            "entry per submission."
+        )
+
+    return (
+        f"You are an expert assignment grader for the course "
+        f"{assignment.classroom.subject}. I will provide you with the "
+        f"assignment's task, a correct solution, and {submissions}. "
+        f"{comparison} Your primary goal is to evaluate accuracy, completeness, "
+        f"and adherence to the task requirements. {scored} between 0.0 and "
+        f"{assignment.max_score} (inclusive). {response_format} Do not include "
+        f"any other text, explanation, or formatting beyond this."
+    )
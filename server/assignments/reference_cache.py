@@ -0,0 +1,163 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from assignments.storage import recorded_sha256
+from assignments.utils import file_sha256
+
+
+class LRUByteCache:
+    """Thread-safe LRU cache bounded by the total size of its values."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries: OrderedDict[str, tuple[object, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: str, value, size: int) -> None:
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.current_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.current_bytes -= entry[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+
+_local_cache = LRUByteCache(settings.GRADING_REFERENCE_CACHE_MAX_BYTES)
+
+# (assignment id, role) -> cache key currently in use for that file
+_assignment_keys: dict[tuple[int, str], str] = {}
+_compute_locks: dict[str, threading.Lock] = {}
+_index_lock = threading.Lock()
+
+
+def _shared_cache():
+    alias = settings.GRADING_REFERENCE_CACHE_ALIAS
+    return caches[alias] if alias else None
+
+
+def file_identity(file_field) -> str:
+    """
+    Identify a stored file by its recorded content hash, or else by name,
+    size and modification time. Storages that cannot report a modification
+    time fall back to hashing the content.
+    """
+    digest = recorded_sha256(file_field)
+    if digest:
+        return f"sha256:{digest}"
+    storage = file_field.storage
+    try:
+        modified = storage.get_modified_time(file_field.name).timestamp()
+        size = storage.size(file_field.name)
+        return f"{file_field.name}:{size}:{modified}"
+    except NotImplementedError:
+        return f"sha256:{file_sha256(file_field)}"
+
+
+def _part_size(part: dict) -> int:
+    if part.get("type") == "image_url":
+        return len(part["image_url"]["url"])
+    return len(part.get("text", ""))
+
+
+def get_reference_part(assignment, role: str, file_field, mime_type: str, build):
+    """
+    Return the prompt part for an assignment's task or solution file, building
+    it with `build(mime_type, file_field)` only on a cache miss.
+    """
+    identity = f"{role}:{mime_type}:{file_identity(file_field)}"
+    key = "reference-part:" + hashlib.sha256(identity.encode()).hexdigest()
+    _track_key(assignment.id, role, key)
+
+    part = _local_cache.get(key)
+    if part is not None:
+        return part
+
+    with _index_lock:
+        compute_lock = _compute_locks.setdefault(key, threading.Lock())
+
+    # Only one thread builds a given part; the others wait and reuse it
+    with compute_lock:
+        part = _local_cache.get(key)
+        if part is not None:
+            return part
+
+        shared = _shared_cache()
+        if shared is not None:
+            part = shared.get(key)
+
+        if part is None:
+            part = build(mime_type, file_field)
+            if shared is not None:
+                shared.set(key, part, settings.GRADING_REFERENCE_CACHE_TIMEOUT)
+
+        _local_cache.set(key, part, _part_size(part))
+
+    with _index_lock:
+        _compute_locks.pop(key, None)
+    return part
+
+
+def _track_key(assignment_id: int, role: str, key: str) -> None:
+    with _index_lock:
+        previous = _assignment_keys.get((assignment_id, role))
+        _assignment_keys[(assignment_id, role)] = key
+        unused = _unreferenced([previous]) if previous not in (None, key) else []
+    for unused_key in unused:
+        _drop(unused_key)
+
+
+def _unreferenced(keys) -> list[str]:
+    # Assignments with the same file share a key; it stays while any uses it
+    referenced = set(_assignment_keys.values())
+    return [key for key in keys if key not in referenced]
+
+
+def _drop(key: str) -> None:
+    _local_cache.delete(key)
+    shared = _shared_cache()
+    if shared is not None:
+        shared.delete(key)
+
+
+def invalidate_assignment(assignment_id: int) -> None:
+    """
+    Forget the cached task and solution parts of an assignment, keeping
+    those still used by other assignments.
+    """
+    with _index_lock:
+        keys = [
+            _assignment_keys.pop(slot)
+            for slot in list(_assignment_keys)
+            if slot[0] == assignment_id
+        ]
+        unused = _unreferenced(keys)
+    for key in unused:
+        _drop(key)
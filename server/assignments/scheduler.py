@@ -0,0 +1,210 @@
+import math
+import random
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+from email.utils import parsedate_to_datetime
+
+import requests
+from django.conf import settings
+
+from assignments.budget import estimate_prompt_tokens
+
+
+class TokenBucket:
+    """Allows `per_minute` units per minute; a non-positive rate means unlimited."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.tokens = per_minute
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1) -> None:
+        if self.rate <= 0:
+            return
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated_at) * self.rate
+                )
+                self.updated_at = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD concurrency limit: grows by one slot per window of successful
+    requests and halves whenever the provider throttles or fails.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self) -> None:
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def on_success(self) -> None:
+        with self._condition:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+    def on_throttle(self) -> None:
+        with self._condition:
+            self.limit = max(self.minimum, self.limit / 2)
+
+
+def parse_retry_after(response: requests.Response) -> float | None:
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        pass
+    else:
+        # float() also reads "inf" and "nan"
+        return max(0.0, seconds) if math.isfinite(seconds) else None
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(dt_timezone.utc)).total_seconds())
+
+
+def estimate_tokens(payload: dict) -> int:
+    """Estimated prompt and completion tokens of a chat completion request."""
+    prompt_tokens = sum(
+        estimate_prompt_tokens(message["content"]) for message in payload["messages"]
+    )
+    return prompt_tokens + payload.get("max_tokens", 0)
+
+
+class RequestScheduler:
+    def __init__(
+        self,
+        requests_per_minute: float,
+        tokens_per_minute: float,
+        initial_concurrency: int,
+        min_concurrency: int,
+        max_concurrency: int,
+        max_retries: int,
+        backoff_base: float,
+        backoff_max: float,
+    ):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.limiter = AdaptiveConcurrencyLimiter(
+            initial_concurrency, min_concurrency, max_concurrency
+        )
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._paused_until = 0.0
+        self._pause_lock = threading.Lock()
+
+    def backoff(self, attempt: int) -> float:
+        # Full jitter keeps retrying threads from hitting the provider in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2**attempt))
+
+    def pause(self, seconds: float) -> None:
+        with self._pause_lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def wait_if_paused(self) -> None:
+        while True:
+            with self._pause_lock:
+                remaining = self._paused_until - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(remaining)
+
+    def send(self, send_request, estimated_tokens: int) -> requests.Response:
+        """
+        Call `send_request()` within the configured rate limits, retrying
+        throttled (429), server error (5xx) and network failures.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.wait_if_paused()
+            self.request_bucket.acquire(1)
+            self.token_bucket.acquire(estimated_tokens)
+
+            self.limiter.acquire()
+            try:
+                response = send_request()
+            except requests.exceptions.RequestException as e:
+                self.limiter.on_throttle()
+                if attempt == self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+                print(f"OpenRouter request failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+            finally:
+                self.limiter.release()
+
+            if response.status_code != 429 and response.status_code < 500:
+                self.limiter.on_success()
+                return response
+
+            self.limiter.on_throttle()
+            if attempt == self.max_retries:
+                return response
+
+            retry_after = parse_retry_after(response)
+            # A longer wait asked by the server must not hold the thread
+            delay = (
+                min(retry_after, self.backoff_max)
+                if retry_after is not None
+                else self.backoff(attempt)
+            )
+            if response.status_code == 429:
+                # The limit is shared by every thread, so all of them back off
+                self.pause(delay)
+            print(
+                f"OpenRouter returned {response.status_code}, retrying in {delay:.1f}s"
+            )
+            time.sleep(delay)
+
+        raise AssertionError("unreachable")
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> RequestScheduler:
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = RequestScheduler(
+                    requests_per_minute=settings.OPENROUTER_REQUESTS_PER_MINUTE,
+                    tokens_per_minute=settings.OPENROUTER_TOKENS_PER_MINUTE,
+                    initial_concurrency=settings.OPENROUTER_INITIAL_CONCURRENCY,
+                    min_concurrency=settings.OPENROUTER_MIN_CONCURRENCY,
+                    max_concurrency=settings.OPENROUTER_MAX_CONCURRENCY,
+                    max_retries=settings.OPENROUTER_MAX_RETRIES,
+                    backoff_base=settings.OPENROUTER_BACKOFF_BASE,
+                    backoff_max=settings.OPENROUTER_BACKOFF_MAX,
+                )
+    return _scheduler
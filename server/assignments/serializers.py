@@ -1,26 +1,58 @@
 from rest_framework import serializers
-from .models import Assignment, Submission
+from . import downloads
+from .models import Assignment, AutoCheckJob, Submission, UploadSession
+from django.conf import settings
 from django.contrib.auth import get_user_model
 
 User = get_user_model()
 
 
+class DownloadURLsMixin:
+    """
+    Represent the file fields named in `download_kinds` (field -> kind) by
+    the requesting user's download URL, see downloads.file_url.
+    """
+
+    download_kinds: dict[str, str] = {}
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        request = self.context.get("request")
+        for field, kind in self.download_kinds.items():
+            data[field] = (
+                downloads.file_url(request, kind, instance) if request else None
+            )
+        return data
+
+
 class StudentSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ["id", "name", "email"]
 
 
-class CreateAssignmentSerializer(serializers.ModelSerializer):
+class CreateAssignmentSerializer(DownloadURLsMixin, serializers.ModelSerializer):
+    download_kinds = {"task_file": "task", "solution_file": "solution"}
+
     class Meta:
         model = Assignment
-        fields = ["name", "description", "max_score", "deadline", "task_file", "solution_file"]
+        fields = [
+            "name",
+            "description",
+            "max_score",
+            "deadline",
+            "task_file",
+            "solution_file",
+            "token_budget",
+        ]
 
 
 class AssignmentSerializer(serializers.ModelSerializer):
     submitted = serializers.SerializerMethodField()
+    task_file = serializers.SerializerMethodField()
     solution_file = serializers.SerializerMethodField()
     submission_count = serializers.SerializerMethodField()
+    graded_count = serializers.SerializerMethodField()
     user_submission = serializers.SerializerMethodField()
 
     class Meta:
@@ -36,58 +68,69 @@ class AssignmentSerializer(serializers.ModelSerializer):
             "solution_file",
             "submitted",
             "submission_count",
+            "graded_count",
             "user_submission",
         ]
 
+    def get_user_submission_obj(self, obj):
+        user = self.context["request"].user
+        # Supplied by Assignment.objects.with_user_context()
+        if hasattr(obj, "user_submissions"):
+            return obj.user_submissions[0] if obj.user_submissions else None
+        return Submission.objects.filter(assignment=obj, student_id=user.id).first()
+
     def get_submitted(self, obj):
         user = self.context["request"].user
         if user.role == "student":
-            return Submission.objects.filter(assignment=obj, student=user).exists()
+            return self.get_user_submission_obj(obj) is not None
         return None
 
     def get_user_submission(self, obj):
         user = self.context["request"].user
         if user.role == "student":
-            try:
-                submission = Submission.objects.get(assignment=obj, student=user)
-                return {
-                    "id": submission.id,
-                    "submitted_file": (
-                        self.context["request"].build_absolute_uri(
-                            submission.submitted_file.url
-                        )
-                        if submission.submitted_file
-                        else None
-                    ),
-                    "submitted_at": submission.submitted_at,
-                    "is_hand_written": submission.is_hand_written,
-                    "score": submission.score,
-                }
-            except Submission.DoesNotExist:
+            submission = self.get_user_submission_obj(obj)
+            if submission is None:
                 return None
+            return {
+                "id": submission.id,
+                "submitted_file": downloads.file_url(
+                    self.context["request"], "submission", submission
+                ),
+                "submitted_at": submission.submitted_at,
+                "is_hand_written": submission.is_hand_written,
+                "score": submission.score,
+            }
         return None
 
+    def get_task_file(self, obj):
+        return downloads.file_url(self.context["request"], "task", obj)
+
     def get_solution_file(self, obj):
         user = self.context["request"].user
         if user.role == "teacher":
-            request = self.context["request"]
-            return (
-                request.build_absolute_uri(obj.solution_file.url)
-                if obj.solution_file
-                else None
-            )
+            return downloads.file_url(self.context["request"], "solution", obj)
         return None
 
     def get_submission_count(self, obj):
         user = self.context["request"].user
         if user.role == "teacher":
-            return obj.submissions.count()
+            return obj.submission_count
+        return None
+
+    def get_graded_count(self, obj):
+        user = self.context["request"].user
+        if user.role == "teacher":
+            return obj.graded_count
         return None
 
 
-class SubmissionSerializer(serializers.ModelSerializer):
+class SubmissionSerializer(DownloadURLsMixin, serializers.ModelSerializer):
     student = StudentSerializer(read_only=True)
-    submitted_file_url = serializers.SerializerMethodField()
+    submitted_file_url = serializers.FileField(source="submitted_file", read_only=True)
+    download_kinds = {
+        "submitted_file": "submission",
+        "submitted_file_url": "submission",
+    }
 
     class Meta:
         model = Submission
@@ -99,31 +142,89 @@ class SubmissionSerializer(serializers.ModelSerializer):
             "submitted_at",
             "score",
             "is_hand_written",
+            "needs_manual_grading",
         ]
 
-    def get_submitted_file_url(self, obj):
-        if obj.submitted_file:
-            request = self.context.get("request")
-            return (
-                request.build_absolute_uri(obj.submitted_file.url)
-                if request
-                else obj.submitted_file.url
+
+class SubmissionScoreSerializer(serializers.Serializer):
+    submission_id = serializers.IntegerField()
+    score = serializers.FloatField(min_value=0)
+
+
+class BulkMarkSerializer(serializers.Serializer):
+    scores = serializers.ListField(
+        child=SubmissionScoreSerializer(), allow_empty=False, max_length=1000
+    )
+
+    def validate_scores(self, value):
+        max_score = self.context["assignment"].max_score
+        submission_ids = [entry["submission_id"] for entry in value]
+        if len(set(submission_ids)) != len(submission_ids):
+            raise serializers.ValidationError("Each submission can be scored once")
+        over = [entry["submission_id"] for entry in value if entry["score"] > max_score]
+        if over:
+            raise serializers.ValidationError(
+                f"Scores must not exceed {max_score}, see submissions {over}"
             )
-        return None
+        return value
+
 
+class SubmissionCreateSerializer(DownloadURLsMixin, serializers.ModelSerializer):
+    download_kinds = {"submitted_file": "submission"}
 
-class SubmissionCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Submission
         fields = ["submitted_file", "is_hand_written"]
 
 
-class StudentSubmissionStatusSerializer(serializers.ModelSerializer):
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ["id", "filename", "size", "offset", "created_at"]
+        read_only_fields = ["offset", "created_at"]
+
+    def validate_size(self, value):
+        if value < 1:
+            raise serializers.ValidationError("Files must not be empty")
+        if value > settings.UPLOAD_SESSION_MAX_SIZE:
+            raise serializers.ValidationError(
+                f"Files must not exceed {settings.UPLOAD_SESSION_MAX_SIZE} bytes"
+            )
+        return value
+
+
+class StudentSubmissionStatusSerializer(DownloadURLsMixin, serializers.ModelSerializer):
     submitted = serializers.SerializerMethodField()
+    download_kinds = {"submitted_file": "submission"}
 
     class Meta:
         model = Submission
-        fields = ["submitted_files", "submitted_at", "score", "submitted"]
+        fields = ["submitted_file", "submitted_at", "score", "submitted"]
 
     def get_submitted(self, obj):
         return True if obj.submitted_at else False
+
+
+class AutoCheckJobSerializer(serializers.ModelSerializer):
+    progress = serializers.SerializerMethodField()
+
+    class Meta:
+        model = AutoCheckJob
+        fields = [
+            "id",
+            "assignment",
+            "status",
+            "total_tasks",
+            "completed_tasks",
+            "failed_tasks",
+            "progress",
+            "force_regrade",
+            "created_at",
+            "started_at",
+            "finished_at",
+        ]
+
+    def get_progress(self, obj):
+        if not obj.total_tasks:
+            return 1.0
+        return (obj.completed_tasks + obj.failed_tasks) / obj.total_tasks
@@ -0,0 +1,232 @@
+"""
+Content-addressed storage of uploaded task, solution and submission files.
+
+Each distinct content is written once, to blobs/<aa>/<sha256> under
+MEDIA_ROOT, and a Blob row counts the file fields naming it. The name
+stored in a file field is that path followed by the upload's file name,
+which is only kept for downloads. Uploads arrive already hashed by the
+upload handlers below, so storing a file reads it only once. Names
+outside blobs/ are files stored before: they are read as plain files and
+never deleted, as they are not counted.
+
+The bytes follow the Blob rows: they are removed once the transaction
+releasing the last reference commits, and files are saved inside atomic()
+so that those written by a transaction that rolls back are removed too.
+"""
+
+import hashlib
+import os
+import re
+import threading
+from contextlib import contextmanager
+
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import (
+    MemoryFileUploadHandler,
+    TemporaryFileUploadHandler,
+)
+from django.db import transaction
+from django.db.models import F
+
+BLOB_NAME_PATTERN = re.compile(r"^blobs/[0-9a-f]{2}/([0-9a-f]{64})/[^/]+$")
+
+# Per thread, the hashes of the blob files written inside each open atomic()
+_written_blobs = threading.local()
+
+
+class HashingUploadMixin:
+    """Compute the SHA-256 of an upload while it is received."""
+
+    def new_file(self, *args, **kwargs):
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.sha256 = self.sha256.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadMixin, TemporaryFileUploadHandler):
+    pass
+
+
+def hash_from_name(name: str) -> str:
+    """The content hash in a content-addressed name, "" for other names."""
+    match = BLOB_NAME_PATTERN.match(name or "")
+    return match.group(1) if match else ""
+
+
+def content_sha256(content) -> str:
+    """Hash of a file about to be stored, reusing the upload handler's."""
+    digest = getattr(content, "sha256", None)
+    if digest:
+        return digest
+    hasher = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        hasher.update(chunk)
+    content.seek(0)
+    content.sha256 = hasher.hexdigest()
+    return content.sha256
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def blob_name(self, digest: str) -> str:
+        return f"blobs/{digest[:2]}/{digest}"
+
+    def physical_name(self, name: str) -> str:
+        """Path of the stored bytes relative to the storage root."""
+        digest = hash_from_name(name)
+        return self.blob_name(digest) if digest else name
+
+    def path(self, name):
+        return super().path(self.physical_name(name))
+
+    def url(self, name):
+        return super().url(self.physical_name(name))
+
+    def save(self, name, content, max_length=None):
+        from assignments.models import Blob
+
+        digest = content_sha256(content)
+        blob_name = self.blob_name(digest)
+        filename = self.get_valid_name(os.path.basename(name or "")) or "file"
+        if not self.exists(blob_name):
+            self._write_blob(digest, content)
+        blobs = Blob.objects.filter(sha256=digest)
+        with transaction.atomic(savepoint=False):
+            if not blobs.update(ref_count=F("ref_count") + 1):
+                Blob.objects.bulk_create(
+                    [Blob(sha256=digest, size=content.size)], ignore_conflicts=True
+                )
+                blobs.update(ref_count=F("ref_count") + 1)
+            # Released and removed since the check above
+            if not self.exists(blob_name):
+                self._write_blob(digest, content)
+        return f"{blob_name}/{filename}"
+
+    def _write_blob(self, digest, content):
+        blob_name = self.blob_name(digest)
+        content.seek(0)
+        written = self._save(blob_name, content)
+        if written != blob_name:
+            # Lost a race with an identical upload, keep the other copy
+            super().delete(written)
+            return
+        stack = getattr(_written_blobs, "stack", None)
+        if stack:
+            stack[-1].append(digest)
+
+    def delete(self, name):
+        """
+        Release one reference; the bytes go with the last one, together with
+        the normalized copies made for grading, once the release commits.
+        """
+        from assignments.models import Blob
+
+        digest = hash_from_name(name)
+        if not digest:
+            # Files stored before may be shared by rows without being counted
+            return
+        with transaction.atomic(savepoint=False):
+            Blob.objects.filter(sha256=digest).update(ref_count=F("ref_count") - 1)
+            removed, _ = Blob.objects.filter(sha256=digest, ref_count__lte=0).delete()
+            if removed:
+                transaction.on_commit(lambda: self.remove_unreferenced([digest]))
+
+    def remove_unreferenced(self, digests: list[str]) -> None:
+        """Delete the files of the blobs in `digests` that have no Blob row."""
+        from assignments import images
+        from assignments.models import Blob
+
+        referenced = set(
+            Blob.objects.filter(sha256__in=digests).values_list("sha256", flat=True)
+        )
+        for digest in set(digests) - referenced:
+            super().delete(self.blob_name(digest))
+            images.delete_derivatives(digest)
+
+
+upload_storage = ContentAddressedStorage()
+
+
+def get_upload_storage():
+    return upload_storage
+
+
+@contextmanager
+def atomic():
+    """
+    transaction.atomic for saving uploads: the blob files first written
+    inside it are removed when it rolls back, as their Blob rows are. In an
+    outer atomic() they are handed on, as it may still roll back.
+    """
+    stack = _written_blobs.__dict__.setdefault("stack", [])
+    written = []
+    stack.append(written)
+    rolled_back = True
+    try:
+        with transaction.atomic():
+            yield
+            rolled_back = transaction.get_rollback()
+    finally:
+        stack.pop()
+        if rolled_back:
+            # Another transaction may have stored the same file meanwhile
+            upload_storage.remove_unreferenced(written)
+        elif stack:
+            stack[-1].extend(written)
+
+
+def recorded_sha256(field_file) -> str:
+    """
+    The content hash of a stored file as recorded on its model, without
+    reading it; "" when unknown (files stored before hashing existed).
+    """
+    instance = getattr(field_file, "instance", None)
+    field = getattr(field_file, "field", None)
+    recorded = getattr(instance, f"{field.name}_sha256", "") if field else ""
+    return recorded or hash_from_name(field_file.name)
+
+
+def sync_hashes(instance, field_names: list[str]) -> None:
+    """Set the <field>_sha256 columns before the files are saved."""
+    for field_name in field_names:
+        field_file = getattr(instance, field_name)
+        if not field_file:
+            digest = ""
+        elif not field_file._committed:
+            digest = content_sha256(field_file.file)
+        else:
+            digest = hash_from_name(field_file.name)
+        setattr(instance, f"{field_name}_sha256", digest)
+
+
+def replaced_names(instance, field_names: list[str]) -> list[str]:
+    """Stored names that new uploads are about to replace on a saved row."""
+    uploading = [
+        field_name
+        for field_name in field_names
+        if getattr(instance, field_name)
+        and not getattr(instance, field_name)._committed
+    ]
+    if instance.pk is None or not uploading:
+        return []
+    old = type(instance).objects.filter(pk=instance.pk).values(*uploading).first()
+    return [name for name in (old or {}).values() if name]
+
+
+def release_on_commit(names: list[str]) -> None:
+    """Drop a reference to each stored name once the transaction commits."""
+    for name in filter(None, names):
+        transaction.on_commit(lambda name=name: upload_storage.delete(name))
@@ -0,0 +1,48 @@
+"""Generated files for synthetic datasets and load tests."""
+
+import io
+import random
+
+from docx import Document
+from PIL import Image, ImageDraw
+
+WORDS = (
+    "derive integrate matrix vector proof lemma bound limit series function "
+    "graph node edge weight theorem solve equation variable constant sum"
+).split()
+
+
+def random_text(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def make_docx(rng: random.Random, paragraphs: int = 8) -> bytes:
+    document = Document()
+    document.add_heading(random_text(rng, 4).title(), level=1)
+    for _ in range(paragraphs):
+        document.add_paragraph(random_text(rng, rng.randint(30, 90)))
+    table = document.add_table(rows=3, cols=3)
+    for cell in table._cells:
+        cell.text = str(rng.randint(0, 100))
+    output = io.BytesIO()
+    document.save(output)
+    return output.getvalue()
+
+
+def make_png(rng: random.Random, width: int = 1240, height: int = 1754) -> bytes:
+    # A page of "handwriting": dark strokes on an off-white scan background
+    image = Image.new("L", (width, height), rng.randint(225, 250))
+    draw = ImageDraw.Draw(image)
+    for line in range(60, height - 60, 48):
+        x = 60
+        while x < width - 120:
+            length = rng.randint(20, 90)
+            draw.line(
+                (x, line + rng.randint(-4, 4), x + length, line + rng.randint(-4, 4)),
+                fill=rng.randint(10, 60),
+                width=3,
+            )
+            x += length + rng.randint(8, 24)
+    output = io.BytesIO()
+    image.save(output, format="PNG")
+    return output.getvalue()
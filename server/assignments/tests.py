@@ -1,3 +1,1835 @@
-from django.test import TestCase
+import contextlib
+import hashlib
+import http.client
+import io
+import json
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from django.core.servers.basehttp import WSGIServer
+from django.test import LiveServerTestCase, override_settings
+from django.test.testcases import LiveServerThread, QuietWSGIRequestHandler
+from django.utils import timezone
+import requests
+from docx import Document
+from PIL import Image
+from pypdf import PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from assignments import (
+    batch_grading,
+    budget,
+    extraction,
+    grading_cache,
+    grading_stub,
+    http_pool,
+    images,
+    ocr_cache,
+    reference_cache,
+    scheduler,
+    storage,
+    uploads,
+    utils,
+)
+from assignments.jobs import (
+    ScoreWriter,
+    apply_scores,
+    claim_tasks,
+    enqueue_auto_check,
+    renew_leases,
+    requeue_stale_tasks,
+    run_task,
+    run_task_batch,
+)
+from assignments.models import (
+    Assignment,
+    AutoCheckJob,
+    AutoCheckTask,
+    Blob,
+    ExtractedText,
+    GradingResult,
+    OCRResult,
+    Submission,
+    UploadSession,
+)
+from assignments.pipeline import BoundedPipeline
+from assignments.storage import upload_storage
+from assignments.synthetic import make_png
+from classes.models import Class, ClassMembership
+from server.testing import (
+    TEST_CACHES,
+    EndpointBudgetTestCase,
+    SimpleTestCase,
+    TestCase,
+    add_students,
+    seed_assignments,
+    seed_classroom,
+    seed_users,
+    use_temporary_media_root,
+)
+
+
+class AssignmentEndpointBudgetTests(EndpointBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = seed_users("teacher", 1, "asgt")[0]
+        cls.students = seed_users("student", 40, "asgs")
+        cls.classroom = seed_classroom(
+            cls.teacher, cls.students, assignments=8, prefix="asg0"
+        )
+        cls.assignment = cls.classroom.assignments.order_by("id").first()
+        cls.student = cls.students[0]
+        cls.open_assignment = seed_assignments(
+            cls.classroom, cls.students, 1, submitted_ratio=0
+        )[0]
+
+    def grow_class(self):
+        students = seed_users("student", 120, "asgg")
+        add_students(self.classroom, students)
+        seed_assignments(self.classroom, [self.student] + students, 20)
+
+    def grow_submissions(self):
+        students = seed_users("student", 400, "asgm")
+        add_students(self.classroom, students)
+        Submission.objects.bulk_create(
+            [
+                Submission(
+                    assignment=self.assignment,
+                    student=student,
+                    submitted_file=f"seed/{student.id}.pdf",
+                    is_hand_written=False,
+                )
+                for student in students
+            ]
+        )
+
+    def upload(self, name: str) -> SimpleUploadedFile:
+        return SimpleUploadedFile(name, b"%PDF-1.4 test", "application/pdf")
+
+    def test_list_assignments_as_teacher(self):
+        self.assertFlatQueries(
+            self.teacher,
+            f"/assignments/class/{self.classroom.id}/",
+            2,
+            grow=self.grow_class,
+        )
+
+    def test_list_assignments_as_student(self):
+        self.assertFlatQueries(
+            self.student,
+            f"/assignments/class/{self.classroom.id}/",
+            3,
+            grow=self.grow_class,
+        )
+
+    def test_assignment_detail_as_teacher(self):
+        self.assertFlatQueries(
+            self.teacher,
+            f"/assignments/{self.assignment.id}/class/{self.classroom.id}/",
+            2,
+            grow=self.grow_submissions,
+        )
+
+    def test_assignment_detail_as_student(self):
+        self.assertFlatQueries(
+            self.student,
+            f"/assignments/{self.assignment.id}/class/{self.classroom.id}/",
+            3,
+            grow=self.grow_submissions,
+        )
+
+    def test_list_submissions(self):
+        self.assertFlatQueries(
+            self.teacher,
+            f"/assignments/submissions/{self.assignment.id}/",
+            3,
+            grow=self.grow_submissions,
+        )
+
+    def test_student_score(self):
+        response, _ = self.assertWithinBudget(
+            self.student,
+            "get",
+            f"/assignments/score/{self.assignment.id}/",
+            max_queries=1,
+        )
+        self.assertTrue(response.data["submitted"])
+
+    def test_auto_check_job_status(self):
+        job = enqueue_auto_check(self.assignment, self.teacher)
+        self.assertFlatQueries(
+            self.teacher,
+            f"/assignments/auto-check/jobs/{job.id}/",
+            1,
+            grow=self.grow_submissions,
+        )
+
+    def test_create_assignment(self):
+        self.assertWithinBudget(
+            self.teacher,
+            "post",
+            "/assignments/create/",
+            max_queries=8,
+            status_code=201,
+            format="multipart",
+            data={
+                "classroom": self.classroom.id,
+                "name": "Homework",
+                "description": "",
+                "max_score": 10,
+                "deadline": (timezone.now() + timedelta(days=7)).isoformat(),
+                "task_file": self.upload("task.pdf"),
+                "solution_file": self.upload("solution.pdf"),
+            },
+        )
+
+    def test_submit_assignment(self):
+        self.assertWithinBudget(
+            self.student,
+            "post",
+            f"/assignments/submit/{self.open_assignment.id}/",
+            max_queries=9,
+            status_code=201,
+            format="multipart",
+            data={
+                "submitted_file": self.upload("answer.pdf"),
+                "is_hand_written": False,
+            },
+        )
+        self.open_assignment.refresh_from_db()
+        self.assertEqual(self.open_assignment.submission_count, 1)
+
+    def test_mark_submission(self):
+        submission = Submission.objects.filter(
+            assignment=self.assignment, score__isnull=True
+        ).first()
+        self.assertWithinBudget(
+            self.teacher,
+            "patch",
+            f"/assignments/mark/{submission.id}/",
+            max_queries=5,
+            data={"score": 9},
+        )
+        self.assertEqual(
+            Assignment.objects.get(id=self.assignment.id).graded_count,
+            self.assignment.graded_count + 1,
+        )
+
+    def test_auto_check(self):
+        response, _ = self.assertWithinBudget(
+            self.teacher,
+            "post",
+            f"/assignments/{self.assignment.id}/class/{self.classroom.id}/auto-check/",
+            max_queries=7,
+            status_code=202,
+        )
+        self.assertEqual(
+            response.data["total_tasks"],
+            self.assignment.submission_count - self.assignment.graded_count,
+        )
+
+    def test_reset_scores(self):
+        response, _ = self.assertWithinBudget(
+            self.teacher,
+            "post",
+            f"/assignments/{self.assignment.id}/reset-scores/",
+            max_queries=6,
+        )
+        self.assertEqual(response.data["reset_count"], self.assignment.graded_count)
+
+    def test_bulk_mark_submissions(self):
+        submissions = list(
+            Submission.objects.filter(assignment=self.assignment).order_by("id")
+        )
+        ungraded = sum(1 for submission in submissions if submission.score is None)
+        response, _ = self.assertWithinBudget(
+            self.teacher,
+            "post",
+            f"/assignments/{self.assignment.id}/mark/",
+            max_queries=7,
+            format="json",
+            data={
+                "scores": [
+                    {"submission_id": submission.id, "score": 6.5}
+                    for submission in submissions
+                ]
+            },
+        )
+        self.assertEqual(response.data["updated"], len(submissions))
+        self.assertEqual(
+            Assignment.objects.get(id=self.assignment.id).graded_count,
+            self.assignment.graded_count + ungraded,
+        )
+
+    def test_bulk_mark_rejects_scores_over_max_and_foreign_submissions(self):
+        submission = Submission.objects.filter(assignment=self.assignment).first()
+        foreign = Submission.objects.exclude(assignment=self.assignment).first()
+        url = f"/assignments/{self.assignment.id}/mark/"
+        for scores in (
+            [{"submission_id": submission.id, "score": self.assignment.max_score + 1}],
+            [
+                {"submission_id": submission.id, "score": 1},
+                {"submission_id": foreign.id, "score": 1},
+            ],
+        ):
+            self.assertWithinBudget(
+                self.teacher,
+                "post",
+                url,
+                max_queries=4,
+                status_code=400,
+                format="json",
+                data={"scores": scores},
+            )
+        self.assertEqual(
+            Submission.objects.get(id=submission.id).score, submission.score
+        )
+
+    def test_list_submissions_revalidation(self):
+        url = f"/assignments/submissions/{self.assignment.id}/"
+        response, _, _ = self.request(self.teacher, "get", url)
+        etag = response["ETag"]
+        self.assertWithinBudget(
+            self.teacher,
+            "get",
+            url,
+            max_queries=1,
+            status_code=304,
+            HTTP_IF_NONE_MATCH=etag,
+        )
+
+        Submission.objects.filter(assignment=self.assignment).first().set_score(3)
+        response, _ = self.assertWithinBudget(
+            self.teacher, "get", url, max_queries=3, HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertNotEqual(response["ETag"], etag)
+
+
+class FileDownloadTests(EndpointBudgetTestCase):
+    content = bytes(range(256)) * 40
+
+    def setUp(self):
+        self.teacher = seed_users("teacher", 1, "dlt")[0]
+        self.students = seed_users("student", 2, "dls")
+        self.classroom = seed_classroom(
+            self.teacher, self.students, assignments=1, prefix="dl0"
+        )
+        self.assignment = self.classroom.assignments.get()
+        self.assignment.task_file = default_storage.save(
+            "tasks/task.pdf", ContentFile(self.content)
+        )
+        self.assignment.save()
+        self.submission = self.assignment.submissions.get(student=self.students[0])
+        self.submission.submitted_file = default_storage.save(
+            "submissions/answer.png", ContentFile(b"scan")
+        )
+        self.submission.save()
+
+    def detail(self, user):
+        response, _, _ = self.request(
+            user,
+            "get",
+            f"/assignments/{self.assignment.id}/class/{self.classroom.id}/",
+        )
+        return response.data
+
+    def download(self, url, status_code=200, max_queries=1, **headers):
+        # Links are followed without the Authorization header
+        response, _ = self.assertWithinBudget(
+            None,
+            "get",
+            url,
+            max_queries=max_queries,
+            status_code=status_code,
+            **headers,
+        )
+        return response
+
+    def test_download_with_cache_headers(self):
+        url = self.detail(self.students[1])["task_file"]
+        self.assertTrue(url.endswith(os.path.basename(self.assignment.task_file.name)))
+        response = self.download(url)
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        self.assertEqual(response["Content-Length"], str(len(self.content)))
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("private", response["Cache-Control"])
+
+        self.download(url, 304, HTTP_IF_NONE_MATCH=response["ETag"])
+
+    def test_only_safe_types_are_shown_inline(self):
+        response = self.download(self.detail(self.teacher)["task_file"])
+        self.assertEqual(response["Content-Type"], "application/pdf")
+        self.assertTrue(response["Content-Disposition"].startswith("inline"))
+        self.assertEqual(response["X-Content-Type-Options"], "nosniff")
+
+        self.submission.submitted_file = default_storage.save(
+            "submissions/answer.html", ContentFile(b"<script>alert(1)</script>")
+        )
+        self.submission.save()
+        url = self.detail(self.students[0])["user_submission"]["submitted_file"]
+        response = self.download(url)
+        self.assertTrue(response["Content-Disposition"].startswith("attachment"))
+        self.assertEqual(response["X-Content-Type-Options"], "nosniff")
+
+    def test_range_requests(self):
+        url = self.detail(self.teacher)["task_file"]
+        etag = self.download(url)["ETag"]
+
+        response = self.download(url, 206, HTTP_RANGE="bytes=10-19")
+        self.assertEqual(b"".join(response.streaming_content), self.content[10:20])
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(self.content)}")
+        response = self.download(url, 206, HTTP_RANGE="bytes=-5", HTTP_IF_RANGE=etag)
+        self.assertEqual(b"".join(response.streaming_content), self.content[-5:])
+        response = self.download(url, 200, HTTP_RANGE="bytes=0-1", HTTP_IF_RANGE='"x"')
+        self.assertEqual(b"".join(response.streaming_content), self.content)
+        response = self.download(url, 416, HTTP_RANGE=f"bytes={len(self.content)}-")
+        self.assertEqual(response["Content-Range"], f"bytes */{len(self.content)}")
+
+    def test_urls_are_signed_per_user(self):
+        teacher_url = self.detail(self.teacher)["solution_file"]
+        self.assertIsNone(self.detail(self.students[0])["solution_file"])
+        forged = teacher_url.replace(f"/{self.teacher.id}/", f"/{self.students[0].id}/")
+        self.download(forged, 404, max_queries=0)
+
+        submission_url = self.detail(self.students[0])["user_submission"][
+            "submitted_file"
+        ]
+        self.assertEqual(
+            b"".join(self.download(submission_url).streaming_content), b"scan"
+        )
+
+    def test_replaced_file_gets_a_new_url(self):
+        url = self.detail(self.teacher)["task_file"]
+        self.assignment.task_file = default_storage.save(
+            "tasks/task.pdf", ContentFile(b"new")
+        )
+        self.assignment.save()
+        self.download(url, 404)
+        self.assertNotEqual(self.detail(self.teacher)["task_file"], url)
+
+    @override_settings(DOWNLOAD_URL_MAX_AGE=3600)
+    def test_urls_expire(self):
+        url = self.detail(self.teacher)["task_file"]
+        self.assertEqual(url, self.detail(self.teacher)["task_file"])
+
+        # Valid for at least half of the maximum age, never past it
+        now = time.time()
+        with mock.patch("time.time", return_value=now + 1800):
+            self.download(url)
+        with mock.patch("time.time", return_value=now + 3601):
+            self.download(url, 404)
+            self.assertNotEqual(self.detail(self.teacher)["task_file"], url)
+
+    def test_access_is_checked_again(self):
+        url = self.detail(self.students[1])["task_file"]
+        ClassMembership.objects.filter(student=self.students[1]).delete()
+        self.download(url, 404)
+
+    @override_settings(
+        FILE_DELIVERY="x-accel-redirect", FILE_ACCEL_REDIRECT_PREFIX="/protected/"
+    )
+    def test_transfer_offloaded_to_proxy(self):
+        response = self.download(self.detail(self.teacher)["task_file"])
+        self.assertEqual(
+            response["X-Accel-Redirect"], f"/protected/{self.assignment.task_file.name}"
+        )
+        self.assertEqual(response.content, b"")
+
+
+class ContentAddressedStorageTests(EndpointBudgetTestCase):
+    content = b"%PDF-1.4 shared answer"
+
+    def setUp(self):
+        self.teacher = seed_users("teacher", 1, "cat")[0]
+        self.students = seed_users("student", 2, "cas")
+        self.classroom = seed_classroom(
+            self.teacher, self.students, assignments=0, prefix="ca0"
+        )
+        self.assignment = seed_assignments(
+            self.classroom, self.students, 1, submitted_ratio=0
+        )[0]
+
+    def submit(self, student, content, name="answer.pdf"):
+        self.assertWithinBudget(
+            student,
+            "post",
+            f"/assignments/submit/{self.assignment.id}/",
+            max_queries=9,
+            status_code=201,
+            format="multipart",
+            data={
+                "submitted_file": SimpleUploadedFile(name, content),
+                "is_hand_written": False,
+            },
+        )
+        return Submission.objects.get(assignment=self.assignment, student=student)
+
+    def blob_path(self, content):
+        digest = hashlib.sha256(content).hexdigest()
+        return upload_storage.path(upload_storage.blob_name(digest))
+
+    def test_identical_uploads_share_one_blob(self):
+        first = self.submit(self.students[0], self.content)
+        second = self.submit(self.students[1], self.content)
+        digest = hashlib.sha256(self.content).hexdigest()
+
+        self.assertEqual(first.submitted_file_sha256, digest)
+        self.assertEqual(second.submitted_file_sha256, digest)
+        self.assertNotEqual(first.submitted_file.name, "")
+        self.assertEqual(first.submitted_file.path, second.submitted_file.path)
+        self.assertEqual(Blob.objects.get(sha256=digest).ref_count, 2)
+        with first.submitted_file.open("rb") as file:
+            self.assertEqual(file.read(), self.content)
+
+    def test_deleting_rows_releases_the_blob(self):
+        first = self.submit(self.students[0], self.content)
+        second = self.submit(self.students[1], self.content)
+        path = first.submitted_file.path
+        digest = first.submitted_file_sha256
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(Blob.objects.get(sha256=digest).ref_count, 1)
+        self.assertTrue(os.path.exists(path))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(Blob.objects.filter(sha256=digest).exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_storage_urls_name_the_blob(self):
+        submission = self.submit(self.students[0], self.content)
+        digest = hashlib.sha256(self.content).hexdigest()
+        self.assertEqual(
+            submission.submitted_file.url, f"/media/blobs/{digest[:2]}/{digest}"
+        )
+
+    def test_failed_insert_releases_the_files(self):
+        data = {
+            "classroom": self.classroom.id,
+            "name": self.assignment.name,
+            "description": "",
+            "max_score": 10,
+            "deadline": (timezone.now() + timedelta(days=7)).isoformat(),
+            "task_file": SimpleUploadedFile("task.pdf", b"%PDF-1.4 task"),
+            "solution_file": SimpleUploadedFile("solution.pdf", b"%PDF-1.4 key"),
+        }
+        response, _, _ = self.request(
+            self.teacher, "post", "/assignments/create/", format="multipart", data=data
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("name", response.data)
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(self.blob_path(b"%PDF-1.4 task")))
+        self.assertFalse(os.path.exists(self.blob_path(b"%PDF-1.4 key")))
+
+    def test_rolled_back_saves_remove_their_files(self):
+        with self.assertRaises(DatabaseError):
+            with storage.atomic():
+                with storage.atomic():
+                    upload_storage.save("answer.pdf", ContentFile(b"%PDF-1.4 draft"))
+                # The outer transaction rolls back after the inner one ended
+                raise DatabaseError
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(os.path.exists(self.blob_path(b"%PDF-1.4 draft")))
+
+    def test_rolled_back_release_keeps_the_file(self):
+        submission = self.submit(self.students[0], self.content)
+        path = submission.submitted_file.path
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(DatabaseError):
+                with transaction.atomic():
+                    submission.delete()
+                    raise DatabaseError
+        self.assertEqual(callbacks, [])
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertTrue(os.path.exists(path))
+
+    def test_normalized_copies_are_deleted_with_the_source(self):
+        submission = self.submit(
+            self.students[0], make_png(random.Random(0), 200, 300), "scan.png"
+        )
+        image_file = images.normalize_for_ocr(submission.submitted_file)
+        image_file.close()
+        self.assertTrue(default_storage.exists(image_file.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            submission.delete()
+        self.assertFalse(default_storage.exists(image_file.name))
+
+
+class ChunkedUploadTests(EndpointBudgetTestCase):
+    content = bytes(range(256)) * 100
+
+    def setUp(self):
+        self.teacher = seed_users("teacher", 1, "cut")[0]
+        self.students = seed_users("student", 2, "cus")
+        self.classroom = seed_classroom(
+            self.teacher, self.students, assignments=0, prefix="cu0"
+        )
+        self.assignment = seed_assignments(
+            self.classroom, self.students, 1, submitted_ratio=0
+        )[0]
+        self.student = self.students[0]
+
+    def open_session(self, size=None):
+        response, _ = self.assertWithinBudget(
+            self.student,
+            "post",
+            "/assignments/uploads/",
+            max_queries=2,
+            status_code=201,
+            data={"filename": "scan.png", "size": size or len(self.content)},
+        )
+        return response.data["id"]
+
+    def send(self, upload_id, offset, chunk, status_code=200):
+        response, _ = self.assertWithinBudget(
+            self.student,
+            "patch",
+            f"/assignments/uploads/{upload_id}/",
+            max_queries=3,
+            status_code=status_code,
+            data=chunk,
+            content_type="application/offset+octet-stream",
+            HTTP_UPLOAD_OFFSET=str(offset),
+        )
+        return response
+
+    def submit(self, upload_id, status_code=201):
+        response, _ = self.assertWithinBudget(
+            self.student,
+            "post",
+            f"/assignments/submit/{self.assignment.id}/",
+            max_queries=10,
+            status_code=status_code,
+            format="json",
+            data={"submitted_file_upload": upload_id, "is_hand_written": True},
+        )
+        return response
+
+    def test_resume_and_submit(self):
+        upload_id = self.open_session()
+        self.assertEqual(
+            self.send(upload_id, 0, self.content[:10000]).data["offset"], 10000
+        )
+
+        # The acknowledgement of a chunk was lost and the client retries it
+        response = self.send(upload_id, 0, self.content[:10000], status_code=409)
+        self.assertEqual(response.data["offset"], 10000)
+        response, _ = self.assertWithinBudget(
+            self.student, "get", f"/assignments/uploads/{upload_id}/", max_queries=1
+        )
+        self.assertEqual(response.data["offset"], 10000)
+
+        self.send(upload_id, 10000, self.content[10000:])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.submit(upload_id)
+
+        submission = Submission.objects.get(
+            assignment=self.assignment, student=self.student
+        )
+        self.assertTrue(submission.is_hand_written)
+        self.assertTrue(submission.submitted_file.name.endswith("/scan.png"))
+        self.assertEqual(
+            submission.submitted_file_sha256,
+            hashlib.sha256(self.content).hexdigest(),
+        )
+        with submission.submitted_file.open("rb") as file:
+            self.assertEqual(file.read(), self.content)
+        self.assertFalse(UploadSession.objects.filter(id=upload_id).exists())
+        self.assertFalse(os.path.exists(uploads.data_path(UploadSession(id=upload_id))))
+
+    def test_incomplete_or_foreign_uploads_are_rejected(self):
+        upload_id = self.open_session()
+        self.send(upload_id, 0, self.content[:100])
+        response = self.submit(upload_id, status_code=400)
+        self.assertIn("submitted_file_upload", response.data)
+
+        response, _, _ = self.request(
+            self.students[1],
+            "post",
+            f"/assignments/submit/{self.assignment.id}/",
+            format="json",
+            data={"submitted_file_upload": upload_id, "is_hand_written": False},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Submission.objects.filter(assignment=self.assignment).exists())
+
+    def test_chunk_sent_twice_is_written_once(self):
+        upload_id = self.open_session(size=4)
+        # Both requests loaded the session before either wrote its chunk
+        first = UploadSession.objects.get(id=upload_id)
+        second = UploadSession.objects.get(id=upload_id)
+
+        self.assertTrue(uploads.write_chunk(first, 0, io.BytesIO(b"good"), 4))
+        self.assertFalse(uploads.write_chunk(second, 0, io.BytesIO(b"late"), 4))
+
+        session = UploadSession.objects.get(id=upload_id)
+        self.assertEqual(session.sha256, hashlib.sha256(b"good").hexdigest())
+        with open(uploads.data_path(session), "rb") as file:
+            self.assertEqual(file.read(), b"good")
+
+    @override_settings(UPLOAD_CHUNK_MAX_SIZE=1000)
+    def test_chunks_must_fit(self):
+        upload_id = self.open_session(size=1500)
+        self.send(upload_id, 0, b"x" * 1001, status_code=413)
+        self.send(upload_id, 0, b"x" * 1000)
+        self.send(upload_id, 1000, b"x" * 501, status_code=400)
+        self.assertEqual(self.send(upload_id, 1000, b"x" * 500).data["offset"], 1500)
+
+
+@override_settings(GRADING_CHARS_PER_TOKEN=1, GRADING_MIN_TRUNCATED_PART_TOKENS=100)
+class FitToBudgetTests(SimpleTestCase):
+    def parts(self, *sizes):
+        # The instructions first, then text parts of the given sizes
+        return [{"type": "text", "text": "i" * 50}] + [
+            {"type": "text", "text": str(index) * size}
+            for index, size in enumerate(sizes)
+        ]
+
+    def test_prompt_at_the_budget_is_sent_whole(self):
+        parts = self.parts(400, 600)
+        self.assertIs(budget.fit_to_budget(parts, 1050), parts)
+
+    def test_largest_parts_are_truncated_to_fit(self):
+        parts = self.parts(200, 2000, 3000)
+        fitted = budget.fit_to_budget(parts, 2250)
+
+        self.assertLessEqual(budget.estimate_prompt_tokens(fitted), 2250)
+        self.assertEqual(fitted[:2], parts[:2])
+        # The two large parts share what is left evenly
+        self.assertEqual(len(fitted[2]["text"]), len(fitted[3]["text"]))
+        self.assertIn("characters omitted", fitted[3]["text"])
+        self.assertTrue(fitted[3]["text"].startswith("2"))
+        self.assertTrue(fitted[3]["text"].endswith("2"))
+        # The input, which may be cached, is left untouched
+        self.assertEqual(len(parts[3]["text"]), 3000)
+
+    def test_parts_that_cannot_be_truncated_count_in_full(self):
+        encoded = {"type": "text", "text": "File (application/pdf) " + "A" * 900}
+        parts = self.parts(2000) + [encoded]
+        fitted = budget.fit_to_budget(parts, 1500)
+        self.assertIs(fitted[2], encoded)
+        self.assertLessEqual(budget.estimate_prompt_tokens(fitted), 1500)
+
+        with self.assertRaises(budget.PromptTooLarge):
+            budget.fit_to_budget(parts, 1000)
+
+    def test_parts_are_not_cut_below_the_minimum(self):
+        with self.assertRaises(budget.PromptTooLarge):
+            budget.fit_to_budget(self.parts(1000, 1000), 249)
+        self.assertLessEqual(
+            budget.estimate_prompt_tokens(
+                budget.fit_to_budget(self.parts(1000, 1000), 250)
+            ),
+            250,
+        )
+
+
+class ManualGradingFlagTests(TestCase):
+    def setUp(self):
+        teacher = seed_users("teacher", 1, "mgt")[0]
+        students = seed_users("student", 1, "mgs")
+        classroom = seed_classroom(
+            teacher, students, assignments=1, prefix="mg0", graded_ratio=0
+        )
+        self.assignment = classroom.assignments.get()
+        self.submission = self.assignment.submissions.get()
+        self.submission.needs_manual_grading = True
+        self.submission.save()
+
+    def test_marking_clears_the_flag(self):
+        self.submission.set_score(4)
+        self.submission.refresh_from_db()
+        self.assertFalse(self.submission.needs_manual_grading)
+
+        self.submission.needs_manual_grading = True
+        self.submission.save()
+        Submission.set_scores([self.submission], {self.submission.id: 6})
+        self.submission.refresh_from_db()
+        self.assertFalse(self.submission.needs_manual_grading)
+
+    @override_settings(AUTOCHECK_TASK_MAX_ATTEMPTS=1)
+    def test_failure_reason_comes_from_the_current_attempt(self):
+        job = enqueue_auto_check(self.assignment, self.assignment.classroom.teacher)
+        task = job.tasks.get()
+        task.status, task.attempts = task.STATUS_RUNNING, 1
+        task.save()
+
+        # A flag left from an earlier attempt is not the reason this time
+        with mock.patch.object(Submission, "grade_with_openrouter", return_value=None):
+            run_task(task)
+        task.refresh_from_db()
+        self.assertEqual(task.status, task.STATUS_FAILED)
+        self.assertEqual(task.error, "No score could be obtained")
+
+    def test_cached_scores_depend_on_the_token_budget(self):
+        with mock.patch.object(grading_cache, "content_hash", return_value="0" * 64):
+            key = grading_cache.make_key(self.submission, self.assignment)
+            self.assignment.token_budget = 1000
+            self.assertNotEqual(
+                grading_cache.make_key(self.submission, self.assignment), key
+            )
+
+
+def make_text_pdf(pages: list[str]) -> bytes:
+    """A PDF with one line of Helvetica text per page, "" for blank pages."""
+    writer = PdfWriter()
+    font = writer._add_object(
+        DictionaryObject(
+            {
+                NameObject("/Type"): NameObject("/Font"),
+                NameObject("/Subtype"): NameObject("/Type1"),
+                NameObject("/BaseFont"): NameObject("/Helvetica"),
+            }
+        )
+    )
+    for text in pages:
+        page = writer.add_blank_page(width=595, height=842)
+        if not text:
+            continue
+        contents = DecodedStreamObject()
+        contents.set_data(f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode())
+        page[NameObject("/Contents")] = writer._add_object(contents)
+        page[NameObject("/Resources")] = DictionaryObject(
+            {NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})}
+        )
+    output = io.BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+class TextExtractionTests(TestCase):
+    def setUp(self):
+        use_temporary_media_root(self)
+        teacher = seed_users("teacher", 1, "txt")[0]
+        students = seed_users("student", 1, "txs")
+        classroom = seed_classroom(teacher, students, assignments=1, prefix="tx0")
+        self.submission = Submission.objects.get(assignment__classroom=classroom)
+
+    def extract(self, name, content, mime_type=""):
+        self.submission.submitted_file.save(name, ContentFile(content), save=True)
+        return extraction.extract_text(self.submission.submitted_file, mime_type)
+
+    def test_pdf_without_text_is_sent_as_a_file(self):
+        self.submission.submitted_file.save(
+            "scan.pdf", ContentFile(make_text_pdf(["", ""])), save=False
+        )
+
+        self.assertEqual(utils.pdf_to_text(self.submission.submitted_file), "")
+        part = self.submission.build_content_part(
+            "application/pdf", self.submission.submitted_file
+        )
+        self.assertTrue(
+            part["text"].startswith("File (application/pdf) provided as base64")
+        )
+
+    def test_pdf_pages_with_text_are_labelled(self):
+        text = self.extract(
+            "answer.pdf", make_text_pdf(["First answer", "", "Third answer"])
+        )
+        self.assertEqual(text, "[Page 1]\nFirst answer\n\n[Page 3]\nThird answer")
+
+    def test_docx_tables_stay_between_their_paragraphs(self):
+        document = Document()
+        document.add_paragraph("Results:")
+        table = document.add_table(rows=2, cols=2)
+        for row, values in zip(table.rows, [("x", "y"), ("1", "2")]):
+            for cell, value in zip(row.cells, values):
+                cell.text = value
+        document.add_paragraph("So y grows with x.")
+        output = io.BytesIO()
+        document.save(output)
+
+        self.assertEqual(
+            self.extract("answer.docx", output.getvalue()),
+            "Results:\nx | y\n1 | 2\nSo y grows with x.",
+        )
+
+    def test_plain_text_is_decoded_and_binary_files_are_refused(self):
+        self.assertEqual(self.extract("answer.py", b"print(42)\n"), "print(42)\n")
+        self.assertEqual(
+            self.extract("notes", "café".encode(), "text/plain"), "café"
+        )
+        self.assertIsNone(self.extract("answer.txt", b"\x00\x01binary"))
+        self.assertIsNone(self.extract("answer.bin", b"data"))
+
+    def test_notebook_cells_and_outputs(self):
+        notebook = {
+            "cells": [
+                {"cell_type": "markdown", "source": ["# Task 1"]},
+                {
+                    "cell_type": "code",
+                    "source": ["x = 2\n", "x * 21"],
+                    "outputs": [{"data": {"text/plain": ["42"]}}],
+                },
+            ]
+        }
+        self.assertEqual(
+            self.extract("answer.ipynb", json.dumps(notebook).encode()),
+            "[Cell 1: markdown]\n# Task 1\n\n"
+            "[Cell 2: code]\nx = 2\nx * 21\n\n[Output]\n42",
+        )
+
+    def test_files_are_extracted_once_per_content(self):
+        extractor = mock.Mock(wraps=utils.plain_text)
+        extractor.__name__ = "plain_text"
+        with mock.patch.dict(utils.EXTRACTORS_BY_EXTENSION, {".txt": extractor}):
+            self.assertEqual(self.extract("first.txt", b"answer"), "answer")
+            # Another name for the same content hits the cache
+            self.assertEqual(self.extract("second.txt", b"answer"), "answer")
+            self.assertEqual(extractor.call_count, 1)
+
+            self.assertEqual(self.extract("first.txt", b"new answer"), "new answer")
+            self.assertEqual(extractor.call_count, 2)
+        self.assertEqual(
+            set(ExtractedText.objects.values_list("text", flat=True)),
+            {"answer", "new answer"},
+        )
+
+
+class ParseBatchScoresTests(SimpleTestCase):
+    def parse(self, output_text):
+        return batch_grading.parse_batch_scores(output_text, [1, 2, 3], 10)
+
+    def test_scores_are_read_from_surrounding_text(self):
+        self.assertEqual(
+            self.parse(
+                'Here you go: {"scores": [{"submission_id": 1, "score": 8.5}, '
+                '{"submission_id": "2", "score": "12"}]} Done.'
+            ),
+            {1: 8.5, 2: 10.0},
+        )
+
+    def test_malformed_output_gives_no_scores(self):
+        for output_text in [
+            "",
+            "Score: 7",
+            '{"scores": [{"submission_id": 1, "score": 8}',
+            '{"scores": {"submission_id": 1, "score": 8}}',
+            '["scores"]',
+        ]:
+            with self.subTest(output_text=output_text):
+                self.assertEqual(self.parse(output_text), {})
+
+    def test_missing_and_unknown_entries_are_left_out(self):
+        self.assertEqual(
+            self.parse(
+                '{"scores": [{"submission_id": 1}, {"score": 4}, '
+                '{"submission_id": 9, "score": 4}, "3: 5", '
+                '{"submission_id": 3, "score": "high"}, '
+                '{"submission_id": 2, "score": -1}]}'
+            ),
+            {2: 0.0},
+        )
+
+
+@override_settings(AUTOCHECK_TASK_LEASE_SECONDS=60, AUTOCHECK_TASK_MAX_ATTEMPTS=2)
+class AutoCheckQueueTests(TestCase):
+    def setUp(self):
+        teacher = seed_users("teacher", 1, "aqt")[0]
+        students = seed_users("student", 3, "aqs")
+        classroom = seed_classroom(
+            teacher, students, assignments=1, prefix="aq0", graded_ratio=0
+        )
+        self.assignment = classroom.assignments.get()
+        self.job = enqueue_auto_check(self.assignment, teacher)
+
+    def expire_leases(self):
+        AutoCheckTask.objects.filter(status=AutoCheckTask.STATUS_RUNNING).update(
+            claimed_at=timezone.now() - timedelta(seconds=120)
+        )
+
+    def test_tasks_are_claimed_by_one_worker(self):
+        first = claim_tasks("a", 2)
+        second = claim_tasks("b", 10)
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 1)
+        self.assertFalse({task.id for task in first} & {task.id for task in second})
+        self.assertEqual(claim_tasks("c", 10), [])
+        self.assertEqual(
+            set(self.job.tasks.values_list("worker_id", flat=True)), {"a", "b"}
+        )
+
+    def test_one_active_job_per_assignment(self):
+        # A concurrent request that passed the get_active_job check
+        teacher = self.assignment.classroom.teacher
+        self.assertEqual(enqueue_auto_check(self.assignment, teacher), self.job)
+        self.assertEqual(self.assignment.auto_check_jobs.count(), 1)
+
+    def test_scores_that_cannot_be_saved_are_counted_once(self):
+        tasks = claim_tasks("a", 10)
+        with self.assertLogs("assignments.jobs") as logs, mock.patch(
+            "assignments.jobs.apply_scores", side_effect=DatabaseError("locked")
+        ):
+            with ScoreWriter(flush_size=10, flush_interval=0.01) as writer:
+                for task in tasks:
+                    writer.add(task.id, "a", task.submission_id, 3.0)
+        self.assertIn(
+            "ERROR:assignments.jobs:"
+            "Could not save 3 scores, their tasks will be requeued",
+            logs.output,
+        )
+
+    def test_claiming_can_be_limited_to_jobs(self):
+        self.assertEqual(claim_tasks("a", 10, job_ids=[self.job.id + 1]), [])
+        self.assertEqual(len(claim_tasks("a", 10, job_ids=[self.job.id])), 3)
+
+    def test_expired_leases_are_requeued_until_attempts_run_out(self):
+        claim_tasks("a", 10)
+        self.expire_leases()
+        self.assertEqual(requeue_stale_tasks(), 3)
+        self.assertEqual(
+            self.job.tasks.filter(status=AutoCheckTask.STATUS_PENDING).count(), 3
+        )
+
+        self.assertEqual(len(claim_tasks("b", 10)), 3)
+        self.expire_leases()
+        self.assertEqual(requeue_stale_tasks(), 0)
+        self.assertEqual(
+            set(self.job.tasks.values_list("status", "attempts", "error")),
+            {(AutoCheckTask.STATUS_FAILED, 2, "Worker lease expired")},
+        )
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.failed_tasks, 3)
+        self.assertEqual(self.job.status, AutoCheckJob.STATUS_COMPLETED)
+
+    def test_renewed_leases_are_kept(self):
+        task_ids = [task.id for task in claim_tasks("a", 10)]
+        self.expire_leases()
+        self.assertEqual(renew_leases("b", task_ids), 0)
+        self.assertEqual(renew_leases("a", task_ids), 3)
+        self.assertEqual(requeue_stale_tasks(), 0)
+
+    def test_score_after_a_manual_mark_is_dropped(self):
+        tasks = claim_tasks("a", 10)
+        marked = tasks[0].submission
+        marked.set_score(9)
+
+        apply_scores([(task.id, "a", task.submission_id, 3.0) for task in tasks])
+        self.assertEqual(
+            dict(self.assignment.submissions.values_list("id", "score")),
+            {
+                task.submission_id: 9 if task.submission_id == marked.id else 3.0
+                for task in tasks
+            },
+        )
+        self.assertEqual(Assignment.objects.get(id=self.assignment.id).graded_count, 3)
+        self.job.refresh_from_db()
+        self.assertEqual(self.job.completed_tasks, 3)
+        self.assertEqual(self.job.status, AutoCheckJob.STATUS_COMPLETED)
+
+    def test_score_of_a_requeued_task_is_dropped(self):
+        task = claim_tasks("a", 1)[0]
+        self.expire_leases()
+        requeue_stale_tasks()
+
+        apply_scores([(task.id, "a", task.submission_id, 3.0)])
+        self.assertIsNone(Submission.objects.get(id=task.submission_id).score)
+        task.refresh_from_db()
+        self.assertEqual(task.status, AutoCheckTask.STATUS_PENDING)
+
+    @override_settings(AUTOCHECK_TASK_MAX_ATTEMPTS=2)
+    def test_tasks_without_a_score_are_retried(self):
+        task = claim_tasks("a", 1)[0]
+        # An outage outlasting the scheduler's retries
+        with mock.patch("assignments.jobs.grade_submission", return_value=None):
+            run_task(task)
+        task.refresh_from_db()
+        self.assertEqual(
+            (task.status, task.error),
+            (AutoCheckTask.STATUS_PENDING, "No score could be obtained"),
+        )
+
+        task = claim_tasks("a", 1)[0]
+        with mock.patch("assignments.jobs.grade_submission", return_value=None):
+            run_task(task)
+        task.refresh_from_db()
+        self.assertEqual(task.status, AutoCheckTask.STATUS_FAILED)
+
+    def test_prompts_over_the_budget_fail_at_once(self):
+        task = claim_tasks("a", 1)[0]
+
+        def refuse(submission, assignment, use_cache):
+            submission.prompt_too_large = True
+            return None
+
+        with mock.patch("assignments.jobs.grade_submission", side_effect=refuse):
+            run_task(task)
+        task.refresh_from_db()
+        self.assertEqual(
+            (task.status, task.attempts),
+            (AutoCheckTask.STATUS_FAILED, 1),
+        )
+        self.assertIn("manual grading", task.error)
+
+    def test_late_results_do_not_touch_a_reclaimed_task(self):
+        task = claim_tasks("a", 1)[0]
+        self.expire_leases()
+        requeue_stale_tasks()
+        reclaimed = claim_tasks("b", 1)[0]
+        self.assertEqual(reclaimed.id, task.id)
+
+        # Worker "a" reports back after "b" took the task over
+        apply_scores([(task.id, task.worker_id, task.submission_id, 3.0)])
+        with mock.patch(
+            "assignments.jobs.grade_submission", side_effect=RuntimeError("timeout")
+        ):
+            run_task(task)
+        with mock.patch("assignments.jobs.grade_submission", return_value=None):
+            run_task(task)
+
+        self.assertIsNone(Submission.objects.get(id=task.submission_id).score)
+        reclaimed.refresh_from_db()
+        self.assertEqual(
+            (reclaimed.status, reclaimed.worker_id, reclaimed.error),
+            (AutoCheckTask.STATUS_RUNNING, "b", ""),
+        )
+
+        apply_scores([(task.id, "b", task.submission_id, 3.0)])
+        self.assertEqual(Submission.objects.get(id=task.submission_id).score, 3.0)
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+class HTTPPoolTests(SimpleTestCase):
+    def setUp(self):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.url = f"http://127.0.0.1:{server.server_port}/"
+
+        http_pool.reset_pool_stats()
+        self.addCleanup(http_pool.reset_pool_stats)
+
+    def test_connections_are_reused(self):
+        with http_pool._build_session() as session:
+            for _ in range(3):
+                self.assertEqual(session.get(self.url, timeout=5).content, b"ok")
+
+        self.assertEqual(
+            http_pool.get_pool_stats()["127.0.0.1"],
+            {"requests": 3, "hits": 2, "misses": 1, "reuse_rate": 2 / 3},
+        )
+
+
+class RebuildCountersTests(TestCase):
+    def test_counters_are_recomputed_from_the_rows(self):
+        teacher = seed_users("teacher", 1, "rbt")[0]
+        students = seed_users("student", 4, "rbs")
+        classroom = seed_classroom(
+            teacher,
+            students,
+            assignments=2,
+            prefix="rb0",
+            submitted_ratio=0.5,
+            graded_ratio=0.5,
+        )
+        Class.objects.filter(id=classroom.id).update(student_count=99)
+        classroom.assignments.update(submission_count=99, graded_count=-1)
+
+        output = io.StringIO()
+        call_command("rebuild_counters", stdout=output)
+
+        self.assertEqual(Class.objects.get(id=classroom.id).student_count, 4)
+        self.assertEqual(
+            set(classroom.assignments.values_list("submission_count", "graded_count")),
+            {(2, 1)},
+        )
+        self.assertIn(
+            "Rebuilt counters for 1 classes and 2 assignments", output.getvalue()
+        )
+
+
+class SerialLiveServerThread(LiveServerThread):
+    """
+    Serves one request at a time, as the server thread shares the single
+    connection to the in-memory test database.
+    """
+
+    def _create_server(self, connections_override=None):
+        return WSGIServer(
+            (self.host, self.port), QuietWSGIRequestHandler, allow_reuse_address=False
+        )
+
+
+@override_settings(
+    CACHES=TEST_CACHES,
+    PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+)
+class LoadTestCommandTests(LiveServerTestCase):
+    server_thread_class = SerialLiveServerThread
+
+    def setUp(self):
+        use_temporary_media_root(self)
+
+    def test_seed_and_load_test_run_end_to_end(self):
+        call_command(
+            "seed_load",
+            prefix="e2e",
+            teachers=2,
+            students=6,
+            classes_per_teacher=1,
+            students_per_class=4,
+            assignments_per_class=3,
+            distinct_files=2,
+            password="e2e-password",
+            stdout=io.StringIO(),
+        )
+
+        output = io.StringIO()
+        call_command(
+            "run_load_test",
+            base_url=self.live_server_url,
+            prefix="e2e",
+            password="e2e-password",
+            concurrency=4,
+            duration=1,
+            teacher_ratio=0.5,
+            stdout=output,
+        )
+
+        rows = {
+            line.split()[0]: line.split()[1:3]
+            for line in output.getvalue().splitlines()[2:]
+        }
+        requests_sent, errors = map(int, rows["total"])
+        self.assertGreater(requests_sent, 0)
+        self.assertEqual(errors, 0)
+        self.assertIn("mark", rows)
+        self.assertFalse(
+            Submission.objects.filter(score__gt=F("assignment__max_score")).exists()
+        )
+
+
+class JSONBodyTests(SimpleTestCase):
+    def test_payload_is_encoded_once_in_chunks(self):
+        payload = {"messages": [{"text": "x" * 100}, {"text": "é" * 10}]}
+        expected = json.dumps(payload).encode()
+        with mock.patch.object(
+            json.JSONEncoder,
+            "iterencode",
+            autospec=True,
+            side_effect=json.JSONEncoder.iterencode,
+        ) as iterencode:
+            body = http_pool.JSONBody(payload, chunk_size=16)
+            self.assertEqual(len(body), len(expected))
+            self.assertEqual(b"".join(body), expected)
+            # Requests may read the body again to retry it
+            self.assertEqual(b"".join(body), expected)
+        self.assertEqual(iterencode.call_count, 1)
+        self.assertGreater(len(body.chunks), 1)
+
+    @override_settings(OPENROUTER_API_KEY="test-key")
+    def test_retried_requests_resend_the_same_body(self):
+        request_scheduler = mock.Mock()
+        # Retries once, as after a 429
+        request_scheduler.send.side_effect = lambda send_request, tokens: [
+            send_request(),
+            send_request(),
+        ][-1]
+        with mock.patch.object(
+            scheduler, "get_scheduler", return_value=request_scheduler
+        ), mock.patch.object(http_pool, "post") as post, mock.patch.object(
+            http_pool, "JSONBody", wraps=http_pool.JSONBody
+        ) as json_body:
+            Submission().make_openrouter_prediction([{"type": "text", "text": "x"}])
+
+        self.assertEqual(json_body.call_count, 1)
+        first, second = (call.kwargs["data"] for call in post.call_args_list)
+        self.assertIs(first, second)
+
+
+class GradingStubTests(SimpleTestCase):
+    def setUp(self):
+        self.server = grading_stub.start_stub_server(
+            grading_stub.StubConfig(
+                latency=grading_stub.LatencyDistribution("constant:0")
+            )
+        )
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_completion_is_parseable(self):
+        for response_format in ("plain", "parts"):
+            with self.subTest(response_format=response_format):
+                self.server.config.response_format = response_format
+                response = requests.post(
+                    f"{self.server.base_url}/api/v1/chat/completions",
+                    json={
+                        "model": "stub",
+                        "messages": [
+                            {
+                                "role": "user",
+                                "content": "Assign a numerical score between "
+                                "0.0 and 20 (inclusive).",
+                            }
+                        ],
+                    },
+                    timeout=5,
+                )
+
+                self.assertEqual(response.status_code, 200)
+                text = Submission().extract_openrouter_text(response.json())
+                self.assertRegex(text, r"^Score: \d+(\.\d+)?$")
+                self.assertLessEqual(float(text.removeprefix("Score: ")), 20)
+
+    def test_missing_content_length_is_refused(self):
+        host, port = self.server.server_address[:2]
+        connection = http.client.HTTPConnection(host, port, timeout=5)
+        self.addCleanup(connection.close)
+        # putrequest sends no Content-Length unless one is added
+        connection.putrequest("POST", "/api/v1/chat/completions")
+        connection.endheaders()
+        response = connection.getresponse()
+
+        self.assertEqual(response.status, 411)
+        self.assertEqual(
+            json.loads(response.read()), {"error": "Content-Length required"}
+        )
+        self.assertEqual(self.server.stats["completions"], 0)
+
+
+class BoundedPipelineTests(SimpleTestCase):
+    def run_items(self, pipeline, costs):
+        """Submit items that block until released; return the started ones."""
+        started, release = [], threading.Event()
+
+        def work(item):
+            started.append(item)
+            release.wait(5)
+
+        submitter = threading.Thread(
+            target=lambda: [
+                pipeline.submit(work, index, cost) for index, cost in enumerate(costs)
+            ]
+        )
+        submitter.start()
+        return started, release, submitter
+
+    def wait_for(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_submit_blocks_at_the_item_limit(self):
+        with BoundedPipeline(2, 1000) as pipeline:
+            started, release, submitter = self.run_items(pipeline, [1, 1, 1])
+            self.wait_for(lambda: len(started) == 2)
+            time.sleep(0.05)
+            self.assertEqual(sorted(started), [0, 1])
+            self.assertTrue(submitter.is_alive())
+            self.assertEqual(pipeline.free_slots(), 0)
+
+            release.set()
+            submitter.join(5)
+            pipeline.drain()
+        self.assertEqual(sorted(started), [0, 1, 2])
+        self.assertEqual((pipeline.in_flight, pipeline.in_flight_bytes), (0, 0))
+
+    def test_submit_blocks_at_the_byte_limit(self):
+        with BoundedPipeline(4, 100) as pipeline:
+            started, release, submitter = self.run_items(pipeline, [60, 60])
+            self.wait_for(lambda: len(started) == 1)
+            time.sleep(0.05)
+            self.assertEqual(pipeline.in_flight_bytes, 60)
+            self.assertTrue(submitter.is_alive())
+
+            release.set()
+            submitter.join(5)
+            pipeline.drain()
+        self.assertEqual(started, [0, 1])
+
+    def test_items_over_the_byte_limit_run_alone(self):
+        with BoundedPipeline(4, 100) as pipeline:
+            started, release, submitter = self.run_items(pipeline, [500, 1])
+            self.wait_for(lambda: len(started) == 1)
+            time.sleep(0.05)
+            self.assertEqual(started, [0])
+
+            release.set()
+            submitter.join(5)
+            pipeline.drain()
+        self.assertEqual(started, [0, 1])
+
+    def test_failures_are_logged_and_release_their_slot(self):
+        def fail(item):
+            raise RuntimeError(f"item {item} failed")
+
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), BoundedPipeline(1, 100) as pipeline:
+            pipeline.submit(fail, 7, 10)
+            pipeline.drain()
+        self.assertEqual((pipeline.in_flight, pipeline.in_flight_bytes), (0, 0))
+        self.assertIn("RuntimeError: item 7 failed", output.getvalue())
+
+
+class FakeClock:
+    """Stands in for the time module of assignments.scheduler."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def make_response(status_code, **headers):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers)
+    return response
+
+
+class SchedulerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch.object(scheduler, "time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_scheduler(self, **kwargs):
+        options = {
+            "requests_per_minute": 0,
+            "tokens_per_minute": 0,
+            "initial_concurrency": 8,
+            "min_concurrency": 1,
+            "max_concurrency": 16,
+            "max_retries": 3,
+            "backoff_base": 1,
+            "backoff_max": 5,
+        }
+        return scheduler.RequestScheduler(**{**options, **kwargs})
+
+    def test_retry_after_in_seconds(self):
+        self.assertEqual(
+            scheduler.parse_retry_after(make_response(429, **{"Retry-After": "7"})),
+            7.0,
+        )
+        self.assertIsNone(scheduler.parse_retry_after(make_response(429)))
+        for value in ("soon", "inf", "nan"):
+            response = make_response(429, **{"Retry-After": value})
+            self.assertIsNone(scheduler.parse_retry_after(response))
+
+    def test_long_retry_after_is_capped(self):
+        request_scheduler = self.make_scheduler()
+        responses = [
+            make_response(429, **{"Retry-After": "3600"}),
+            make_response(200),
+        ]
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = request_scheduler.send(lambda: responses.pop(0), 100)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.clock.sleeps, [5])
+
+    def test_retry_after_as_an_http_date(self):
+        retry_at = format_datetime(
+            datetime.now(dt_timezone.utc) + timedelta(seconds=120), usegmt=True
+        )
+        delay = scheduler.parse_retry_after(
+            make_response(503, **{"Retry-After": retry_at})
+        )
+        self.assertAlmostEqual(delay, 120, delta=2)
+
+        past = format_datetime(datetime(2000, 1, 1, tzinfo=dt_timezone.utc), True)
+        self.assertEqual(
+            scheduler.parse_retry_after(make_response(503, **{"Retry-After": past})),
+            0.0,
+        )
+
+    def test_limit_halves_on_throttling_and_grows_on_success(self):
+        limiter = scheduler.AdaptiveConcurrencyLimiter(8, minimum=1, maximum=5)
+        self.assertEqual(limiter.limit, 5)
+        limiter.on_throttle()
+        self.assertEqual(limiter.limit, 2.5)
+        for _ in range(3):
+            limiter.on_throttle()
+        self.assertEqual(limiter.limit, 1)
+
+        # About one slot per window of as many successes as the limit
+        limiter.on_success()
+        self.assertEqual(limiter.limit, 2)
+        limiter.on_success()
+        self.assertEqual(limiter.limit, 2.5)
+        for _ in range(20):
+            limiter.on_success()
+        self.assertEqual(limiter.limit, 5)
+
+    def test_tokens_refill_over_time(self):
+        bucket = scheduler.TokenBucket(60)
+        bucket.acquire(60)
+        self.assertEqual(self.clock.sleeps, [])
+
+        bucket.acquire(2)
+        self.assertEqual(self.clock.sleeps, [2])
+
+        self.clock.now += 30
+        bucket.acquire(30)
+        self.assertEqual(self.clock.sleeps, [2])
+        bucket.acquire(1)
+        self.assertEqual(len(self.clock.sleeps), 2)
+        self.assertAlmostEqual(self.clock.sleeps[1], 1)
+
+    def test_requests_over_the_bucket_capacity_wait_for_a_full_bucket(self):
+        bucket = scheduler.TokenBucket(60)
+        bucket.acquire(60)
+        bucket.acquire(500)
+        self.assertEqual(self.clock.sleeps, [60])
+
+    def test_throttled_requests_are_retried_after_retry_after(self):
+        request_scheduler = self.make_scheduler()
+        responses = [
+            make_response(429, **{"Retry-After": "3"}),
+            make_response(200),
+        ]
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            response = request_scheduler.send(lambda: responses.pop(0), 100)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.clock.sleeps, [3.0])
+        self.assertEqual(request_scheduler.limiter.limit, 4.25)
+        self.assertIn("OpenRouter returned 429, retrying in 3.0s", output.getvalue())
+
+    def test_failures_are_retried_with_jittered_backoff(self):
+        request_scheduler = self.make_scheduler(max_retries=4)
+
+        def fail():
+            raise requests.exceptions.ConnectionError("reset")
+
+        with contextlib.redirect_stdout(io.StringIO()), mock.patch.object(
+            scheduler.random, "uniform", side_effect=lambda low, high: high
+        ) as uniform:
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                request_scheduler.send(fail, 100)
+
+        # Delays are drawn from 0 up to a doubling bound capped at backoff_max
+        self.assertEqual(
+            [call.args for call in uniform.call_args_list],
+            [(0, 1), (0, 2), (0, 4), (0, 5)],
+        )
+        self.assertEqual(self.clock.sleeps, [1, 2, 4, 5])
+        self.assertEqual(request_scheduler.limiter.limit, 1)
+
+    def test_server_errors_are_returned_when_retries_run_out(self):
+        request_scheduler = self.make_scheduler(max_retries=1)
+        with contextlib.redirect_stdout(io.StringIO()), mock.patch.object(
+            scheduler.random, "uniform", return_value=0.5
+        ):
+            response = request_scheduler.send(lambda: make_response(502), 100)
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(self.clock.sleeps, [0.5])
+
+
+class LRUByteCacheTests(SimpleTestCase):
+    def test_least_recently_used_entries_are_evicted_first(self):
+        cache = reference_cache.LRUByteCache(10)
+        cache.set("a", "A", 4)
+        cache.set("b", "B", 4)
+        self.assertEqual(cache.get("a"), "A")
+
+        cache.set("c", "C", 4)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual((cache.get("a"), cache.get("c")), ("A", "C"))
+        self.assertEqual(cache.current_bytes, 8)
+
+        cache.set("d", "D", 6)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.current_bytes, 10)
+
+    def test_sizes_are_kept_within_the_bound(self):
+        cache = reference_cache.LRUByteCache(10)
+        cache.set("a", "A", 11)
+        self.assertIsNone(cache.get("a"))
+
+        cache.set("a", "A", 4)
+        cache.set("a", "AA", 8)
+        self.assertEqual((cache.get("a"), cache.current_bytes), ("AA", 8))
+        cache.delete("a")
+        self.assertEqual(cache.current_bytes, 0)
+
+
+class ReferenceCacheTests(TestCase):
+    def setUp(self):
+        use_temporary_media_root(self)
+        teacher = seed_users("teacher", 1, "rct")[0]
+        classroom = seed_classroom(teacher, [], assignments=1, prefix="rc0")
+        self.assignment = classroom.assignments.get()
+        self.assignment.task_file.save("task.txt", ContentFile(b"task"), save=False)
+        self.assignment.solution_file.save(
+            "key.txt", ContentFile(b"mark scheme"), save=True
+        )
+        reference_cache._local_cache.clear()
+        self.addCleanup(reference_cache._local_cache.clear)
+        self.addCleanup(reference_cache._assignment_keys.clear)
+        self.builds = 0
+
+    def solution_part(self, assignment=None):
+        assignment = assignment or self.assignment
+        return reference_cache.get_reference_part(
+            assignment,
+            "solution",
+            assignment.solution_file,
+            "text/plain",
+            self.build,
+        )
+
+    def build(self, mime_type, file_field):
+        self.builds += 1
+        with file_field.open("rb") as file:
+            return {"type": "text", "text": file.read().decode()}
+
+    def test_parts_are_built_once(self):
+        self.assertEqual(self.solution_part()["text"], "mark scheme")
+        self.assertEqual(self.solution_part()["text"], "mark scheme")
+        self.assertEqual(self.builds, 1)
+
+    def test_replaced_files_miss_the_cache(self):
+        self.solution_part()
+        self.assignment.solution_file.save(
+            "key.txt", ContentFile(b"corrected mark scheme"), save=True
+        )
+
+        self.assertEqual(self.solution_part()["text"], "corrected mark scheme")
+        self.assertEqual(self.builds, 2)
+        # The part of the replaced file is not kept around
+        self.assertEqual(
+            reference_cache._local_cache.current_bytes, len("corrected mark scheme")
+        )
+
+
+    def test_shared_parts_outlive_one_assignment(self):
+        other = seed_assignments(self.assignment.classroom, [], 1)[0]
+        other.solution_file.save("key.txt", ContentFile(b"mark scheme"), save=True)
+        self.solution_part()
+        self.solution_part(other)
+        self.assertEqual(self.builds, 1)
+
+        # Saving one assignment keeps the part the other still uses
+        self.assignment.save()
+        self.solution_part(other)
+        self.assertEqual(self.builds, 1)
+
+        reference_cache.invalidate_assignment(other.id)
+        self.solution_part(other)
+        self.assertEqual(self.builds, 2)
+
+
+@override_settings(OCR_PREDICTION_URL="http://ocr.test/predict")
+class OCRCacheTests(TestCase):
+    def setUp(self):
+        use_temporary_media_root(self)
+        teacher = seed_users("teacher", 1, "oct")[0]
+        students = seed_users("student", 3, "ocs")
+        classroom = seed_classroom(teacher, students, assignments=1, prefix="oc0")
+        self.submissions = list(
+            Submission.objects.filter(assignment__classroom=classroom).order_by("id")
+        )
+        scans = [make_png(random.Random(seed), 200, 300) for seed in (0, 0, 1)]
+        for submission, scan in zip(self.submissions, scans):
+            submission.is_hand_written = True
+            submission.submitted_file.save("scan.png", ContentFile(scan), save=True)
+
+    def predict(self, submission):
+        response = mock.Mock()
+        response.json.return_value = {"pred": f"text of {submission.id}"}
+        with mock.patch.object(http_pool, "post", return_value=response) as post:
+            text = submission.handle_ocr_prediction("image/png")
+        return text, post.call_count
+
+    def test_identical_images_are_read_once(self):
+        first, second, other = self.submissions
+        self.assertEqual(self.predict(first), (f"text of {first.id}", 1))
+        self.assertEqual(self.predict(first), (f"text of {first.id}", 0))
+        # Keyed on the content, not the submission
+        self.assertEqual(self.predict(second), (f"text of {first.id}", 0))
+        self.assertEqual(self.predict(other), (f"text of {other.id}", 1))
+        self.assertEqual(OCRResult.objects.count(), 2)
+
+    def test_images_are_read_again_under_other_settings(self):
+        submission = self.submissions[0]
+        self.assertEqual(self.predict(submission)[1], 1)
+        with override_settings(GRADING_IMAGE_MAX_DIMENSION=100):
+            self.assertEqual(self.predict(submission)[1], 1)
+        with mock.patch.object(ocr_cache, "OCR_VERSION", "next"):
+            self.assertEqual(self.predict(submission)[1], 1)
+        self.assertEqual(self.predict(submission)[1], 0)
+        self.assertEqual(OCRResult.objects.count(), 3)
+
+    @override_settings(OCR_CACHE_MAX_TEXT_LENGTH=5)
+    def test_long_texts_are_not_stored(self):
+        self.predict(self.submissions[0])
+        self.assertFalse(OCRResult.objects.exists())
+
+    @override_settings(OCR_CACHE_MAX_ENTRIES=2)
+    def test_least_recently_used_entries_are_evicted(self):
+        now = timezone.now()
+        with mock.patch.object(ocr_cache.timezone, "now") as clock:
+            for minute, image_hash in enumerate(["a", "b", "a", "c"]):
+                clock.return_value = now + timedelta(minutes=minute)
+                if ocr_cache.get_cached_text(image_hash) is None:
+                    ocr_cache.store_text(image_hash, image_hash.upper())
+
+        self.assertEqual(
+            set(OCRResult.objects.values_list("image_hash", flat=True)), {"a", "c"}
+        )
+        self.assertEqual(ocr_cache.get_cached_text("a"), "A")
+        self.assertIsNone(ocr_cache.get_cached_text("b"))
+
+
+class GradingCacheTests(TestCase):
+    def setUp(self):
+        use_temporary_media_root(self)
+        teacher = seed_users("teacher", 1, "gct")[0]
+        students = seed_users("student", 2, "gcs")
+        classroom = seed_classroom(
+            teacher, students, assignments=1, prefix="gc0", graded_ratio=0
+        )
+        self.teacher = teacher
+        self.assignment = classroom.assignments.get()
+        self.assignment.task_file.save("task.txt", ContentFile(b"task"), save=False)
+        self.assignment.solution_file.save("key.txt", ContentFile(b"key"), save=True)
+        for submission in self.assignment.submissions.all():
+            submission.submitted_file.save(
+                "answer.txt", ContentFile(b"same answer"), save=True
+            )
+
+    def grade(self, score, force_regrade=False):
+        """Run an auto-check job; return the scores and the model calls."""
+        job = enqueue_auto_check(self.assignment, self.teacher, force_regrade)
+        with mock.patch.object(
+            Submission, "grade_with_openrouter", return_value=score
+        ) as grade:
+            for task in claim_tasks("a", 10, job_ids=[job.id]):
+                run_task(task)
+        scores = set(self.assignment.submissions.values_list("score", flat=True))
+        return scores, grade.call_count
+
+    def clear_scores(self):
+        self.assignment.submissions.update(score=None)
+
+    def test_identical_files_are_graded_once(self):
+        self.assertEqual(self.grade(7.0), ({7.0}, 1))
+        self.clear_scores()
+        self.assertEqual(self.grade(3.0), ({7.0}, 0))
+
+    def test_forced_regrade_bypasses_the_cache(self):
+        self.grade(7.0)
+        self.clear_scores()
+        self.assertEqual(self.grade(3.0, force_regrade=True), ({3.0}, 2))
+        # The new score replaces the cached one
+        self.clear_scores()
+        self.assertEqual(self.grade(5.0), ({3.0}, 0))
+
+    def test_scores_of_other_models_are_not_reused(self):
+        with override_settings(OPENROUTER_MODEL="benchmark-stub/model"):
+            self.grade(7.0)
+        self.clear_scores()
+        self.assertEqual(self.grade(3.0), ({3.0}, 1))
+
+    def test_batched_scores_are_not_cached(self):
+        job = enqueue_auto_check(self.assignment, self.teacher)
+        tasks = claim_tasks("a", 10, job_ids=[job.id])
+        with mock.patch.object(
+            batch_grading,
+            "grade_batch",
+            return_value={task.submission_id: 6.0 for task in tasks},
+        ):
+            run_task_batch(tasks)
+        self.assertEqual(
+            set(self.assignment.submissions.values_list("score", flat=True)), {6.0}
+        )
+        self.assertFalse(GradingResult.objects.exists())
+
+        # Scores of single prompts are still reused by batches
+        self.clear_scores()
+        self.grade(7.0)
+        self.clear_scores()
+        job = enqueue_auto_check(self.assignment, self.teacher)
+        with mock.patch.object(batch_grading, "grade_batch") as grade_batch:
+            run_task_batch(claim_tasks("a", 10, job_ids=[job.id]))
+        grade_batch.assert_not_called()
+        self.assertEqual(
+            set(self.assignment.submissions.values_list("score", flat=True)), {7.0}
+        )
+
+
+@override_settings(GRADING_IMAGE_MAX_DIMENSION=100, GRADING_OCR_IMAGE_FORMAT="PNG")
+class ImageNormalizationTests(TestCase):
+    def setUp(self):
+        use_temporary_media_root(self)
+        teacher = seed_users("teacher", 1, "imt")[0]
+        students = seed_users("student", 1, "ims")
+        classroom = seed_classroom(teacher, students, assignments=1, prefix="im0")
+        self.submission = Submission.objects.get(assignment__classroom=classroom)
+        self.submission.submitted_file.save(
+            "scan.png", ContentFile(make_png(random.Random(0), 200, 300)), save=True
+        )
+        self.directory = images.derivatives_dir(self.submission.submitted_file_sha256)
+
+    def normalize(self):
+        """Return the (file name, size) of the normalized copy sent to OCR."""
+        image_file = images.normalize_for_ocr(self.submission.submitted_file)
+        with image_file:
+            return os.path.basename(image_file.name), Image.open(image_file).size
+
+    def derivatives(self):
+        return default_storage.listdir(self.directory)[1]
+
+    def test_images_are_normalized_once(self):
+        name, size = self.normalize()
+        self.assertEqual(self.derivatives(), [name])
+        self.assertEqual(max(size), 100)
+
+        with mock.patch.object(images, "_normalize") as normalize:
+            self.assertEqual(self.normalize(), (name, size))
+        normalize.assert_not_called()
+
+    def test_concurrent_normalizations_keep_one_copy(self):
+        name, _ = self.normalize()
+        # The other request saw no copy before normalizing; storage itself
+        # then finds the first copy and picks another name
+        exists = default_storage.exists
+        checked = []
+
+        def race_exists(path):
+            checked.append(path)
+            return len(checked) > 1 and exists(path)
+
+        with mock.patch.object(default_storage, "exists", side_effect=race_exists):
+            self.assertEqual(self.normalize()[0], name)
+        self.assertEqual(self.derivatives(), [name])
@@ -0,0 +1,201 @@
+"""
+Resumable chunked uploads of task, solution and submission files.
+
+A client opens an UploadSession with the file's name and size, then sends
+its bytes in order with PATCH requests carrying the Upload-Offset they start
+at. Each chunk is streamed from the request to a temporary file, so it is
+never held in memory, then copied into the session's file under
+MEDIA_ROOT/UPLOAD_SESSION_DIR; the session's offset only advances once the
+whole chunk is written. After a
+dropped connection the client reads the offset back and resumes from there.
+
+A complete upload is attached to the usual create or submit request by
+sending its id as `<field>_upload` instead of the file, so the file goes
+through the same validation as a multipart upload. Storing it moves the
+assembled file into content-addressed storage rather than copying it.
+"""
+
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers
+
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+class IncompleteChunk(Exception):
+    """The request body ended before its Content-Length."""
+
+
+def data_path(session) -> str:
+    return os.path.join(
+        settings.MEDIA_ROOT, settings.UPLOAD_SESSION_DIR, str(session.id)
+    )
+
+
+def create_data(session) -> None:
+    os.makedirs(os.path.dirname(data_path(session)), exist_ok=True)
+    open(data_path(session), "wb").close()
+
+
+def remove_data(session) -> None:
+    try:
+        os.remove(data_path(session))
+    except FileNotFoundError:
+        pass
+
+
+def clear_expired() -> None:
+    """Delete sessions left unfinished for UPLOAD_SESSION_EXPIRY_SECONDS."""
+    from assignments.models import UploadSession
+
+    cutoff = timezone.now() - timedelta(seconds=settings.UPLOAD_SESSION_EXPIRY_SECONDS)
+    UploadSession.objects.filter(updated_at__lt=cutoff).delete()
+
+
+def write_chunk(session, offset: int, stream, length: int) -> bool:
+    """
+    Write `length` bytes read from `stream` at `offset` and advance the
+    session past them. Returns False when another request advanced it
+    first; raises IncompleteChunk when the stream ends early, leaving the
+    offset unchanged so that the chunk is sent again.
+
+    The chunk is received into a temporary file, so a slow or stalled
+    request holds no lock. It is then copied into place under a lock on
+    the session's file, only while the session is still at `offset`: of
+    two requests sending the same chunk, the loser writes nothing.
+    """
+    from assignments.models import UploadSession
+
+    with tempfile.TemporaryFile(dir=settings.FILE_UPLOAD_TEMP_DIR) as chunk_file:
+        remaining = length
+        while remaining > 0:
+            chunk = stream.read(min(COPY_CHUNK_SIZE, remaining))
+            if not chunk:
+                raise IncompleteChunk
+            chunk_file.write(chunk)
+            remaining -= len(chunk)
+        chunk_file.seek(0)
+
+        with open(data_path(session), "r+b") as file:
+            # Released when the file is closed
+            fcntl.flock(file, fcntl.LOCK_EX)
+            sessions = UploadSession.objects.filter(id=session.id, offset=offset)
+            if not sessions.exists():
+                return False
+            file.seek(offset)
+            shutil.copyfileobj(chunk_file, file, COPY_CHUNK_SIZE)
+            file.flush()
+
+            session.offset = offset + length
+            if session.is_complete:
+                session.sha256 = file_sha256(data_path(session))
+            return bool(
+                sessions.update(
+                    offset=session.offset,
+                    sha256=session.sha256,
+                    updated_at=timezone.now(),
+                )
+            )
+
+
+def file_sha256(path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(COPY_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class SessionFile(File):
+    """
+    The assembled file of a complete session. Like an upload spooled to a
+    temporary file, it is moved into storage, and it carries its hash so
+    that storing it does not read it again.
+    """
+
+    def __init__(self, session):
+        super().__init__(open(data_path(session), "rb"), name=session.filename)
+        self.session = session
+        self.size = session.size
+        self.sha256 = session.sha256
+
+    def temporary_file_path(self):
+        return data_path(self.session)
+
+
+def open_uploads(data, user_id, field_names: list[str]):
+    """
+    Return `data` with each `<field>_upload` session id replaced by the
+    session's file under `<field>`, and the files opened. Raises a
+    ValidationError for sessions that are unknown or not complete.
+    """
+    from assignments.models import UploadSession
+
+    upload_ids = {
+        field_name: data.get(f"{field_name}_upload")
+        for field_name in field_names
+        if data.get(f"{field_name}_upload")
+    }
+    if not upload_ids:
+        return data, []
+
+    valid_ids = []
+    for upload_id in upload_ids.values():
+        try:
+            valid_ids.append(uuid.UUID(str(upload_id)))
+        except ValueError:
+            pass
+    sessions = {
+        str(session.id): session
+        for session in UploadSession.objects.filter(id__in=valid_ids, user_id=user_id)
+    }
+
+    data = data.dict() if hasattr(data, "dict") else dict(data)
+    files, errors = [], {}
+    for field_name, upload_id in upload_ids.items():
+        session = sessions.get(str(upload_id))
+        if session is None:
+            errors[f"{field_name}_upload"] = ["Unknown upload."]
+        elif not session.is_complete:
+            errors[f"{field_name}_upload"] = [
+                f"Upload is incomplete, {session.offset} of {session.size} bytes "
+                "were received."
+            ]
+        else:
+            try:
+                data[field_name] = SessionFile(session)
+            except FileNotFoundError:
+                errors[f"{field_name}_upload"] = ["Upload is no longer available."]
+                continue
+            files.append(data[field_name])
+    if errors:
+        close_uploads(files)
+        raise serializers.ValidationError(errors)
+    return data, files
+
+
+def close_uploads(files: list[SessionFile]) -> None:
+    for file in files:
+        file.close()
+
+
+def finish_uploads(files: list[SessionFile]) -> None:
+    """Delete the sessions whose files were stored, once that is committed."""
+    from assignments.models import UploadSession
+
+    close_uploads(files)
+    session_ids = [file.session.id for file in files]
+    if session_ids:
+        transaction.on_commit(
+            lambda: UploadSession.objects.filter(id__in=session_ids).delete()
+        )
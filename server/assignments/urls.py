@@ -1,7 +1,10 @@
 from django.urls import path
 from .views import (
+    AutoCheckJobStatusView,
     AutoCheckSubmissionsView,
+    BulkMarkSubmissionsView,
     CreateAssignmentView,
+    FileDownloadView,
     AssignmentListView,
     SubmitAssignmentView,
     SubmissionListView,
@@ -9,6 +12,8 @@ from .views import (
     StudentScoreView,
     AssignmentDetailView,
     ResetSubmissionScoresView,
+    UploadSessionCreateView,
+    UploadSessionView,
 )
 
 urlpatterns = [
@@ -26,6 +31,11 @@ urlpatterns = [
         AutoCheckSubmissionsView.as_view(),
         name="assignment-auto-check",
     ),
+    path(
+        "auto-check/jobs/<int:job_id>/",
+        AutoCheckJobStatusView.as_view(),
+        name="auto-check-job-status",
+    ),
     path(
         "<int:assignment_id>/reset-scores/",
         ResetSubmissionScoresView.as_view(),
@@ -46,7 +56,23 @@ urlpatterns = [
         MarkSubmissionView.as_view(),
         name="mark-submission",
     ),
+    path(
+        "<int:assignment_id>/mark/",
+        BulkMarkSubmissionsView.as_view(),
+        name="bulk-mark-submissions",
+    ),
     path(
         "score/<int:assignment_id>/", StudentScoreView.as_view(), name="student-score"
     ),
+    path(
+        "files/<str:kind>/<int:object_id>/<int:user_id>/<str:token>/<str:filename>",
+        FileDownloadView.as_view(),
+        name="download-file",
+    ),
+    path("uploads/", UploadSessionCreateView.as_view(), name="create-upload"),
+    path(
+        "uploads/<uuid:upload_id>/",
+        UploadSessionView.as_view(),
+        name="upload-session",
+    ),
 ]
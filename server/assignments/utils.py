@@ -1,10 +1,114 @@
 import base64
+import hashlib
+import json
+import os
 from docx import Document
+from docx.table import Table
+from pypdf import PdfReader
 
-def read_file_b64(file_field) -> str:
+# Multiple of 3 so every chunk encodes to base64 without padding
+B64_CHUNK_SIZE = 3 * 256 * 1024
+
+def read_file_b64(file_field, prefix: str = '') -> str:
+    """
+    Return `prefix` followed by the base64 encoding of the file. The file is
+    read and encoded chunk by chunk and the pieces are joined once into the
+    result, so encoding holds at most two copies of the encoded data (the
+    pieces and the result) and the raw file is never held whole.
+    """
+    pieces = [prefix]
+    pending = b''
     with file_field.open('rb') as f:
-        return base64.b64encode(f.read()).decode('utf-8')
+        for chunk in iter(lambda: f.read(B64_CHUNK_SIZE), b''):
+            pending += chunk
+            usable = len(pending) - len(pending) % 3
+            pieces.append(base64.b64encode(pending[:usable]).decode('ascii'))
+            pending = pending[usable:]
+    pieces.append(base64.b64encode(pending).decode('ascii'))
+    return ''.join(pieces)
+
+DOCX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# Source code and plain-text formats sent to the model as decoded text
+PLAIN_TEXT_EXTENSIONS = {
+    ".txt", ".md", ".csv", ".tsv", ".json", ".xml", ".yaml", ".yml", ".html",
+    ".css", ".tex", ".py", ".java", ".c", ".h", ".cpp", ".hpp", ".cc", ".cs",
+    ".js", ".jsx", ".ts", ".tsx", ".go", ".rs", ".rb", ".php", ".kt", ".swift",
+    ".scala", ".r", ".m", ".sql", ".sh", ".asm", ".hs", ".pl", ".lua", ".dart",
+}
+
+# Text extractors by file extension and by MIME type, see get_text_extractor
+EXTRACTORS_BY_EXTENSION = {}
+EXTRACTORS_BY_MIME_TYPE = {}
 
+def register_extractor(extensions=(), mime_types=()):
+    def decorator(extractor):
+        for extension in extensions:
+            EXTRACTORS_BY_EXTENSION[extension] = extractor
+        for mime_type in mime_types:
+            EXTRACTORS_BY_MIME_TYPE[mime_type] = extractor
+        return extractor
+    return decorator
+
+def get_text_extractor(file_name, mime_type):
+    extension = os.path.splitext(file_name)[1].lower()
+    extractor = EXTRACTORS_BY_EXTENSION.get(extension) or EXTRACTORS_BY_MIME_TYPE.get(mime_type)
+    if extractor is None and mime_type and mime_type.startswith("text/"):
+        extractor = plain_text
+    return extractor
+
+@register_extractor(extensions=[".docx"], mime_types=[DOCX_MIME_TYPE])
 def docx_to_text(file_field):
-    doc = Document(file_field)
-    return "\n".join(p.text for p in doc.paragraphs)
+    with file_field.open('rb') as f:
+        doc = Document(f)
+    blocks = []
+    # Walk the body in order so tables stay next to the paragraphs around them
+    for block in doc.iter_inner_content():
+        if isinstance(block, Table):
+            for row in block.rows:
+                blocks.append(" | ".join(cell.text.strip() for cell in row.cells))
+        else:
+            blocks.append(block.text)
+    return "\n".join(blocks)
+
+@register_extractor(extensions=[".pdf"], mime_types=["application/pdf"])
+def pdf_to_text(file_field):
+    with file_field.open('rb') as f:
+        reader = PdfReader(f)
+        pages = [page.extract_text() or "" for page in reader.pages]
+    # Scanned pages have no text layer; labelling them would hide from the
+    # caller that there is no text and keep it from sending the file instead
+    return "\n\n".join(
+        f"[Page {number}]\n{text}"
+        for number, text in enumerate(pages, start=1)
+        if text.strip()
+    )
+
+@register_extractor(extensions=sorted(PLAIN_TEXT_EXTENSIONS))
+def plain_text(file_field):
+    with file_field.open('rb') as f:
+        data = f.read()
+    if b'\x00' in data:
+        raise ValueError("file looks binary")
+    return data.decode('utf-8', errors='replace')
+
+@register_extractor(extensions=[".ipynb"], mime_types=["application/x-ipynb+json"])
+def notebook_to_text(file_field):
+    with file_field.open('rb') as f:
+        notebook = json.load(f)
+    blocks = []
+    for number, cell in enumerate(notebook.get("cells", []), start=1):
+        source = "".join(cell.get("source", []))
+        blocks.append(f"[Cell {number}: {cell.get('cell_type', 'unknown')}]\n{source}")
+        for output in cell.get("outputs", []):
+            text = output.get("text") or output.get("data", {}).get("text/plain")
+            if text:
+                blocks.append("[Output]\n" + "".join(text))
+    return "\n\n".join(blocks)
+
+def file_sha256(file_field) -> str:
+    digest = hashlib.sha256()
+    with file_field.open('rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -1,52 +1,133 @@
-from rest_framework import generics, permissions, status, parsers
+from rest_framework import generics, permissions, serializers, status, parsers
 from rest_framework.response import Response
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
-from assignments.models import Assignment, Submission
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.http import Http404
+from django.conf import settings
+from assignments import downloads, storage, uploads
+from assignments.models import (
+    Assignment,
+    AutoCheckJob,
+    Submission,
+    UploadSession,
+    count_subquery,
+)
+from assignments.jobs import enqueue_auto_check, get_active_job
+from assignments.pagination import (
+    AssignmentCursorPagination,
+    SubmissionCursorPagination,
+)
 from assignments.serializers import (
     AssignmentSerializer,
+    AutoCheckJobSerializer,
+    BulkMarkSerializer,
     CreateAssignmentSerializer,
     StudentSubmissionStatusSerializer,
     SubmissionSerializer,
     SubmissionCreateSerializer,
+    UploadSessionSerializer,
+)
+from classes import response_cache
+from classes.conditional import (
+    ConditionalGetMixin,
+    class_state,
+    newest_subquery,
 )
 from classes.models import Class
 from accounts.permissions import IsTeacher, IsStudent
-from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class ChunkedUploadMixin:
+    """
+    Also accept the files in `upload_fields` uploaded in chunks beforehand,
+    see assignments.uploads: the request names the complete upload session
+    as `<field>_upload` instead of sending the file. The sessions are
+    deleted once the files are stored.
+    """
+
+    upload_fields: list[str] = []
+
+    def create(self, request, *args, **kwargs):
+        self.upload_files = []
+        try:
+            # Storing a file counts a reference to its blob, which has to be
+            # given back when the row cannot be inserted
+            with storage.atomic():
+                response = super().create(request, *args, **kwargs)
+        except Exception:
+            uploads.close_uploads(self.upload_files)
+            raise
+        uploads.finish_uploads(self.upload_files)
+        return response
+
+    def get_serializer(self, *args, **kwargs):
+        if "data" in kwargs:
+            kwargs["data"], self.upload_files = uploads.open_uploads(
+                kwargs["data"], self.request.user.id, self.upload_fields
+            )
+        return super().get_serializer(*args, **kwargs)
 
 
 # 1. Teacher creates assignment in a class
-class CreateAssignmentView(generics.CreateAPIView):
+class CreateAssignmentView(ChunkedUploadMixin, generics.CreateAPIView):
     serializer_class = CreateAssignmentSerializer
     permission_classes = [permissions.IsAuthenticated, IsTeacher]
-    parser_classes = [parsers.MultiPartParser, parsers.FormParser]
+    parser_classes = [parsers.MultiPartParser, parsers.FormParser, parsers.JSONParser]
+    upload_fields = ["task_file", "solution_file"]
+
+    def create(self, request, *args, **kwargs):
+        try:
+            return super().create(request, *args, **kwargs)
+        except IntegrityError:
+            raise serializers.ValidationError(
+                {"name": ["This class already has an assignment with this name"]}
+            )
 
     def perform_create(self, serializer):
         class_id = self.request.data.get("classroom")
-        classroom = get_object_or_404(Class, id=class_id, teacher=self.request.user)
+        classroom = get_object_or_404(
+            Class, id=class_id, teacher_id=self.request.user.id
+        )
         serializer.save(classroom=classroom)
 
 
 # 2. Teacher & student see all assignments in a class
-class AssignmentListView(generics.ListAPIView):
+class AssignmentListView(ConditionalGetMixin, generics.ListAPIView):
     serializer_class = AssignmentSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = AssignmentCursorPagination
 
     def get_queryset(self):
         classroom = self.kwargs["class_id"]
         user = self.request.user
 
         if user.role == "teacher":
-            return Assignment.objects.filter(
-                classroom__id=classroom, classroom__teacher=user
+            queryset = Assignment.objects.filter(
+                classroom__id=classroom, classroom__teacher_id=user.id
             )
         else:
-            return Assignment.objects.filter(
-                classroom__id=classroom, classroom__classmembership__student=user
+            queryset = Assignment.objects.filter(
+                classroom__id=classroom,
+                classroom__classmembership__student_id=user.id,
             )
+        return queryset.with_user_context(user)
 
+    def get_state(self):
+        return class_state(self.request.user, self.kwargs["class_id"])
+
+    def list(self, request, *args, **kwargs):
+        data = response_cache.cached_response(
+            request,
+            "assignment-list",
+            self.kwargs["class_id"],
+            lambda: super(AssignmentListView, self).list(request, *args, **kwargs).data,
+        )
+        return Response(data)
 
-class AssignmentDetailView(generics.RetrieveAPIView):
+
+class AssignmentDetailView(ConditionalGetMixin, generics.RetrieveAPIView):
     serializer_class = AssignmentSerializer
     permission_classes = [permissions.IsAuthenticated]
     lookup_url_kwarg = "assignment_id"
@@ -55,72 +136,167 @@ class AssignmentDetailView(generics.RetrieveAPIView):
         user = self.request.user
         class_id = self.kwargs["class_id"]
         if user.role == "teacher":
-            return Assignment.objects.filter(
+            queryset = Assignment.objects.filter(
+                id=self.kwargs["assignment_id"],
+                classroom__id=class_id,
+                classroom__teacher_id=user.id,
+            )
+        else:
+            queryset = Assignment.objects.filter(
                 id=self.kwargs["assignment_id"],
                 classroom__id=class_id,
-                classroom__teacher=user,
+                classroom__classmembership__student_id=user.id,
             )
-        return Assignment.objects.filter(
-            id=self.kwargs["assignment_id"],
-            classroom__id=class_id,
-            classroom__classmembership__student=user,
+        return queryset.with_user_context(user)
+
+    def get_state(self):
+        user = self.request.user
+        queryset = self.get_queryset()
+        if user.role == "teacher":
+            return queryset.values_list("updated_at").first()
+        return (
+            queryset.annotate(
+                submission_updated_at=newest_subquery(
+                    Submission.objects.filter(student_id=user.id), "assignment"
+                )
+            )
+            .values_list("updated_at", "submission_updated_at")
+            .first()
         )
 
 
 # 3. Student uploads submission if deadline not passed
-class SubmitAssignmentView(generics.CreateAPIView):
+class SubmitAssignmentView(ChunkedUploadMixin, generics.CreateAPIView):
     serializer_class = SubmissionCreateSerializer
     permission_classes = [permissions.IsAuthenticated, IsStudent]
-    parser_classes = [parsers.MultiPartParser, parsers.FormParser]
+    parser_classes = [parsers.MultiPartParser, parsers.FormParser, parsers.JSONParser]
+    upload_fields = ["submitted_file"]
 
     def perform_create(self, serializer):
         assignment = get_object_or_404(Assignment, id=self.kwargs["assignment_id"])
         if timezone.now() > assignment.deadline:
             raise serializers.ValidationError({"detail": "Deadline passed"})
         if Submission.objects.filter(
-            assignment=assignment, student=self.request.user
+            assignment=assignment, student_id=self.request.user.id
         ).exists():
             raise serializers.ValidationError(
                 {"detail": "You have already submitted this assignment"}
             )
-        serializer.save(student=self.request.user, assignment=assignment)
+        # In the transaction of ChunkedUploadMixin.create
+        serializer.save(student_id=self.request.user.id, assignment=assignment)
+        Assignment.objects.filter(id=assignment.id).update(
+            submission_count=F("submission_count") + 1, updated_at=timezone.now()
+        )
+        response_cache.submissions_changed(
+            assignment.classroom_id, [self.request.user.id]
+        )
 
 
 # 4. Teacher views all submissions for an assignment
-class SubmissionListView(generics.ListAPIView):
+class SubmissionListView(ConditionalGetMixin, generics.ListAPIView):
     serializer_class = SubmissionSerializer
     permission_classes = [permissions.IsAuthenticated, IsTeacher]
+    pagination_class = SubmissionCursorPagination
 
     def get_queryset(self):
         assignment_id = self.kwargs["assignment_id"]
         assignment = Assignment.objects.get(
-            id=assignment_id, classroom__teacher=self.request.user
+            id=assignment_id, classroom__teacher_id=self.request.user.id
+        )
+        return Submission.objects.filter(assignment=assignment).select_related(
+            "student"
+        )
+
+    def get_state(self):
+        return (
+            Assignment.objects.filter(
+                id=self.kwargs["assignment_id"],
+                classroom__teacher_id=self.request.user.id,
+            )
+            .annotate(
+                submissions_updated_at=newest_subquery(
+                    Submission.objects, "assignment"
+                ),
+                submission_rows=count_subquery(Submission.objects, "assignment"),
+            )
+            .values_list("submissions_updated_at", "submission_rows")
+            .first()
         )
-        return Submission.objects.filter(assignment=assignment)
 
 
 # 5. Teacher marks submissions
 class MarkSubmissionView(generics.UpdateAPIView):
     serializer_class = SubmissionSerializer
     permission_classes = [permissions.IsAuthenticated, IsTeacher]
-    queryset = Submission.objects.all()
+    queryset = Submission.objects.select_related("assignment__classroom", "student")
     lookup_url_kwarg = "submission_id"
 
     def patch(self, request, *args, **kwargs):
         submission = self.get_object()
-        if submission.assignment.classroom.teacher != request.user:
+        if submission.assignment.classroom.teacher_id != request.user.id:
             return Response({"detail": "Not allowed"}, status=status.HTTP_403_FORBIDDEN)
         score = request.data.get("score")
         if score is None:
             return Response(
                 {"detail": "Score required"}, status=status.HTTP_400_BAD_REQUEST
             )
-        submission.score = score
-        submission.save()
+        submission.set_score(score)
         serializer = self.get_serializer(submission)
         return Response(serializer.data)
 
 
+class BulkMarkSubmissionsView(generics.GenericAPIView):
+    """
+    Score many submissions of one assignment at once, e.g. from a spreadsheet.
+    Expects {"scores": [{"submission_id": 1, "score": 8.5}, ...]}; either all
+    scores are saved or none.
+    """
+
+    permission_classes = [permissions.IsAuthenticated, IsTeacher]
+
+    def post(self, request, *args, **kwargs):
+        assignment = get_object_or_404(
+            Assignment,
+            id=kwargs["assignment_id"],
+            classroom__teacher_id=request.user.id,
+        )
+        serializer = BulkMarkSerializer(
+            data=request.data, context={"assignment": assignment}
+        )
+        serializer.is_valid(raise_exception=True)
+        scores = {
+            entry["submission_id"]: entry["score"]
+            for entry in serializer.validated_data["scores"]
+        }
+
+        with transaction.atomic():
+            submissions = list(
+                Submission.objects.filter(
+                    assignment=assignment, id__in=scores
+                ).select_related("student")
+            )
+            unknown = sorted(
+                set(scores) - {submission.id for submission in submissions}
+            )
+            if unknown:
+                return Response(
+                    {
+                        "detail": f"Submissions {unknown} do not belong to this assignment"
+                    },
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+            Submission.set_scores(submissions, scores)
+
+        return Response(
+            {
+                "updated": len(submissions),
+                "submissions": SubmissionSerializer(
+                    submissions, many=True, context={"request": request}
+                ).data,
+            }
+        )
+
+
 # 6. Student views their score in an assignment
 class StudentScoreView(generics.RetrieveAPIView):
     serializer_class = StudentSubmissionStatusSerializer
@@ -129,17 +305,24 @@ class StudentScoreView(generics.RetrieveAPIView):
     def get_object(self):
         assignment_id = self.kwargs["assignment_id"]
         return Submission.objects.get(
-            assignment_id=assignment_id, student=self.request.user
+            assignment_id=assignment_id, student_id=self.request.user.id
         )
 
 
 class AutoCheckSubmissionsView(generics.GenericAPIView):
+    """
+    Queue all unchecked submissions of an assignment for auto-grading. The
+    grading itself is done by `manage.py run_autocheck_worker`; progress can be
+    followed through AutoCheckJobStatusView. Pass `force: true` to ignore
+    previously cached scores for identical files.
+    """
+
     permission_classes = [permissions.IsAuthenticated, IsTeacher]
 
     def post(self, request, *args, **kwargs):
         assignment_id = kwargs.get("assignment_id")
         assignment = get_object_or_404(
-            Assignment, id=assignment_id, classroom__teacher=request.user
+            Assignment, id=assignment_id, classroom__teacher_id=request.user.id
         )
 
         if not assignment.task_file or not assignment.solution_file:
@@ -150,52 +333,29 @@ class AutoCheckSubmissionsView(generics.GenericAPIView):
                 status=status.HTTP_400_BAD_REQUEST,
             )
 
-        submissions = Submission.objects.filter(
-            assignment=assignment, score__isnull=True
-        )
-        if not submissions.exists():
+        job = get_active_job(assignment)
+        if job is None:
+            force_regrade = str(request.data.get("force", "")).lower() in ("1", "true")
+            job = enqueue_auto_check(assignment, request.user, force_regrade)
+        if job is None:
             return Response(
                 {"detail": "No unchecked submissions found"},
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        with ThreadPoolExecutor() as executor:
-            futures = [
-                executor.submit(self.process_submission, sub, assignment)
-                for sub in submissions
-                if sub.submitted_file
-            ]
-            for future in as_completed(futures):
-                _ = future.result()
-        
-        # for sub in submissions:
-        #     if sub.submitted_file:
-        #         self.process_submission(sub, assignment)
-
-        # Return the updated submissions
-        updated_submissions = Submission.objects.filter(assignment=assignment)
-        serializer = SubmissionSerializer(
-            updated_submissions, many=True, context={"request": request}
-        )
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        serializer = AutoCheckJobSerializer(job)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
 
-    def process_submission(self, submission, assignment):
-        if not submission.submitted_file:
-            return None
 
-        print(f" ⏱ Auto checking {submission}")
+class AutoCheckJobStatusView(generics.RetrieveAPIView):
+    serializer_class = AutoCheckJobSerializer
+    permission_classes = [permissions.IsAuthenticated, IsTeacher]
+    lookup_url_kwarg = "job_id"
 
-        try:
-            score = submission.auto_check(assignment)
-            if score is None:
-                return None
-            submission.score = round(score * 4) / 4
-            submission.save()
-            print(f" ✔ Checked {submission}")
-            return submission.id
-        except Exception as e:
-            print(f"Error processing submission {submission.id}: {str(e)}")
-            return None
+    def get_queryset(self):
+        return AutoCheckJob.objects.filter(
+            assignment__classroom__teacher_id=self.request.user.id
+        )
 
 
 class ResetSubmissionScoresView(generics.GenericAPIView):
@@ -210,7 +370,7 @@ class ResetSubmissionScoresView(generics.GenericAPIView):
     def post(self, request, *args, **kwargs):
         assignment_id = kwargs.get("assignment_id")
         assignment = get_object_or_404(
-            Assignment, id=assignment_id, classroom__teacher=request.user
+            Assignment, id=assignment_id, classroom__teacher_id=request.user.id
         )
 
         # Find all submissions for this assignment that have scores
@@ -225,7 +385,13 @@ class ResetSubmissionScoresView(generics.GenericAPIView):
             )
 
         # Reset scores to None
-        reset_count = submissions_with_scores.update(score=None)
+        with transaction.atomic():
+            now = timezone.now()
+            reset_count = submissions_with_scores.update(score=None, updated_at=now)
+            Assignment.objects.filter(id=assignment.id).update(
+                graded_count=F("graded_count") - reset_count, updated_at=now
+            )
+            response_cache.class_changed(assignment.classroom_id)
 
         return Response(
             {
@@ -236,3 +402,122 @@ class ResetSubmissionScoresView(generics.GenericAPIView):
             },
             status=status.HTTP_200_OK,
         )
+
+
+# 7. Teacher & student download task, solution and submission files
+class FileDownloadView(generics.GenericAPIView):
+    """
+    Serve a file through the signed URL built by `downloads.file_url`. The
+    URL stands in for the Authorization header, which links do not send,
+    and access is checked again for the user it was issued to.
+    """
+
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request, kind, object_id, user_id, token, filename):
+        if kind not in downloads.FILE_FIELDS:
+            raise Http404
+        version = downloads.check_token(kind, object_id, user_id, token)
+        if version is None:
+            raise Http404
+
+        if kind == "submission":
+            queryset = Submission.objects.filter(
+                Q(student_id=user_id) | Q(assignment__classroom__teacher_id=user_id)
+            )
+        elif kind == "solution":
+            queryset = Assignment.objects.filter(classroom__teacher_id=user_id)
+        else:
+            queryset = Assignment.objects.filter(
+                Q(classroom__teacher_id=user_id)
+                | Q(classroom__classmembership__student_id=user_id)
+            )
+        obj = queryset.filter(id=object_id).first()
+        if obj is None:
+            raise Http404
+        file_field = getattr(obj, downloads.FILE_FIELDS[kind])
+        # A replaced file gets a new URL
+        if not file_field or downloads.file_version(file_field) != version:
+            raise Http404
+        return downloads.serve_file(request, file_field, version)
+
+
+# 8. Teacher & student upload large files in chunks
+class UploadSessionCreateView(generics.CreateAPIView):
+    """
+    Open a resumable upload, given the file's name and size. The file is
+    then sent to UploadSessionView and attached to an assignment or a
+    submission by the returned id, see ChunkedUploadMixin.
+    """
+
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def perform_create(self, serializer):
+        uploads.clear_expired()
+        session = serializer.save(user_id=self.request.user.id)
+        uploads.create_data(session)
+
+
+class UploadSessionView(generics.RetrieveDestroyAPIView):
+    """
+    GET returns the offset to resume an upload from, DELETE abandons it and
+    PATCH appends a chunk: the raw bytes as the body, with an Upload-Offset
+    header giving their position in the file, which must be the current
+    offset.
+    """
+
+    serializer_class = UploadSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    lookup_url_kwarg = "upload_id"
+
+    def get_queryset(self):
+        return UploadSession.objects.filter(user_id=self.request.user.id)
+
+    def patch(self, request, *args, **kwargs):
+        session = self.get_object()
+        try:
+            offset = int(request.headers["Upload-Offset"])
+            length = int(request.headers["Content-Length"])
+        except (KeyError, ValueError):
+            return Response(
+                {"detail": "Upload-Offset and Content-Length headers required"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if offset != session.offset:
+            return self.offset_conflict(session)
+        if length > settings.UPLOAD_CHUNK_MAX_SIZE:
+            return Response(
+                {
+                    "detail": f"Chunks must not exceed {settings.UPLOAD_CHUNK_MAX_SIZE} bytes"
+                },
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+        if length < 1 or offset + length > session.size:
+            return Response(
+                {"detail": f"Chunk does not fit in the {session.size} bytes file"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            written = uploads.write_chunk(session, offset, request.stream, length)
+        except uploads.IncompleteChunk:
+            return Response(
+                {"detail": "Chunk ended early, send it again"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not written:
+            # A retried chunk was written by another request in the meantime
+            session.refresh_from_db()
+            return self.offset_conflict(session)
+        return Response(self.get_serializer(session).data)
+
+    def offset_conflict(self, session):
+        return Response(
+            {
+                "detail": f"Expected the chunk at offset {session.offset}",
+                "offset": session.offset,
+            },
+            status=status.HTTP_409_CONFLICT,
+        )
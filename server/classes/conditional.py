@@ -0,0 +1,114 @@
+"""
+Conditional GET for the read endpoints that clients poll. A view describes
+the rows its response is built from with one aggregate query over their
+updated_at columns; the ETag and Last-Modified validators are derived from
+that state, so an unchanged resource is answered with 304 before anything
+is serialized.
+"""
+
+import hashlib
+
+from django.db.models import DateTimeField, Max, OuterRef, Subquery
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date
+
+from assignments import downloads
+from assignments.models import Assignment, Submission, count_subquery
+from classes.models import Class
+
+
+def newest_subquery(queryset, field):
+    """Newest updated_at of the rows of `queryset` whose `field` is the outer row."""
+    return Subquery(
+        queryset.filter(**{field: OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(value=Max("updated_at"))
+        .values("value"),
+        output_field=DateTimeField(),
+    )
+
+
+def class_state(user, class_id):
+    """
+    State of a class as seen by `user`: its row, its assignments and, for
+    students, their membership and own submissions. None when the user has
+    no access to the class.
+    """
+    if user.role == "teacher":
+        queryset = Class.objects.filter(id=class_id, teacher_id=user.id)
+        fields = ["updated_at"]
+    else:
+        queryset = Class.objects.filter(
+            id=class_id, classmembership__student_id=user.id
+        ).annotate(
+            submissions_updated_at=newest_subquery(
+                Submission.objects.filter(student_id=user.id),
+                "assignment__classroom",
+            )
+        )
+        fields = ["updated_at", "classmembership__updated_at", "submissions_updated_at"]
+    return (
+        queryset.annotate(
+            assignments_updated_at=newest_subquery(Assignment.objects, "classroom"),
+            # Deleting a row can leave the newest updated_at unchanged
+            assignment_count=count_subquery(Assignment.objects, "classroom"),
+        )
+        .values_list(*fields, "assignments_updated_at", "assignment_count")
+        .first()
+    )
+
+
+class ConditionalGetMixin:
+    """
+    Answer GET with 304 Not Modified when the client's If-None-Match or
+    If-Modified-Since still matches `get_state()`, a tuple of the timestamps
+    and counts the response is built from. A state of None (missing or
+    forbidden resource) leaves the request to the view, which returns the
+    error response without validators.
+    """
+
+    def get_state(self):
+        raise NotImplementedError
+
+    def get(self, request, *args, **kwargs):
+        state = self.get_state()
+        if state is None:
+            return super().get(request, *args, **kwargs)
+
+        # Responses differ per user, and absolute URLs per host and query.
+        # Embedded download URLs are reissued when their window rolls over.
+        etag = hashlib.sha256(
+            repr(
+                (
+                    type(self).__name__,
+                    request.user.id,
+                    request.build_absolute_uri(),
+                    state,
+                    downloads.url_epoch(),
+                )
+            ).encode()
+        ).hexdigest()[:32]
+        etag = f'W/"{etag}"'
+        # Reissued download URLs count as a modification too
+        last_modified = max(
+            [int(value.timestamp()) for value in state if hasattr(value, "timestamp")]
+            + [downloads.url_epoch() * downloads.url_window()]
+        )
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response["ETag"] = etag
+            response["Last-Modified"] = http_date(last_modified)
+        # Browsers revalidate on every request instead of reusing the body
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ["Authorization"])
+        return response
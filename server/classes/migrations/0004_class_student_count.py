@@ -0,0 +1,18 @@
+# Generated by Django 5.2.3 on 2026-10-17 06:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("classes", "0003_alter_class_invite_code"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="class",
+            name="student_count",
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.3 on 2026-10-17 07:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("classes", "0004_class_student_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="class",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name="classmembership",
+            name="updated_at",
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -10,6 +10,10 @@ class Class(models.Model):
     subject = models.CharField(max_length=255)
     teacher = models.ForeignKey(User, on_delete=models.CASCADE, related_name="taught_classes")
     invite_code = models.CharField(unique=True)
+    # Maintained on join, see rebuild_counters to recompute
+    student_count = models.IntegerField(default=0)
+    # Queryset updates set it explicitly, auto_now only applies to save()
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ('subject', 'section')
@@ -18,5 +22,6 @@ class Class(models.Model):
 class ClassMembership(models.Model):
     student = models.ForeignKey(User, on_delete=models.CASCADE)
     classroom = models.ForeignKey(Class, on_delete=models.CASCADE)
+    updated_at = models.DateTimeField(auto_now=True)
     class Meta:
         unique_together = ('student', 'classroom')
@@ -0,0 +1,113 @@
+"""
+Cache of serialized class detail and assignment list responses.
+
+Cache keys embed version numbers kept in the same cache, and a change bumps
+the versions of the viewers it affects, so nothing has to be enumerated or
+deleted:
+
+- the class version, for changes every member sees (new assignments, joins),
+- the teacher version, for submission and grading counters,
+- one version per student and class, for that student's own submissions.
+
+Versions are bumped once the surrounding transaction commits, so a response
+built from uncommitted data is never stored under a current version.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+GENERATION_KEY = "responses:generation"
+
+
+def _cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def _class_key(class_id) -> str:
+    return f"responses:class:{class_id}"
+
+
+def _teacher_key(class_id) -> str:
+    return f"responses:class:{class_id}:teacher"
+
+
+def _student_key(class_id, student_id) -> str:
+    return f"responses:class:{class_id}:student:{student_id}"
+
+
+def _new_version() -> int:
+    # A version lost to eviction restarts from a value never used before
+    return time.time_ns()
+
+
+def _get_versions(keys: list[str]) -> list[int]:
+    cache = _cache()
+    versions = cache.get_many(keys)
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        for key in missing:
+            cache.add(key, _new_version(), None)
+        versions.update(cache.get_many(missing))
+    return [versions.get(key, 0) for key in keys]
+
+
+def _bump(keys: list[str]) -> None:
+    def bump():
+        cache = _cache()
+        for key in keys:
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, _new_version(), None)
+
+    transaction.on_commit(bump)
+
+
+def cached_response(request, view_name: str, class_id, build):
+    """
+    Return the serialized response of `view_name` for the requesting user in
+    a class, calling `build()` on a miss. Responses are cached per user, so
+    access checks made by `build()` are cached with them; exceptions such as
+    a 404 are not cached.
+    """
+    if not settings.RESPONSE_CACHE_TIMEOUT:
+        return build()
+
+    user = request.user
+    version_keys = [GENERATION_KEY, _class_key(class_id)]
+    if user.role == "teacher":
+        version_keys.append(_teacher_key(class_id))
+    else:
+        version_keys.append(_student_key(class_id, user.id))
+    versions = ".".join(str(version) for version in _get_versions(version_keys))
+    # Absolute URLs in the payload depend on the host, pages on the query
+    url = hashlib.sha256(request.build_absolute_uri().encode()).hexdigest()[:32]
+    key = f"responses:{view_name}:{class_id}:{user.id}:{versions}:{url}"
+
+    cache = _cache()
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, settings.RESPONSE_CACHE_TIMEOUT)
+    return data
+
+
+def class_changed(class_id) -> None:
+    """Invalidate every cached response of a class."""
+    _bump([_class_key(class_id)])
+
+
+def submissions_changed(class_id, student_ids) -> None:
+    """Invalidate the teacher's and the given students' responses of a class."""
+    _bump(
+        [_teacher_key(class_id)]
+        + [_student_key(class_id, student_id) for student_id in set(student_ids)]
+    )
+
+
+def invalidate_all() -> None:
+    _bump([GENERATION_KEY])
@@ -20,15 +20,11 @@ class CreateClassSerializer(serializers.ModelSerializer):
 
 class ClassSerializer(serializers.ModelSerializer):
     teacher = TeacherSerializer()
-    student_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Class
         fields = ["id", "name", "subject", "section", "teacher", "student_count"]
 
-    def get_student_count(self, obj):
-        return obj.classmembership_set.count()
-
 
 class JoinClassSerializer(serializers.Serializer):
     invite_code = serializers.CharField(min_length=7, max_length=7)
@@ -37,7 +33,6 @@ class JoinClassSerializer(serializers.Serializer):
 class ClassDetailSerializer(serializers.ModelSerializer):
     teacher = TeacherSerializer()
     assignments = serializers.SerializerMethodField()
-    student_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Class
@@ -59,6 +54,3 @@ class ClassDetailSerializer(serializers.ModelSerializer):
             assignments, many=True, context={"request": request}
         )
         return serializer.data
-
-    def get_student_count(self, obj):
-        return obj.classmembership_set.count()
@@ -1,3 +1,243 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import override_settings
+from django.utils import timezone
+
+from assignments.models import Assignment
+from server.testing import (
+    EndpointBudgetTestCase,
+    add_students,
+    seed_assignments,
+    seed_classroom,
+    seed_users,
+)
+
+
+class ClassEndpointBudgetTests(EndpointBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = seed_users("teacher", 1, "clst")[0]
+        cls.students = seed_users("student", 30, "clss")
+        cls.classroom = seed_classroom(
+            cls.teacher, cls.students, assignments=10, prefix="cls0"
+        )
+        cls.other_teacher = seed_users("teacher", 1, "clso")[0]
+        cls.other_class = seed_classroom(
+            cls.other_teacher, [], assignments=1, prefix="clsx"
+        )
+
+    def grow_classes(self):
+        # More classes, each with its own students, assignments and submissions
+        students = seed_users("student", 10, "clsg")
+        for index in range(60):
+            seed_classroom(
+                self.teacher,
+                students + [self.students[0]],
+                assignments=3,
+                prefix=f"g{index}",
+            )
+
+    def grow_class_content(self):
+        # More students, more assignments and more submissions in the class
+        students = seed_users("student", 60, "clsm")
+        add_students(self.classroom, students)
+        seed_assignments(self.classroom, self.students + students, 10)
+        seed_assignments(self.classroom, students, 10, submitted_ratio=0)
+
+    def test_list_classes_as_teacher(self):
+        self.assertFlatQueries(self.teacher, "/classes/", 1, grow=self.grow_classes)
+
+    def test_list_classes_as_student(self):
+        self.assertFlatQueries(self.students[0], "/classes/", 1, grow=self.grow_classes)
+
+    def test_class_detail_as_teacher(self):
+        self.assertFlatQueries(
+            self.teacher,
+            f"/classes/{self.classroom.id}/",
+            3,
+            grow=self.grow_class_content,
+        )
+
+    def test_class_detail_as_student(self):
+        self.assertFlatQueries(
+            self.students[0],
+            f"/classes/{self.classroom.id}/",
+            4,
+            grow=self.grow_class_content,
+        )
+
+    def test_class_detail_of_other_teacher(self):
+        self.assertWithinBudget(
+            self.teacher,
+            "get",
+            f"/classes/{self.other_class.id}/",
+            max_queries=2,
+            status_code=404,
+        )
+
+    def test_create_class(self):
+        self.assertWithinBudget(
+            self.teacher,
+            "post",
+            "/classes/create/",
+            max_queries=2,
+            status_code=201,
+            data={"name": "Physics", "subject": "Physics", "section": "B"},
+        )
+
+    def test_join_class(self):
+        student = seed_users("student", 1, "clsj")[0]
+        response, _ = self.assertWithinBudget(
+            student,
+            "post",
+            "/classes/join/",
+            max_queries=8,
+            data={"invite_code": self.other_class.invite_code},
+        )
+        self.assertEqual(response.data, {"status": "joined"})
+        self.other_class.refresh_from_db()
+        self.assertEqual(self.other_class.student_count, 1)
+
+
+@override_settings(
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+    RESPONSE_CACHE_TIMEOUT=300,
+)
+class ClassResponseCacheTests(EndpointBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = seed_users("teacher", 1, "clct")[0]
+        cls.students = seed_users("student", 3, "clcs")
+        cls.classroom = seed_classroom(
+            cls.teacher, cls.students, assignments=2, prefix="clc0", graded_ratio=0
+        )
+        cls.url = f"/classes/{cls.classroom.id}/"
+
+    def setUp(self):
+        cache.clear()
+        for user in [self.teacher, *self.students]:
+            self.request(user, "get", self.url)
+
+    def assertCached(self, user, cached=True):
+        response, query_count, _ = self.request(user, "get", self.url)
+        self.assertEqual(response.status_code, 200)
+        # Only the conditional GET validator query runs on a hit
+        if cached:
+            self.assertEqual(query_count, 1)
+        else:
+            self.assertGreater(query_count, 1)
+        return response
+
+    def test_repeated_class_detail_is_cached(self):
+        self.assertCached(self.teacher)
+        self.assertCached(self.students[0])
+
+    def test_grading_invalidates_teacher_and_student(self):
+        submission = self.students[0].submissions.first()
+        with self.captureOnCommitCallbacks(execute=True):
+            submission.set_score(9)
+
+        response = self.assertCached(self.teacher, cached=False)
+        self.assertEqual(response.data["assignments"][0]["graded_count"], 1)
+        self.assertCached(self.students[0], cached=False)
+        self.assertCached(self.students[1])
+
+    def test_new_assignment_invalidates_every_member(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Assignment.objects.create(
+                classroom=self.classroom,
+                name="Extra",
+                description="",
+                deadline=timezone.now() + timedelta(days=1),
+                task_file="seed/extra.pdf",
+                max_score=10,
+            )
+
+        for user in [self.teacher, *self.students]:
+            response = self.assertCached(user, cached=False)
+            self.assertEqual(len(response.data["assignments"]), 3)
+
+
+class ClassConditionalGetTests(EndpointBudgetTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = seed_users("teacher", 1, "clvt")[0]
+        cls.students = seed_users("student", 2, "clvs")
+        cls.classroom = seed_classroom(
+            cls.teacher, cls.students, assignments=2, prefix="clv0", graded_ratio=0
+        )
+        cls.url = f"/classes/{cls.classroom.id}/"
+
+    def client_get(self, user):
+        response, _, _ = self.request(user, "get", self.url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def revalidate(self, user, response, status_code):
+        """Repeat the request with the ETag of `response`."""
+        response, _ = self.assertWithinBudget(
+            user,
+            "get",
+            self.url,
+            # A 304 costs only the validator query
+            max_queries=1 if status_code == 304 else 4,
+            status_code=status_code,
+            HTTP_IF_NONE_MATCH=response["ETag"],
+        )
+        return response
+
+    def test_unchanged_class_is_not_modified(self):
+        response = self.client_get(self.teacher)
+        self.assertIn("Last-Modified", response)
+        not_modified = self.revalidate(self.teacher, response, 304)
+        self.assertEqual(not_modified["ETag"], response["ETag"])
+        self.assertEqual(not_modified.content, b"")
+
+    def test_if_modified_since(self):
+        response = self.client_get(self.teacher)
+        self.assertWithinBudget(
+            self.teacher,
+            "get",
+            self.url,
+            max_queries=1,
+            status_code=304,
+            HTTP_IF_MODIFIED_SINCE=response["Last-Modified"],
+        )
+
+    def test_validators_differ_per_user(self):
+        teacher_response = self.client_get(self.teacher)
+        student_response = self.client_get(self.students[0])
+        self.assertNotEqual(teacher_response["ETag"], student_response["ETag"])
+
+    def test_grading_changes_the_teacher_etag(self):
+        response = self.client_get(self.teacher)
+        self.students[0].submissions.first().set_score(9)
+        response = self.revalidate(self.teacher, response, 200)
+        self.assertEqual(response.data["assignments"][0]["graded_count"], 1)
+
+    def test_regrading_changes_only_the_student_etag(self):
+        submission = self.students[0].submissions.first()
+        submission.set_score(9)
+        teacher_response = self.client_get(self.teacher)
+        student_response = self.client_get(self.students[0])
+        other_response = self.client_get(self.students[1])
+
+        submission.set_score(7)
+
+        # Scores are not part of the teacher's class detail
+        self.revalidate(self.teacher, teacher_response, 304)
+        self.revalidate(self.students[0], student_response, 200)
+        self.revalidate(self.students[1], other_response, 304)
+
+    def test_join_changes_the_etag(self):
+        response = self.client_get(self.teacher)
+        student = seed_users("student", 1, "clvj")[0]
+        self.request(
+            student,
+            "post",
+            "/classes/join/",
+            data={"invite_code": self.classroom.invite_code},
+        )
+        response = self.revalidate(self.teacher, response, 200)
+        self.assertEqual(response.data["student_count"], 3)
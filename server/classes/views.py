@@ -9,7 +9,14 @@ from classes.serializers import (
 from accounts.permissions import IsTeacher, IsStudent
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import F, Prefetch
+from django.utils import timezone
+from assignments.models import Assignment
 
+from classes import response_cache
+from classes.conditional import ConditionalGetMixin, class_state
+from classes.pagination import ClassCursorPagination
 from classes.utils import generate_invite_code
 
 
@@ -18,22 +25,42 @@ class CreateClassView(generics.CreateAPIView):
     permission_classes = [permissions.IsAuthenticated, IsTeacher]
 
     def perform_create(self, serializer):
-        serializer.save(teacher=self.request.user, invite_code=generate_invite_code())
+        serializer.save(
+            teacher_id=self.request.user.id, invite_code=generate_invite_code()
+        )
 
 
-class ClassDetailView(generics.RetrieveAPIView):
+class ClassDetailView(ConditionalGetMixin, generics.RetrieveAPIView):
     serializer_class = ClassDetailSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         user = self.request.user
         if user.role == "teacher":
-            return Class.objects.filter(teacher=user)
-        return Class.objects.filter(classmembership__student=user)
+            queryset = Class.objects.filter(teacher_id=user.id)
+        else:
+            queryset = Class.objects.filter(classmembership__student_id=user.id)
+        return queryset.select_related("teacher").prefetch_related(
+            Prefetch(
+                "assignments", queryset=Assignment.objects.with_user_context(user)
+            )
+        )
 
     def get_object(self):
         return get_object_or_404(self.get_queryset(), pk=self.kwargs["pk"])
 
+    def get_state(self):
+        return class_state(self.request.user, self.kwargs["pk"])
+
+    def retrieve(self, request, *args, **kwargs):
+        data = response_cache.cached_response(
+            request,
+            "class-detail",
+            self.kwargs["pk"],
+            lambda: self.get_serializer(self.get_object()).data,
+        )
+        return Response(data)
+
 
 class JoinClassView(generics.CreateAPIView):
     serializer_class = JoinClassSerializer
@@ -42,16 +69,27 @@ class JoinClassView(generics.CreateAPIView):
     def post(self, request, *args, **kwargs):
         code = request.data["invite_code"]
         classroom = get_object_or_404(Class, invite_code=code)
-        ClassMembership.objects.get_or_create(student=request.user, classroom=classroom)
+        with transaction.atomic():
+            _, created = ClassMembership.objects.get_or_create(
+                student_id=request.user.id, classroom=classroom
+            )
+            if created:
+                Class.objects.filter(id=classroom.id).update(
+                    student_count=F("student_count") + 1, updated_at=timezone.now()
+                )
+                response_cache.class_changed(classroom.id)
         return Response({"status": "joined"})
 
 
 class ClassesView(generics.ListAPIView):
     serializer_class = ClassSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ClassCursorPagination
 
     def get_queryset(self):
         user = self.request.user
         if user.role == "teacher":
-            return Class.objects.filter(teacher=user)
-        return Class.objects.filter(classmembership__student=user)
+            queryset = Class.objects.filter(teacher_id=user.id)
+        else:
+            queryset = Class.objects.filter(classmembership__student_id=user.id)
+        return queryset.select_related("teacher")
@@ -93,9 +93,62 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # WAL lets requests read while the auto-check worker writes. Writers
+        # take the lock when their transaction starts and wait up to
+        # `timeout` seconds for it instead of failing with "database is locked"
+        "OPTIONS": {
+            "init_command": "PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;",
+            "transaction_mode": "IMMEDIATE",
+            "timeout": float(os.environ.get("SQLITE_BUSY_TIMEOUT", "20")),
+        },
+    }
+}
+
+
+# Messages of the grading worker and pipeline go to the console, at
+# LOG_LEVEL and above
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "assignments": {
+            "handlers": ["console"],
+            "level": os.environ.get("LOG_LEVEL", "INFO"),
+        },
+    },
+}
+
+
+# Cache
+# CACHE_BACKEND is "file" (shared by the processes of one host), "locmem"
+# (per process), "redis" or "memcached". CACHE_LOCATION is the directory or
+# server URL. The auto-check worker invalidates cached responses when it saves
+# scores, so it must share the web server's cache: avoid locmem when they run
+# as separate processes. Tests use locmem, see server.testing.
+CACHE_BACKENDS = {
+    "file": "django.core.cache.backends.filebased.FileBasedCache",
+    "locmem": "django.core.cache.backends.locmem.LocMemCache",
+    "redis": "django.core.cache.backends.redis.RedisCache",
+    "memcached": "django.core.cache.backends.memcached.PyMemcacheCache",
+}
+CACHE_BACKEND = os.environ.get("CACHE_BACKEND", "file")
+CACHES = {
+    "default": {
+        "BACKEND": CACHE_BACKENDS[CACHE_BACKEND],
+        "LOCATION": os.environ.get(
+            "CACHE_LOCATION",
+            os.path.join(BASE_DIR, "cache") if CACHE_BACKEND == "file" else "",
+        ),
+        "OPTIONS": {"MAX_ENTRIES": 10000} if CACHE_BACKEND in ("file", "locmem") else {},
     }
 }
 
+# Serialized class detail and assignment list responses are cached for this
+# many seconds, and invalidated when their data changes. 0 disables it.
+RESPONSE_CACHE_ALIAS = "default"
+RESPONSE_CACHE_TIMEOUT = int(os.environ.get("RESPONSE_CACHE_TIMEOUT", "300"))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -122,10 +175,24 @@ AUTH_USER_MODEL = "accounts.CustomUser"
 
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "rest_framework_simplejwt.authentication.JWTStatelessUserAuthentication",
     )
 }
 
+# Requests are authenticated from the access token's claims without loading
+# the user, so deactivating a user takes effect when their access token
+# expires; refreshing a token still checks the database.
+SIMPLE_JWT = {
+    "TOKEN_USER_CLASS": "accounts.authentication.ClaimsUser",
+}
+
+# Cursor pagination page sizes per listing; clients may ask for up to
+# MAX_PAGE_SIZE with ?page_size=
+CLASS_PAGE_SIZE = int(os.environ.get("CLASS_PAGE_SIZE", "50"))
+ASSIGNMENT_PAGE_SIZE = int(os.environ.get("ASSIGNMENT_PAGE_SIZE", "50"))
+SUBMISSION_PAGE_SIZE = int(os.environ.get("SUBMISSION_PAGE_SIZE", "100"))
+MAX_PAGE_SIZE = 500
+
 # Cors
 
 CORS_ALLOW_ALL_ORIGINS = True
@@ -161,6 +228,41 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+# Uploads are hashed while they are received, so that content-addressed
+# storage (assignments.storage) does not read them again
+FILE_UPLOAD_HANDLERS = [
+    "assignments.storage.HashingMemoryFileUploadHandler",
+    "assignments.storage.HashingTemporaryFileUploadHandler",
+]
+
+# Uploaded files are downloaded through signed URLs, see assignments.downloads.
+# FILE_DELIVERY is "django" (streamed by Django, with Range support),
+# "x-accel-redirect" (nginx serves FILE_ACCEL_REDIRECT_PREFIX + file name
+# from an internal location aliased to MEDIA_ROOT), "x-sendfile" (Apache or
+# lighttpd) or "storage" (redirect to the storage backend's URL, e.g. a
+# presigned object storage URL; with local storage the web server has to
+# serve MEDIA_ROOT at MEDIA_URL).
+FILE_DELIVERY = os.environ.get("FILE_DELIVERY", "django")
+FILE_ACCEL_REDIRECT_PREFIX = os.environ.get("FILE_ACCEL_REDIRECT_PREFIX", "/protected/")
+FILE_CACHE_MAX_AGE = int(os.environ.get("FILE_CACHE_MAX_AGE", str(365 * 24 * 60 * 60)))
+# Download URLs expire after this many seconds. They are issued for windows
+# of half this length, within which they do not change, so a URL is valid
+# for at least half of it. Responses embedding URLs get a new ETag with
+# every window.
+DOWNLOAD_URL_MAX_AGE = int(os.environ.get("DOWNLOAD_URL_MAX_AGE", str(24 * 60 * 60)))
+
+# Resumable chunked uploads, see assignments.uploads. Partial files are kept
+# under MEDIA_ROOT/UPLOAD_SESSION_DIR; sessions left unfinished for
+# UPLOAD_SESSION_EXPIRY_SECONDS are deleted when new ones are opened.
+UPLOAD_SESSION_DIR = "uploads"
+UPLOAD_SESSION_MAX_SIZE = int(
+    os.environ.get("UPLOAD_SESSION_MAX_SIZE", str(200 * 1024 * 1024))
+)
+UPLOAD_CHUNK_MAX_SIZE = int(os.environ.get("UPLOAD_CHUNK_MAX_SIZE", str(8 * 1024 * 1024)))
+UPLOAD_SESSION_EXPIRY_SECONDS = int(
+    os.environ.get("UPLOAD_SESSION_EXPIRY_SECONDS", str(24 * 60 * 60))
+)
+
 
 #OPENROUTER MODEL
 OPENROUTER_API_KEY = os.environ.get("OPENROUTER_API_KEY", "")
@@ -168,6 +270,22 @@ OPENROUTER_API_URL = os.environ.get(
     "OPENROUTER_API_URL", "https://openrouter.ai/api/v1/chat/completions"
 )
 OPENROUTER_MODEL = os.environ.get("OPENROUTER_MODEL", "openai/gpt-4o-mini")
+# Provider limits for this process; 0 disables a limit
+OPENROUTER_REQUESTS_PER_MINUTE = float(
+    os.environ.get("OPENROUTER_REQUESTS_PER_MINUTE", "60")
+)
+OPENROUTER_TOKENS_PER_MINUTE = float(
+    os.environ.get("OPENROUTER_TOKENS_PER_MINUTE", "200000")
+)
+# Concurrency adapts between the min and max based on 429/5xx responses
+OPENROUTER_INITIAL_CONCURRENCY = int(
+    os.environ.get("OPENROUTER_INITIAL_CONCURRENCY", "4")
+)
+OPENROUTER_MIN_CONCURRENCY = int(os.environ.get("OPENROUTER_MIN_CONCURRENCY", "1"))
+OPENROUTER_MAX_CONCURRENCY = int(os.environ.get("OPENROUTER_MAX_CONCURRENCY", "16"))
+OPENROUTER_MAX_RETRIES = int(os.environ.get("OPENROUTER_MAX_RETRIES", "4"))
+OPENROUTER_BACKOFF_BASE = float(os.environ.get("OPENROUTER_BACKOFF_BASE", "1"))
+OPENROUTER_BACKOFF_MAX = float(os.environ.get("OPENROUTER_BACKOFF_MAX", "60"))
 
 
 # OCR service
@@ -176,3 +294,76 @@ OCR_PREDICTION_URL = os.environ.get(
     "http://localhost:9000/2015-03-31/functions/function/invocations",
 )
 #OCR_PREDICTION_URL="https://zatxeedvkqbkgirog5ew4wshoe0neozq.lambda-url.ap-south-1.on.aws/"
+# OCR output is stored per image hash; least recently used entries are evicted
+OCR_CACHE_MAX_ENTRIES = int(os.environ.get("OCR_CACHE_MAX_ENTRIES", "5000"))
+OCR_CACHE_MAX_TEXT_LENGTH = int(os.environ.get("OCR_CACHE_MAX_TEXT_LENGTH", "100000"))
+
+
+# Auto-check worker
+AUTOCHECK_WORKER_CONCURRENCY = int(os.environ.get("AUTOCHECK_WORKER_CONCURRENCY", "4"))
+AUTOCHECK_WORKER_POLL_INTERVAL = float(
+    os.environ.get("AUTOCHECK_WORKER_POLL_INTERVAL", "2")
+)
+# Running workers renew the lease of their tasks every third of it; tasks
+# whose lease ran out (the worker died) are requeued
+AUTOCHECK_TASK_LEASE_SECONDS = int(os.environ.get("AUTOCHECK_TASK_LEASE_SECONDS", "600"))
+AUTOCHECK_TASK_MAX_ATTEMPTS = int(os.environ.get("AUTOCHECK_TASK_MAX_ATTEMPTS", "3"))
+# Grade up to this many submissions of an assignment per OpenRouter request,
+# sending the task and solution once. 1 grades every submission on its own.
+AUTOCHECK_BATCH_SIZE = int(os.environ.get("AUTOCHECK_BATCH_SIZE", "1"))
+# Upper bound on the memory a worker spends on encoded submission payloads,
+# counted at their peak while being encoded
+AUTOCHECK_MAX_IN_FLIGHT_BYTES = int(
+    os.environ.get("AUTOCHECK_MAX_IN_FLIGHT_BYTES", str(64 * 1024 * 1024))
+)
+# Scores are written in batches of up to this size, at least this often
+AUTOCHECK_SCORE_FLUSH_SIZE = int(os.environ.get("AUTOCHECK_SCORE_FLUSH_SIZE", "50"))
+AUTOCHECK_SCORE_FLUSH_INTERVAL = float(
+    os.environ.get("AUTOCHECK_SCORE_FLUSH_INTERVAL", "1")
+)
+
+
+# Outbound HTTP for grading (OpenRouter and OCR). Connections are kept alive
+# and shared by all grading threads of a process.
+GRADING_HTTP_POOL_CONNECTIONS = int(os.environ.get("GRADING_HTTP_POOL_CONNECTIONS", "4"))
+GRADING_HTTP_POOL_MAXSIZE = int(
+    os.environ.get("GRADING_HTTP_POOL_MAXSIZE", str(AUTOCHECK_WORKER_CONCURRENCY))
+)
+GRADING_HTTP_POOL_BLOCK = os.environ.get("GRADING_HTTP_POOL_BLOCK", "") == "1"
+GRADING_HTTP_CONNECT_TIMEOUT = float(os.environ.get("GRADING_HTTP_CONNECT_TIMEOUT", "5"))
+GRADING_HTTP_READ_TIMEOUT = float(os.environ.get("GRADING_HTTP_READ_TIMEOUT", "120"))
+# Per-host overrides, e.g. {"openrouter.ai": 8}
+GRADING_HTTP_HOST_POOL_LIMITS = {}
+# Per-host (connect, read) timeouts, e.g. {"localhost:9000": (2, 30)}
+GRADING_HTTP_HOST_TIMEOUTS = {}
+
+
+# Cache of the encoded task and solution prompt parts, shared by all
+# submissions of an assignment. Set GRADING_REFERENCE_CACHE_ALIAS to a CACHES
+# alias to also share the parts between worker processes.
+GRADING_REFERENCE_CACHE_MAX_BYTES = int(
+    os.environ.get("GRADING_REFERENCE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))
+)
+GRADING_REFERENCE_CACHE_ALIAS = os.environ.get("GRADING_REFERENCE_CACHE_ALIAS", "")
+GRADING_REFERENCE_CACHE_TIMEOUT = int(
+    os.environ.get("GRADING_REFERENCE_CACHE_TIMEOUT", str(24 * 60 * 60))
+)
+
+# Images are downsized and re-encoded before being sent to OCR and the model.
+# Normalized copies are stored under MEDIA_ROOT/GRADING_IMAGE_DERIVATIVES_DIR,
+# one directory per source hash, deleted with the source upload.
+GRADING_IMAGE_MAX_DIMENSION = int(os.environ.get("GRADING_IMAGE_MAX_DIMENSION", "2048"))
+GRADING_IMAGE_FORMAT = os.environ.get("GRADING_IMAGE_FORMAT", "JPEG")
+GRADING_IMAGE_QUALITY = int(os.environ.get("GRADING_IMAGE_QUALITY", "85"))
+GRADING_OCR_IMAGE_FORMAT = os.environ.get("GRADING_OCR_IMAGE_FORMAT", "PNG")
+GRADING_IMAGE_DERIVATIVES_DIR = "derivatives"
+
+# Default prompt size limit per auto-check request, overridable per assignment.
+# Large extracted texts are truncated to fit; prompts that still do not fit
+# are flagged for manual grading without calling the model.
+GRADING_PROMPT_TOKEN_BUDGET = int(os.environ.get("GRADING_PROMPT_TOKEN_BUDGET", "100000"))
+GRADING_CHARS_PER_TOKEN = 4
+GRADING_MIN_TRUNCATED_PART_TOKENS = 500
+
+# Number of file hashes remembered by the grading result cache
+GRADING_CACHE_MAX_HASHES = int(os.environ.get("GRADING_CACHE_MAX_HASHES", "10000"))
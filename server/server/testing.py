@@ -0,0 +1,254 @@
+"""
+Helpers shared by the tests of every app: bulk seeding of classes,
+assignments and submissions, assertions on the number of queries and the
+time an API call takes, and test case classes that use a memory cache.
+"""
+
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+
+from django import test
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import F
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient, APITestCase
+
+from assignments.models import Assignment, Submission
+from classes.models import Class, ClassMembership
+from classes.utils import generate_invite_code
+
+User = get_user_model()
+
+# Generous enough for a loaded CI machine; a regression that makes a request
+# scale with the number of rows blows through it at the larger seed size
+LATENCY_BUDGET_MS = float(os.environ.get("ENDPOINT_LATENCY_BUDGET_MS", "300"))
+
+# Reads are timed a few times and the fastest run is kept, which filters out
+# scheduler noise without hiding a slow query
+LATENCY_SAMPLES = 3
+
+
+def seed_users(role: str, count: int, prefix: str) -> list:
+    return User.objects.bulk_create(
+        [
+            User(
+                email=f"{prefix}{index}@example.com",
+                name=f"{role.title()} {prefix}{index}",
+                role=role,
+                password="!",
+            )
+            for index in range(count)
+        ]
+    )
+
+
+def seed_classroom(
+    teacher,
+    students: list,
+    assignments: int,
+    prefix: str,
+    submitted_ratio: float = 1.0,
+    graded_ratio: float = 0.5,
+) -> Class:
+    """Create a class of `students` and seed it with `seed_assignments`."""
+    classroom = Class.objects.create(
+        name=f"Class {prefix}",
+        subject="Mathematics",
+        section=prefix,
+        teacher=teacher,
+        invite_code=generate_invite_code(),
+    )
+    add_students(classroom, students)
+    seed_assignments(classroom, students, assignments, submitted_ratio, graded_ratio)
+    return classroom
+
+
+def add_students(classroom: Class, students: list) -> None:
+    ClassMembership.objects.bulk_create(
+        [ClassMembership(student=student, classroom=classroom) for student in students]
+    )
+    Class.objects.filter(id=classroom.id).update(
+        student_count=F("student_count") + len(students)
+    )
+
+
+def seed_assignments(
+    classroom: Class,
+    students: list,
+    count: int,
+    submitted_ratio: float = 1.0,
+    graded_ratio: float = 0.5,
+) -> list[Assignment]:
+    """
+    Add `count` assignments to a class. The first `submitted_ratio` of
+    `students` submit each of them and the first `graded_ratio` of those
+    submissions are scored. Rows are bulk inserted and the counter columns
+    are filled in as the views would have maintained them.
+    """
+    submitters = students[: int(len(students) * submitted_ratio)]
+    graded = int(len(submitters) * graded_ratio)
+    first = classroom.assignments.count()
+    assignments = Assignment.objects.bulk_create(
+        [
+            Assignment(
+                classroom=classroom,
+                name=f"Assignment {index}",
+                description="Solve the exercises",
+                deadline=timezone.now() + timedelta(days=7),
+                task_file=f"seed/{classroom.id}/task_{index}.pdf",
+                solution_file=f"seed/{classroom.id}/solution_{index}.pdf",
+                max_score=10,
+                submission_count=len(submitters),
+                graded_count=graded,
+            )
+            for index in range(first, first + count)
+        ]
+    )
+    Submission.objects.bulk_create(
+        [
+            Submission(
+                assignment=assignment,
+                student=student,
+                submitted_file=f"seed/{classroom.id}/{assignment.id}_{student.id}.pdf",
+                is_hand_written=False,
+                score=7.5 if position < graded else None,
+            )
+            for assignment in assignments
+            for position, student in enumerate(submitters)
+        ]
+    )
+    return assignments
+
+
+# Tests never share the file cache of a running server, nor leave one behind
+TEST_CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class SimpleTestCase(test.SimpleTestCase):
+    """SimpleTestCase using a memory cache, see TEST_CACHES."""
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TestCase(test.TestCase):
+    """TestCase using a memory cache, see TEST_CACHES."""
+
+
+def use_temporary_media_root(test_case) -> None:
+    """Store the files saved during a test in a MEDIA_ROOT removed after it."""
+    media_root = tempfile.mkdtemp()
+    test_case.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+    media_override = override_settings(MEDIA_ROOT=media_root)
+    media_override.enable()
+    test_case.addCleanup(media_override.disable)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class EndpointBudgetTestCase(APITestCase):
+    """
+    Base class for tests that hold an endpoint to a maximum number of queries
+    and a latency budget. Uploaded files go to a temporary MEDIA_ROOT,
+    passwords use a fast hasher so that hashing does not dominate timings,
+    the cache is in memory and the response cache is off.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls._media_root = tempfile.mkdtemp()
+        cls._settings_override = override_settings(
+            MEDIA_ROOT=cls._media_root,
+            PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"],
+            # Budgets are for building responses, not for serving them cached
+            RESPONSE_CACHE_TIMEOUT=0,
+        )
+        cls._settings_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls._settings_override.disable()
+        shutil.rmtree(cls._media_root, ignore_errors=True)
+
+    def request(self, user, method: str, url: str, **kwargs):
+        """Return (response, query count, elapsed milliseconds) of one call."""
+        client = APIClient()
+        if user is not None:
+            client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = getattr(client, method)(url, **kwargs)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+        return response, len(queries), elapsed_ms
+
+    def assertWithinBudget(
+        self,
+        user,
+        method: str,
+        url: str,
+        max_queries: int,
+        status_code: int = 200,
+        max_ms: float | None = None,
+        samples: int = 1,
+        **kwargs,
+    ):
+        """
+        Call the endpoint `samples` times and check the status code, the
+        query count of every call and the fastest call's latency. Returns the
+        last response and its query count.
+        """
+        max_ms = LATENCY_BUDGET_MS if max_ms is None else max_ms
+        timings = []
+        for _ in range(samples):
+            response, query_count, elapsed_ms = self.request(
+                user, method, url, **kwargs
+            )
+            # Streamed responses have no content to show
+            body = getattr(response, "data", None) or getattr(response, "content", "")
+            self.assertEqual(
+                response.status_code,
+                status_code,
+                f"{method.upper()} {url} returned {response.status_code}: {body}",
+            )
+            self.assertLessEqual(
+                query_count,
+                max_queries,
+                f"{method.upper()} {url} ran {query_count} queries, "
+                f"budget is {max_queries}",
+            )
+            timings.append(elapsed_ms)
+        self.assertLessEqual(
+            min(timings),
+            max_ms,
+            f"{method.upper()} {url} took {min(timings):.1f}ms, budget is {max_ms}ms",
+        )
+        return response, query_count
+
+    def assertFlatQueries(
+        self, user, url: str, max_queries: int, grow, status_code: int = 200
+    ):
+        """
+        Check a read endpoint before and after `grow()` adds rows to what it
+        returns: the query count must not change and both calls must stay
+        within budget.
+        """
+        _, before = self.assertWithinBudget(
+            user, "get", url, max_queries, status_code, samples=LATENCY_SAMPLES
+        )
+        grow()
+        _, after = self.assertWithinBudget(
+            user, "get", url, max_queries, status_code, samples=LATENCY_SAMPLES
+        )
+        self.assertEqual(
+            before,
+            after,
+            f"GET {url} ran {before} queries before and {after} after adding rows",
+        )